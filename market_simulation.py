@@ -0,0 +1,227 @@
+﻿# --- START OF FILE market_simulation.py ---
+"""
+Offline market simulation for tuning the market governor before rollout.
+
+Loads users, investments, wallets and site_settings from a Firebase JSON export and
+replays many automated_market_balance volatility ticks together with synthetic
+invest/sell flows, across Monte Carlo paths split over a process pool. Nothing is
+written to the database.
+
+    python market_simulation.py firebase_export.json --ticks 2000 --paths 64
+    python market_simulation.py firebase_export.json --settings candidate.json --json result.json
+
+--settings takes a JSON file with `market_governor` and/or `investment_settings`
+objects that override the exported ones key by key.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+# المحاكاة لا تتصل بـ Firebase: استيراد الحزمة يهيئ التخزين، فنجعله محلياً في الذاكرة
+os.environ.setdefault('STORAGE_BACKEND', 'local')
+
+import numpy as np
+from project.market_volatility import volatility_step
+
+PERCENTILES = (5, 25, 50, 75, 95)
+
+
+def load_snapshot(export_path, settings_path=None):
+    with open(export_path, encoding='utf-8') as f:
+        export = json.load(f)
+    site_settings = export.get('site_settings') or {}
+    settings = {
+        'market_governor': dict(site_settings.get('market_governor') or {}),
+        'investment_settings': dict(site_settings.get('investment_settings') or {}),
+    }
+    if settings_path:
+        with open(settings_path, encoding='utf-8') as f:
+            overrides = json.load(f)
+        for key in settings:
+            overrides_for_key = overrides.get(key) or {}
+            if key == 'market_governor' and 'market_volatility' in overrides_for_key:
+                merged = dict(settings[key].get('market_volatility') or {})
+                merged.update(overrides_for_key['market_volatility'])
+                overrides_for_key = dict(overrides_for_key, market_volatility=merged)
+            settings[key].update(overrides_for_key)
+
+    crawlers = sorted((export.get('users') or {}).items())
+    crawler_index = {name: i for i, (name, _) in enumerate(crawlers)}
+    investors = sorted(set(export.get('wallets') or {}) | set(export.get('investments') or {}))
+    wallets = export.get('wallets') or {}
+
+    units = np.zeros((len(investors), len(crawlers)))
+    cost = np.zeros((len(investors), len(crawlers)))
+    personal = np.ones((len(investors), len(crawlers)))
+    for u, uid in enumerate(investors):
+        for crawler_name, investment in ((export.get('investments') or {}).get(uid) or {}).items():
+            c = crawler_index.get(crawler_name)
+            if c is None:
+                continue
+            personal[u, c] = float((investment or {}).get('personal_multiplier', 1.0))
+            for lot in ((investment or {}).get('lots') or {}).values():
+                # القيمة = sp × (النقاط الحالية / نقاط الشراء) × المضاعفات، فنخزن sp / نقاط الشراء
+                units[u, c] += float(lot.get('sp', 0)) / float(max(1, lot.get('p', 1)))
+                cost[u, c] += float(lot.get('original_sp', lot.get('sp', 0)))
+
+    return {
+        'settings': settings,
+        'crawler_names': [name for name, _ in crawlers],
+        'points': np.array([float(max(1, (data or {}).get('points', 1))) for _, data in crawlers]),
+        'multipliers': np.array([float((data or {}).get('stock_multiplier', 1.0)) for _, data in crawlers]),
+        'wallets': np.array([float((wallets.get(uid) or {}).get('sp', 0)) for uid in investors]),
+        'units': units, 'cost': cost, 'personal': personal,
+    }
+
+
+def _instant_bonus(amounts, governor, rng):
+    """Per-trade bonus or loss factor drawn like invest_in_crawler's instant bonus."""
+    factor = np.ones_like(amounts)
+    if not governor.get('instant_bonus_enabled'):
+        return factor
+    win_chance = float(governor.get('instant_win_chance', 0))
+    loss_chance = float(governor.get('instant_loss_chance', 0))
+    roll = rng.uniform(0, 100, amounts.shape)
+    win = roll < win_chance
+    loss = ~win & (roll < win_chance + loss_chance)
+    factor = np.where(win, 1 + rng.uniform(1.0, float(governor.get('instant_win_max_percent', 10)), amounts.shape) / 100.0, factor)
+    factor = np.where(loss, 1 - rng.uniform(1.0, float(governor.get('instant_loss_max_percent', 5)), amounts.shape) / 100.0, factor)
+    return factor
+
+
+def simulate_paths(snapshot, n_paths, ticks, flows, seed):
+    """
+    Runs `n_paths` independent paths at once; every array carries the path as its first axis.
+
+    Each tick applies one volatility step to all multipliers, then every investor may
+    invest `invest_fraction` of their wallet in a random crawler (`invest_rate`) and may
+    sell one random position outright (`sell_rate`), paying sell_tax_percent on its
+    profit and sell_fee_sp. Positions are held per crawler, so tax is charged on the
+    position's net profit rather than lot by lot as sell_lot does.
+    """
+    rng = np.random.default_rng(seed)
+    governor = snapshot['settings']['market_governor']
+    volatility = dict(governor.get('market_volatility') or {})
+    investment = snapshot['settings']['investment_settings']
+    tax_rate = float(investment.get('sell_tax_percent', 0.0)) / 100.0
+    sell_fee = float(investment.get('sell_fee_sp', 0.0))
+    points = snapshot['points']
+
+    multipliers = np.repeat(snapshot['multipliers'][None, :], n_paths, axis=0)
+    wallets = np.repeat(snapshot['wallets'][None, :], n_paths, axis=0)
+    units = np.repeat(snapshot['units'][None, :, :], n_paths, axis=0)
+    cost = np.repeat(snapshot['cost'][None, :, :], n_paths, axis=0)
+    personal = snapshot['personal'][None, :, :]
+    n_investors, n_crawlers = snapshot['units'].shape
+    paths = np.arange(n_paths)[:, None]
+    investor_ids = np.arange(n_investors)[None, :]
+
+    def holdings():
+        return (units * points[None, None, :] * multipliers[:, None, :] * personal).sum(axis=2)
+
+    start_equity = wallets + holdings()
+    taxes = np.zeros(n_paths)
+
+    for _ in range(ticks):
+        if volatility.get('enabled', True):
+            multipliers = volatility_step(multipliers, volatility, rng)
+        if n_investors == 0 or n_crawlers == 0:
+            continue
+
+        # شراء
+        buying = rng.uniform(size=(n_paths, n_investors)) < flows['invest_rate']
+        amounts = np.where(buying, wallets * flows['invest_fraction'], 0.0)
+        targets = rng.integers(n_crawlers, size=(n_paths, n_investors))
+        credited = amounts * _instant_bonus(amounts, governor, rng)
+        wallets -= amounts
+        np.add.at(units, (paths, investor_ids, targets), credited / points[targets])
+        np.add.at(cost, (paths, investor_ids, targets), amounts)
+
+        # بيع مركز كامل
+        selling = rng.uniform(size=(n_paths, n_investors)) < flows['sell_rate']
+        picks = rng.integers(n_crawlers, size=(n_paths, n_investors))
+        held = units[paths, investor_ids, picks]
+        selling &= held > 0
+        value = held * points[picks] * multipliers[paths, picks] * personal[0, investor_ids, picks]
+        tax = np.maximum(0.0, (value - cost[paths, investor_ids, picks]) * tax_rate)
+        proceeds = np.where(selling, value - tax - sell_fee, 0.0)
+        taxes += np.where(selling, tax + sell_fee, 0.0).sum(axis=1)
+        wallets += proceeds
+        units[paths, investor_ids, picks] = np.where(selling, 0.0, held)
+        cost[paths, investor_ids, picks] = np.where(selling, 0.0, cost[paths, investor_ids, picks])
+
+    end_holdings = holdings()
+    return {
+        'wallet_supply': wallets.sum(axis=1),
+        'total_supply': (wallets + end_holdings).sum(axis=1),
+        'taxes_collected': taxes,
+        'multiplier_drift': (multipliers / np.maximum(snapshot['multipliers'][None, :], 1e-9)).mean(axis=1),
+        'at_floor_share': (multipliers <= 0.2000001).mean(axis=1),
+        'investor_pnl': (wallets + end_holdings - start_equity).ravel(),
+    }
+
+
+def _run_chunk(args):
+    snapshot, n_paths, ticks, flows, seed = args
+    return simulate_paths(snapshot, n_paths, ticks, flows, seed)
+
+
+def run_simulation(snapshot, paths, ticks, flows, workers=None, seed=None):
+    workers = max(1, min(workers or os.cpu_count() or 1, paths))
+    chunk_sizes = [len(chunk) for chunk in np.array_split(np.arange(paths), workers) if len(chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+    jobs = [(snapshot, size, ticks, flows, child) for size, child in zip(chunk_sizes, seeds)]
+    if len(jobs) == 1:
+        results = [_run_chunk(jobs[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=len(jobs)) as pool:
+            results = list(pool.map(_run_chunk, jobs))
+    return {key: np.concatenate([result[key] for result in results]) for key in results[0]}
+
+
+def summarize(results, initial_supply):
+    summary = {'initial_total_supply': round(float(initial_supply), 2)}
+    for key, values in results.items():
+        summary[key] = {f'p{p}': round(float(v), 4) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))}
+        summary[key]['mean'] = round(float(values.mean()), 4)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline Monte Carlo simulation of the market governor settings.")
+    parser.add_argument('export', help="Firebase JSON export with users, investments, wallets and site_settings")
+    parser.add_argument('--settings', help="JSON file overriding market_governor / investment_settings")
+    parser.add_argument('--ticks', type=int, default=1000)
+    parser.add_argument('--paths', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=None, help="processes (default: all cores)")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--invest-rate', type=float, default=0.01, help="chance per investor per tick to invest")
+    parser.add_argument('--invest-fraction', type=float, default=0.1, help="share of the wallet invested per trade")
+    parser.add_argument('--sell-rate', type=float, default=0.01, help="chance per investor per tick to sell a position")
+    parser.add_argument('--json', dest='json_out', help="also write the summary to this file")
+    args = parser.parse_args(argv)
+
+    snapshot = load_snapshot(args.export, args.settings)
+    flows = {'invest_rate': args.invest_rate, 'invest_fraction': args.invest_fraction, 'sell_rate': args.sell_rate}
+    print(f">> Loaded {len(snapshot['crawler_names'])} crawlers and {len(snapshot['wallets'])} investors.")
+
+    started = time.time()
+    results = run_simulation(snapshot, args.paths, args.ticks, flows, args.workers, args.seed)
+    initial_supply = snapshot['wallets'].sum() + (snapshot['units'] * snapshot['points'][None, :] * snapshot['multipliers'][None, :] * snapshot['personal']).sum()
+    summary = summarize(results, initial_supply)
+    print(f">> Simulated {args.paths} paths × {args.ticks} ticks in {time.time() - started:.1f}s.")
+    print(json.dumps(summary, indent=2, ensure_ascii=False))
+
+    if args.json_out:
+        with open(args.json_out, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+    return summary
+
+
+if __name__ == '__main__':
+    main()
+
+# --- END OF FILE market_simulation.py ---
@@ -4,26 +4,28 @@ import os
 import sys
 from flask import Flask, session
 from dotenv import load_dotenv
-import firebase_admin
-from firebase_admin import credentials, auth, db
+from firebase_admin import auth
 from flask_apscheduler import APScheduler
 import random
 import time
+from datetime import datetime
 from . import scheduled_tasks
+from . import storage
+from .live_cache import site_settings, get_settings
+from .crawler_roster import roster
+from .write_batch import discard_request_batch
+from .side_effects import side_effects
+from .scheduler_lease import coordinator
+from .job_telemetry import telemetry
+from .leaderboards import richest, RICHEST_PATH
 
 load_dotenv()
 
+# STORAGE_BACKEND=local يشغل التطبيق على قاعدة بيانات محلية بدون Firebase (للتجارب واختبارات الحمل)
 try:
-    if not firebase_admin._apps:
-        SERVICE_ACCOUNT_FILE = os.getenv('FIREBASE_SERVICE_ACCOUNT')
-        FIREBASE_DATABASE_URL = os.getenv('FIREBASE_DATABASE_URL')
-        if not SERVICE_ACCOUNT_FILE or not os.path.exists(SERVICE_ACCOUNT_FILE):
-            raise ValueError(f"ملف مفتاح الخدمة '{SERVICE_ACCOUNT_FILE}' غير موجود أو المسار خاطئ.")
-        creds = credentials.Certificate(SERVICE_ACCOUNT_FILE)
-        firebase_admin.initialize_app(creds, {'databaseURL': FIREBASE_DATABASE_URL})
-        print(">> Firebase Admin Initialized Successfully!")
+    storage.initialize()
 except Exception as e:
-    print(f"!!! CRITICAL: Firebase Admin initialization failed: {e}", file=sys.stderr)
+    print(f"!!! CRITICAL: Storage backend initialization failed: {e}", file=sys.stderr)
     sys.exit(1)
 
 scheduler = APScheduler()
@@ -36,16 +38,24 @@ def create_app():
         SCHEDULER_API_ENABLED=True 
     )
     
+    # مرآة محلية لإعدادات الموقع بدلاً من قراءتها من Firebase في كل طلب
+    site_settings.start()
+    roster.start()
+    side_effects.start(app.instance_path)
+    richest.start()
+
+    # كل عامل يسجل نفس المهام لكن يبدأ متوقفاً؛ المنسق يشغلها في العامل الحاصل على القيادة فقط
     if not scheduler.running:
         scheduler.init_app(app)
-        scheduler.start()
+        scheduler.start(paused=True)
+        telemetry.attach(scheduler)
     
     # --- بداية التعديل: جدولة المهام عند بدء تشغيل التطبيق ---
     with app.app_context():
         # جدولة المهام الدائمة
-        if not scheduler.get_job('manage_contest_job'):
-            scheduler.add_job(id='manage_contest_job', func=scheduled_tasks.manage_popularity_contest, trigger='interval', minutes=1, args=[app])
-            print(">> Popularity Contest management job scheduled.")
+        # المنافسة تُدار بمهمة لمرة واحدة: تشغيل قريب للاستعادة، ثم تعيد جدولة نفسها عند نهاية المنافسة
+        if not scheduler.get_job(scheduled_tasks.CONTEST_JOB_ID):
+            scheduled_tasks.schedule_contest_job(app)
 
         if not scheduler.get_job('clean_notifications_job'):
             scheduler.add_job(id='clean_notifications_job', func=scheduled_tasks.clean_old_notifications, trigger='interval', minutes=5, args=[app])
@@ -55,29 +65,33 @@ def create_app():
             scheduler.add_job(id='clean_nudges_job', func=scheduled_tasks.clean_old_nudges, trigger='interval', minutes=1, args=[app])
             print(">> Nudges Cleaner job scheduled.")
 
+        if not scheduler.get_job('rollup_logs_job'):
+            scheduler.add_job(id='rollup_logs_job', func=scheduled_tasks.rollup_old_logs, trigger='interval', hours=1, args=[app])
+            print(">> Log Retention & Rollup job scheduled.")
+
+        if not scheduler.get_job('fold_counters_job'):
+            scheduler.add_job(id='fold_counters_job', func=scheduled_tasks.fold_counter_shards, trigger='interval', seconds=5, args=[app])
+            print(">> Sharded counters fold job scheduled.")
+
+        # دمج دفعات الاستثمار اختياري: المهمة تعمل كل ساعة وتخرج فوراً إن لم يكن مفعلاً في الإعدادات
+        if not scheduler.get_job('compact_lots_job'):
+            scheduler.add_job(id='compact_lots_job', func=scheduled_tasks.compact_investment_lots, trigger='interval', hours=1, args=[app])
+            print(">> Investment lot compaction job scheduled.")
+
+        # لوحة الأغنى تُحدث تدريجياً مع كل تغيير في المحافظ؛ إعادة البناء الدورية تلتقط تغير قيمة الاستثمارات
+        if not scheduler.get_job('rebuild_richest_job'):
+            first_run = {} if storage.db.reference(RICHEST_PATH, memoize=False).get(shallow=True) else {'next_run_time': datetime.now()}
+            scheduler.add_job(id='rebuild_richest_job', func=scheduled_tasks.rebuild_richest_leaderboard, trigger='interval', hours=1, args=[app], **first_run)
+            print(">> Richest leaderboard rebuild job scheduled.")
+
         # جدولة حاكم السوق الآلي (SAM) بناءً على الإعدادات المحفوظة
-        governor_settings = db.reference('site_settings/market_governor').get() or {}
-        if governor_settings.get('enabled', False):
-            hours = governor_settings.get('interval_hours', 0)
-            minutes = governor_settings.get('interval_minutes', 10)
-            seconds = governor_settings.get('interval_seconds', 0)
-            total_seconds = (hours * 3600) + (minutes * 60) + seconds
-            
-            # التأكد من أن القيمة لا تقل عن 10 ثواني
-            if total_seconds < 10:
-                total_seconds = 600 # قيمة افتراضية آمنة (10 دقائق)
-
-            if not scheduler.get_job('market_justice_job'):
-                scheduler.add_job(
-                    id='market_justice_job',
-                    func=scheduled_tasks.automated_market_balance,
-                    trigger='interval',
-                    seconds=total_seconds,
-                    args=[app]
-                )
-                print(f">> Automated Market Justice System (SAM) job scheduled from startup to run every {total_seconds} seconds.")
-        else:
-            print(">> Automated Market Justice System (SAM) is disabled in settings. Job not scheduled.")
+        if not scheduler.get_job(scheduled_tasks.MARKET_JOB_ID):
+            scheduled_tasks.sync_market_job(app)
+
+    # إعادة الجدولة التي تُحفظ من عامل واحد تصل لكل العمال عبر مراقبة الإعدادات
+    coordinator.watch('market_governor', lambda: scheduled_tasks.sync_market_job(app))
+    coordinator.watch('contest_settings', lambda: scheduled_tasks.schedule_contest_job(app))
+    coordinator.start(scheduler, app.instance_path)
     # --- نهاية التعديل ---
 
 
@@ -90,6 +104,8 @@ def create_app():
     app.register_blueprint(stock_prediction_api.bp, url_prefix='/api/stock_game')
     app.register_blueprint(rps_pvp_api.bp, url_prefix='/api/rps_pvp')
 
+    app.teardown_request(discard_request_batch)
+
     @app.after_request
     def apply_coop_header(response):
         response.headers['Cross-Origin-Opener-Policy'] = 'same-origin-allow-popups'
@@ -110,7 +126,7 @@ def create_app():
         
         context_data = {'firebase_config': firebase_config, 'firebase_token': ""}
         uid_from_session = session.get('user_id')
-        if uid_from_session:
+        if uid_from_session and storage.uses_firebase():
             try:
                 context_data['firebase_token'] = auth.create_custom_token(uid_from_session).decode('utf-8')
             except Exception as e:
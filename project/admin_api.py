@@ -3,10 +3,21 @@ import time
 import sys
 import os
 import io
-from flask import Blueprint, request, jsonify, session, current_app
-from firebase_admin import db, auth
+import hmac
+from flask import Blueprint, request, jsonify, session, current_app, Response
+from firebase_admin import auth
+from .storage import db
 from .utils import admin_required
 from . import scheduled_tasks, scheduler 
+from .live_cache import site_settings, get_settings
+from .crawler_roster import roster
+from . import wallet_service
+from .side_effects import side_effects
+from .job_telemetry import telemetry
+from .scheduler_lease import coordinator
+from .portfolio import portfolio_cache
+from .leaderboards import richest
+from .valuation import lot_arrays, value_positions, reset_profit_multipliers, value_crawler, value_user
 from apscheduler.triggers.interval import IntervalTrigger
 
 from google.oauth2 import service_account
@@ -68,10 +79,11 @@ def adjust_points_percent():
         new_points = max(0, current_points + change_amount)
 
         user_ref.update({'points': new_points})
-        db.reference(f'points_history/{username}').push({'points': new_points, 'timestamp': int(time.time())})
+        roster.apply(f'{username}/points', new_points)
+        side_effects.push(f'points_history/{username}', {'points': new_points, 'timestamp': int(time.time())})
 
         log_text = f"الأدمن '{session.get('name')}' قام بـ{'رفع' if direction == 'increase' else 'خفض'} نقاط '{username}' بنسبة {percent}%."
-        db.reference('activity_log').push({'type': 'admin_edit', 'text': log_text, 'timestamp': int(time.time())})
+        side_effects.push('activity_log', {'type': 'admin_edit', 'text': log_text, 'timestamp': int(time.time())})
         
         return jsonify(success=True)
 
@@ -123,8 +135,9 @@ def add_user():
         if 'likes' not in user_data: user_data['likes'] = 0
 
         ref_users.child(name).set(user_data)
+        roster.apply(name, user_data)
         
-        db.reference(f'points_history/{name}').push({'points': points, 'timestamp': int(time.time())})
+        side_effects.push(f'points_history/{name}', {'points': points, 'timestamp': int(time.time())})
         return jsonify(success=True)
         
     except (ValueError, TypeError):
@@ -148,7 +161,7 @@ def add_candidate():
     name = request.form.get('name', '').strip()
     if not name:
         return jsonify(success=False, message="اسم المرشح مطلوب."), 400
-    if db.reference(f'users/{name}').get():
+    if roster.exists(name):
         return jsonify(success=False, message="هذا الاسم موجود بالفعل كزاحف."), 409
     if db.reference(f'candidates/{name}').get():
         return jsonify(success=False, message="هذا الاسم موجود بالفعل في قائمة المرشحين."), 409
@@ -182,8 +195,8 @@ def manage_user(user_id, action):
     if not user_ref.get(): return jsonify(success=False, message="المستخدم غير موجود."), 404
     try:
         if action == 'approve': auth.update_user(user_id, disabled=False); user_ref.update({'status': 'approved'}); return jsonify(success=True)
-        elif action == 'reject': auth.delete_user(user_id); user_ref.delete(); return jsonify(success=True)
-    except auth.UserNotFoundError: user_ref.delete(); return jsonify(success=True)
+        elif action == 'reject': auth.delete_user(user_id); user_ref.delete(); richest.touch(user_id); return jsonify(success=True)
+    except auth.UserNotFoundError: user_ref.delete(); richest.touch(user_id); return jsonify(success=True)
     except Exception as e: return jsonify(success=False, message=str(e)), 500
 
 @bp.route('/candidate/approve', methods=['POST'])
@@ -237,7 +250,7 @@ def delete_from_honor_roll(item_id):
 @admin_required
 def send_user_message():
     user_id = request.form.get('user_id'); message = request.form.get('message')
-    if all([user_id, message]): db.reference(f'user_messages/{user_id}').push({'text': message, 'timestamp': int(time.time())})
+    if all([user_id, message]): side_effects.push(f'user_messages/{user_id}', {'text': message, 'timestamp': int(time.time())})
     return jsonify(success=True)
 
 @bp.route('/update_wallet', methods=['POST'])
@@ -250,7 +263,8 @@ def update_wallet():
         new_sp = _to_float(request.form.get('sp'))
     except (ValueError, TypeError): return jsonify(success=False, message="Invalid number format."), 400
     db.reference(f'wallets/{user_id}').update({'cc': new_cc, 'sp': new_sp})
-    db.reference('activity_log').push({'type':'admin_edit', 'text': f"الأدمن '{session.get('name')}' عدل محفظة '{user_name}'", 'timestamp': int(time.time())})
+    wallet_service.changed(user_id, 'sp', new_sp)
+    side_effects.push('activity_log', {'type':'admin_edit', 'text': f"الأدمن '{session.get('name')}' عدل محفظة '{user_name}'", 'timestamp': int(time.time())})
     return jsonify(success=True)
 
 @bp.route('/update_purchased_attempts', methods=['POST'])
@@ -263,7 +277,7 @@ def update_purchased_attempts():
         if attempts < 0: return jsonify(success=False, message="عدد المحاولات لا يمكن أن يكون سالباً."), 400
         db.reference(f'user_spin_state/{user_id}/purchasedAttempts').set(attempts)
         user_name = (db.reference(f'registered_users/{user_id}/name').get() or 'مستخدم')
-        db.reference('activity_log').push({'type':'admin_edit', 'text': f"الأدمن '{session.get('name')}' عدل المحاولات المشتراة لـ '{user_name}' إلى {attempts}.", 'timestamp': int(time.time())})
+        side_effects.push('activity_log', {'type':'admin_edit', 'text': f"الأدمن '{session.get('name')}' عدل المحاولات المشتراة لـ '{user_name}' إلى {attempts}.", 'timestamp': int(time.time())})
         return jsonify(success=True)
     except (ValueError, TypeError): return jsonify(success=False, message="عدد المحاولات يجب أن يكون رقماً صحيحاً."), 400
 
@@ -275,6 +289,7 @@ def save_spin_wheel_settings():
     try:
         settings = {"enabled": bool(data.get('enabled')), "cooldownHours": _to_int(data.get('cooldownHours')), "maxAttempts": _to_int(data.get('maxAttempts')), "maxAccumulation": _to_int(data.get('maxAccumulation')), "purchaseLimit": _to_int(data.get('purchaseLimit')), "prizes": [{"value": _to_int(p['value']), "weight": _to_float(p['weight'])} for p in data.get('prizes', []) if p.get('value') and p.get('weight')]}
         db.reference('site_settings/spin_wheel_settings').set(settings)
+        site_settings.apply('spin_wheel_settings', settings)
         return jsonify(success=True)
     except (ValueError, TypeError): return jsonify(success=False, message="بيانات غير صالحة."), 400
 
@@ -288,6 +303,7 @@ def save_gambling_settings():
         if not (0 <= settings['win_chance_percent'] <= 100): raise ValueError("نسبة الربح يجب أن تكون بين 0 و 100.")
         if settings['max_bet'] < 0: raise ValueError("الحد الأعلى للرهان لا يمكن أن يكون سالباً.")
         db.reference('site_settings/gambling_settings').set(settings)
+        site_settings.apply('gambling_settings', settings)
         return jsonify(success=True, message="تم حفظ إعدادات الرهان بنجاح!")
     except (ValueError, TypeError) as e: return jsonify(success=False, message=f"بيانات غير صالحة: {e}"), 400
     except Exception as e:
@@ -307,6 +323,8 @@ def save_contest_settings():
         if winner_points < 0 or voter_sp < 0 or multiplier_boost < 0: raise ValueError("لا يمكن أن تكون القيم سالبة.")
         settings = {'is_enabled': is_enabled,'winner_points_reward': winner_points,'voter_sp_reward': voter_sp, 'multiplier_boost': multiplier_boost}
         db.reference('site_settings/contest_settings').set(settings)
+        site_settings.apply('contest_settings', settings)
+        scheduled_tasks.schedule_contest_job(current_app._get_current_object())
         return jsonify(success=True, message="تم حفظ إعدادات المنافسة بنجاح!")
     except (ValueError, TypeError) as e: return jsonify(success=False, message=f"بيانات غير صالحة. {e}"), 400
     except Exception as e:
@@ -358,7 +376,7 @@ def delete_points_product(pid):
 @bp.route('/reset_all_free_spins', methods=['POST'])
 @admin_required
 def reset_all_free_spins():
-    settings = db.reference('site_settings/spin_wheel_settings').get() or {}; atts = settings.get('maxAttempts', 1); now = int(time.time()); updates = {}
+    settings = get_settings('spin_wheel_settings', {}); atts = settings.get('maxAttempts', 1); now = int(time.time()); updates = {}
     users_approved = (db.reference('registered_users').order_by_child('status').equal_to('approved').get() or {})
     for uid in users_approved: 
         updates[f'user_spin_state/{uid}/freeAttempts'] = atts; 
@@ -404,7 +422,7 @@ def add_avatar():
 def delete_avatar(avatar_id):
     if not avatar_id: return jsonify(success=False, message="معرف الأفاتار مفقود."), 400
     avatar_ref = db.reference(f'site_settings/shop_avatars/{avatar_id}')
-    avatar_data = avatar_ref.get()
+    avatar_data = get_settings(f'shop_avatars/{avatar_id}')
     if not avatar_data: return jsonify(success=False, message="الأفاتار غير موجود."), 404
     try:
         drive_file_id = avatar_data.get('storage_path')
@@ -432,9 +450,9 @@ def remove_user_avatar():
         if avatar_ownership_ref.get() is None: return jsonify(success=False, message="المستخدم لا يمتلك هذا الأفاتار أصلاً."), 404
         avatar_ownership_ref.delete()
         user_name = (db.reference(f'registered_users/{user_id}/name').get() or 'مستخدم')
-        avatar_name = (db.reference(f'site_settings/shop_avatars/{avatar_id}/name').get() or 'غير معروف')
+        avatar_name = (get_settings(f'shop_avatars/{avatar_id}/name') or 'غير معروف')
         log_text = f"الأدمن '{session.get('name')}' أزال أفاتار '{avatar_name}' من المستخدم '{user_name}'."
-        db.reference('activity_log').push({'type': 'admin_edit', 'text': log_text, 'timestamp': int(time.time())})
+        side_effects.push('activity_log', {'type': 'admin_edit', 'text': log_text, 'timestamp': int(time.time())})
         return jsonify(success=True, message=f"تمت إزالة الأفاتار من {user_name} بنجاح.")
     except Exception as e:
         print(f"!!! Remove User Avatar Error: {e}", file=sys.stderr)
@@ -451,8 +469,7 @@ def handle_gift_request(request_id, action):
     try:
         gifter_id, target_name, avatar_id, avatar_url, price_sp = gift_request.get('gifter_id'), gift_request.get('target_user_name'), gift_request.get('avatar_id'), gift_request.get('avatar_image_url'), gift_request.get('price_sp', 0)
         if not all([gifter_id, target_name, avatar_id, avatar_url]): raise ValueError("بيانات طلب الإهداء غير مكتملة.")
-        gifter_wallet_ref = db.reference(f'wallets/{gifter_id}/sp')
-        if gifter_wallet_ref.transaction(lambda current_sp: (current_sp or 0) - price_sp if (current_sp or 0) >= price_sp else None) is None:
+        if not wallet_service.debit(gifter_id, 'sp', price_sp):
              request_ref.update({'status': 'failed', 'reason': 'رصيد غير كافٍ', 'processed_by': session.get('name')}); return jsonify(success=False, message="فشلت الموافقة: رصيد المُهدي غير كافٍ."), 400
         db.reference(f'users/{target_name}').update({'avatar_url': avatar_url})
         registered_user_query = db.reference('registered_users').order_by_child('name').equal_to(target_name).get()
@@ -461,7 +478,7 @@ def handle_gift_request(request_id, action):
             db.reference(f'registered_users/{target_user_id}').update({'current_avatar': avatar_url})
         request_ref.update({'status': 'approved', 'processed_by': session.get('name')})
         log_text = f"الأدمن '{session.get('name')}' وافق على طلب إهداء أفاتار '{gift_request.get('avatar_name')}' إلى الزاحف '{target_name}'."
-        db.reference('activity_log').push({'type': 'gift', 'text': log_text, 'timestamp': int(time.time())})
+        side_effects.push('activity_log', {'type': 'gift', 'text': log_text, 'timestamp': int(time.time())})
         return jsonify(success=True, message="تمت الموافقة على الطلب وتعيين الأفاتار للزاحف بنجاح.")
     except Exception as e:
         request_ref.update({'status': 'failed', 'reason': str(e), 'processed_by': session.get('name')})
@@ -479,11 +496,15 @@ def save_investment_settings():
             'investment_lock_hours': _to_int(data.get('investment_lock_hours')),
             'sell_tax_percent': _to_float(data.get('sell_tax_percent')),
             'sell_fee_sp': _to_float(data.get('sell_fee_sp')),
-            'withdrawal_approval_limit': _to_int(data.get('withdrawal_approval_limit'), 500000)
+            'withdrawal_approval_limit': _to_int(data.get('withdrawal_approval_limit'), 500000),
+            'lot_compaction_min_lots': _to_int(data.get('lot_compaction_min_lots'), 10)
         }
         if any(v < 0 for v in settings.values()): raise ValueError("Values cannot be negative.")
         if not (0 <= settings['sell_tax_percent'] <= 100): raise ValueError("Sell tax must be between 0 and 100.")
+        if settings['lot_compaction_min_lots'] < 2: raise ValueError("Compaction needs at least 2 lots.")
+        settings['lot_compaction_enabled'] = bool(data.get('lot_compaction_enabled'))
         db.reference('site_settings/investment_settings').set(settings)
+        site_settings.apply('investment_settings', settings)
         return jsonify(success=True)
     except (ValueError, TypeError) as e: return jsonify(success=False, message=f"بيانات غير صالحة: {e}"), 400
     except Exception as e:
@@ -592,7 +613,7 @@ def update_personal_multiplier():
         investment_ref.update(updates)
         investor_name = (db.reference(f'registered_users/{investor_id}/name').get() or 'مستخدم')
         log_text = (f"الأدمن '{session.get('name')}' عدّل مضاعف الربح الشخصي للمستثمر '{investor_name}' في الزاحف '{crawler_name}' إلى {multiplier:.2f}x.")
-        db.reference('activity_log').push({'type': 'admin_edit', 'text': log_text, 'timestamp': int(time.time())})
+        side_effects.push('activity_log', {'type': 'admin_edit', 'text': log_text, 'timestamp': int(time.time())})
         return jsonify(success=True, message="تم تحديث المضاعف الشخصي بنجاح.")
     except (ValueError, TypeError): return jsonify(success=False, message="قيمة المضاعف غير صالحة."), 400
     except Exception as e:
@@ -606,7 +627,7 @@ def set_special_multiplier():
         data = request.get_json()
         investor_id, crawler_name, action = data.get('user_id'), data.get('crawler_name'), data.get('action')
         if not all([investor_id, crawler_name, action]): return jsonify(success=False, message="بيانات ناقصة."), 400
-        investment_ref, crawler_data = db.reference(f'investments/{investor_id}/{crawler_name}'), db.reference(f'users/{crawler_name}').get()
+        investment_ref, crawler_data = db.reference(f'investments/{investor_id}/{crawler_name}'), roster.lookup(crawler_name)
         investment_data = investment_ref.get()
         if not investment_data or not crawler_data: return jsonify(success=False, message="بيانات الاستثمار أو الزاحف غير موجودة."), 404
         new_multiplier = 1.0
@@ -614,15 +635,8 @@ def set_special_multiplier():
         elif action == 'total_loss': new_multiplier = 0.0
         elif action == 'invert_profit': new_multiplier = -1.0
         elif action == 'reset_profit':
-            points_now, stock_multiplier, total_invested_sp, weighted_market_factor_sum = _to_float(max(1, crawler_data.get('points', 1))), _to_float(crawler_data.get('stock_multiplier', 1.0)), 0, 0
-            lots = investment_data.get('lots', {})
-            if not lots: new_multiplier = 1.0
-            else:
-                for lot in lots.values():
-                    sp, points_then = _to_float(lot.get('sp', 0)), _to_float(max(1, lot.get('p', 1)))
-                    market_factor = (points_now / points_then) * stock_multiplier
-                    total_invested_sp += sp; weighted_market_factor_sum += sp * market_factor
-                new_multiplier = total_invested_sp / weighted_market_factor_sum if total_invested_sp > 0 and weighted_market_factor_sum > 0 else 1.0
+            positions, lot_position, lots = lot_arrays({investor_id: {crawler_name: investment_data}}, {crawler_name: crawler_data})
+            new_multiplier = float(reset_profit_multipliers(positions, lot_position, lots)[0]) if positions else 1.0
         investment_ref.update({'personal_multiplier': new_multiplier}); return jsonify(success=True, new_multiplier=new_multiplier)
     except Exception as e:
         print(f"!!! Set Special Multiplier Error: {e}", file=sys.stderr)
@@ -637,6 +651,7 @@ def save_stock_prediction_game_settings():
         settings = {'is_enabled': bool(data.get('is_enabled')),'max_bet': _to_int(data.get('max_bet')),'win_chance_percent': _to_float(data.get('win_chance_percent'))}
         if not (0 <= settings['win_chance_percent'] <= 100) or settings['max_bet'] < 0: raise ValueError("قيم الإعدادات غير صالحة.")
         db.reference('site_settings/stock_prediction_game').set(settings)
+        site_settings.apply('stock_prediction_game', settings)
         return jsonify(success=True, message="تم حفظ إعدادات اللعبة بنجاح!")
     except (ValueError, TypeError) as e: return jsonify(success=False, message=f"بيانات غير صالحة: {e}"), 400
     except Exception as e:
@@ -652,6 +667,7 @@ def save_rps_game_settings():
         settings = {'is_enabled': bool(data.get('is_enabled')),'max_bet': _to_int(data.get('max_bet')),'cooldown_seconds': _to_int(data.get('cooldown_seconds'), 60)}
         if settings['max_bet'] < 0 or settings['cooldown_seconds'] < 0: raise ValueError("القيم لا يمكن أن تكون سالبة.")
         db.reference('site_settings/rps_game').update(settings)
+        site_settings.apply_update('rps_game', settings)
         return jsonify(success=True, message="تم حفظ إعدادات اللعبة بنجاح!")
     except (ValueError, TypeError) as e: return jsonify(success=False, message=f"بيانات غير صالحة: {e}"), 400
     except Exception as e:
@@ -669,6 +685,28 @@ def get_user_investments(user_id):
         print(f"!!! Get User Investments Error: {e}", file=sys.stderr)
         return jsonify(success=False, message="خطأ في الخادم أثناء جلب البيانات."), 500
 
+@bp.route('/valuation/crawler/<crawler_name>', methods=['GET'])
+@admin_required
+def get_crawler_valuation(crawler_name):
+    crawler_data = roster.lookup(crawler_name)
+    if not crawler_data: return jsonify(success=False, message="الزاحف غير موجود."), 404
+    try:
+        positions, summary = value_crawler(crawler_name, crawler_data, get_settings('investment_settings', {}))
+        return jsonify(success=True, crawler_name=crawler_name, positions=positions, summary=summary)
+    except Exception as e:
+        print(f"!!! Crawler Valuation Error: {e}", file=sys.stderr)
+        return jsonify(success=False, message="خطأ في الخادم أثناء تقييم الاستثمارات."), 500
+
+@bp.route('/valuation/user/<user_id>', methods=['GET'])
+@admin_required
+def get_user_valuation(user_id):
+    try:
+        positions, summary = value_user(user_id, roster.all(), get_settings('investment_settings', {}))
+        return jsonify(success=True, user_id=user_id, positions=positions, summary=summary)
+    except Exception as e:
+        print(f"!!! User Valuation Error: {e}", file=sys.stderr)
+        return jsonify(success=False, message="خطأ في الخادم أثناء تقييم الاستثمارات."), 500
+
 @bp.route('/delete_investment_lot', methods=['POST'])
 @admin_required
 def delete_investment_lot():
@@ -683,7 +721,7 @@ def delete_investment_lot():
         admin_name = session.get('name', 'Admin')
         user_name = (db.reference(f'registered_users/{user_id}/name').get() or 'مستخدم')
         log_text = f"الأدمن '{admin_name}' حذف دفعة استثمار للمستخدم '{user_name}' في الزاحف '{crawler_name}'."
-        db.reference('activity_log').push({'type': 'admin_edit', 'text': log_text, 'timestamp': int(time.time())})
+        side_effects.push('activity_log', {'type': 'admin_edit', 'text': log_text, 'timestamp': int(time.time())})
         return jsonify(success=True, message="تم حذف دفعة الاستثمار بنجاح.")
     except Exception as e:
         print(f"!!! Delete Investment Lot Error: {e}", file=sys.stderr)
@@ -696,28 +734,20 @@ def force_sell_all_lots():
         data = request.get_json()
         investor_id, crawler_name = data.get('user_id'), data.get('crawler_name')
         if not all([investor_id, crawler_name]): return jsonify(success=False, message="بيانات ناقصة."), 400
-        investment_ref, crawler_data = db.reference(f'investments/{investor_id}/{crawler_name}'), db.reference(f'users/{crawler_name}').get()
+        investment_ref, crawler_data = db.reference(f'investments/{investor_id}/{crawler_name}'), roster.lookup(crawler_name)
         investment_data = investment_ref.get()
         if not investment_data or not crawler_data: return jsonify(success=False, message="لا يوجد استثمار لهذا المستخدم في هذا الزاحف."), 404
-        lots = investment_data.get('lots', {})
-        if not lots: return jsonify(success=False, message="لا توجد دفعات استثمار لبيعها."), 404
-        settings = db.reference('site_settings/investment_settings').get() or {}
-        sell_tax_percent, sell_fee_sp = settings.get('sell_tax_percent', 0.0), settings.get('sell_fee_sp', 0.0)
-        current_points, stock_multiplier, personal_multiplier = _to_float(max(1, crawler_data.get('points', 1))), _to_float(crawler_data.get('stock_multiplier', 1.0)), _to_float(investment_data.get('personal_multiplier', 1.0))
-        total_sp_to_return = 0
-        for lot_data in lots.values():
-            invested_sp, points_at_inv = _to_float(lot_data.get('sp', 0)), _to_float(max(1, lot_data.get('p', 1)))
-            value_of_lot = invested_sp * (current_points / points_at_inv) * stock_multiplier * personal_multiplier
-            profit = value_of_lot - invested_sp
-            tax_amount = max(0, profit * (sell_tax_percent / 100.0))
-            total_sp_to_return += value_of_lot - tax_amount
-        total_sp_to_return -= sell_fee_sp
-        db.reference(f'wallets/{investor_id}/sp').transaction(lambda current: (current or 0) + total_sp_to_return)
+        positions, lot_position, lots = lot_arrays({investor_id: {crawler_name: investment_data}}, {crawler_name: crawler_data})
+        if not positions: return jsonify(success=False, message="لا توجد دفعات استثمار لبيعها."), 404
+        settings = get_settings('investment_settings', {})
+        totals = value_positions(positions, lot_position, lots, settings.get('sell_tax_percent', 0.0), settings.get('sell_fee_sp', 0.0))
+        total_sp_to_return = float(totals['net'][0])
+        wallet_service.credit(investor_id, 'sp', total_sp_to_return)
         investment_ref.delete()
         admin_name, investor_name = session.get('name', 'Admin'), (db.reference(f'registered_users/{investor_id}/name').get() or 'مستخدم')
         log_text = f"الأدمن '{admin_name}' قام بتصفية استثمارات '{investor_name}' في '{crawler_name}' بقيمة {total_sp_to_return:,.2f} SP."
-        db.reference('activity_log').push({'type': 'admin_edit', 'text': log_text, 'timestamp': int(time.time())})
-        db.reference(f'user_messages/{investor_id}').push({'text': f"تمت تصفية استثماراتك في '{crawler_name}'. تم إضافة/خصم {total_sp_to_return:,.2f} SP إلى/من محفظتك.",'timestamp': int(time.time())})
+        side_effects.push('activity_log', {'type': 'admin_edit', 'text': log_text, 'timestamp': int(time.time())})
+        side_effects.push(f'user_messages/{investor_id}', {'text': f"تمت تصفية استثماراتك في '{crawler_name}'. تم إضافة/خصم {total_sp_to_return:,.2f} SP إلى/من محفظتك.",'timestamp': int(time.time())})
         return jsonify(success=True, message=f"تمت تصفية جميع استثمارات {investor_name} في {crawler_name} بنجاح.")
     except Exception as e:
         print(f"!!! Force Sell All Lots Error: {e}", file=sys.stderr)
@@ -740,7 +770,7 @@ def handle_withdrawal_request(request_id, action):
         try:
             db.reference(f"investments/{user_id}/{request_data['crawler_name']}/lots/{request_data['lot_id']}").set(request_data['lot_data'])
             req_ref.update({'status': 'rejected', 'processed_by': session.get('name')})
-            db.reference(f'user_messages/{user_id}').push({'text': f"تم رفض طلب سحب الأرباح الخاص بك من استثمار '{request_data['crawler_name']}'.", 'timestamp': int(time.time())})
+            side_effects.push(f'user_messages/{user_id}', {'text': f"تم رفض طلب سحب الأرباح الخاص بك من استثمار '{request_data['crawler_name']}'.", 'timestamp': int(time.time())})
             return jsonify(success=True, message="تم رفض طلب السحب بنجاح.")
         except Exception as e:
             return jsonify(success=False, message=f"خطأ في الخادم: {e}"), 500
@@ -752,12 +782,12 @@ def handle_withdrawal_request(request_id, action):
         
         final_sp_to_return = _to_float(final_amount_str)
 
-        db.reference(f'wallets/{user_id}/sp').transaction(lambda current: (current or 0) + final_sp_to_return)
+        wallet_service.credit(user_id, 'sp', final_sp_to_return)
         
         req_ref.update({'status': 'approved', 'processed_by': session.get('name'), 'final_amount': final_sp_to_return})
         
-        db.reference(f'user_messages/{user_id}').push({'text': f"تمت الموافقة على طلب سحب الأرباح الخاص بك! تم إضافة {final_sp_to_return:,.2f} SP إلى محفظتك.", 'timestamp': int(time.time())})
-        db.reference('investment_log').push({
+        side_effects.push(f'user_messages/{user_id}', {'text': f"تمت الموافقة على طلب سحب الأرباح الخاص بك! تم إضافة {final_sp_to_return:,.2f} SP إلى محفظتك.", 'timestamp': int(time.time())})
+        side_effects.push('investment_log', {
             'investor_id': user_id, 
             'investor_name': request_data.get('user_name'), 
             'target_name': request_data.get('crawler_name'), 
@@ -787,17 +817,52 @@ def save_governor_settings():
         volatility_data = data.get('market_volatility', {})
         settings = { 'enabled': bool(data.get('enabled')), 'interval_hours': interval_hours, 'interval_minutes': interval_minutes, 'interval_seconds': interval_seconds, 'market_volatility': { 'enabled': bool(volatility_data.get('enabled')), **{k: _to_float(v) for k, v in volatility_data.items() if k != 'enabled'} }, 'balance_profit_threshold': _to_int(data.get('balance_profit_threshold')), 'balance_value_threshold': _to_int(data.get('balance_value_threshold')), 'rescue_wallet_threshold': _to_int(data.get('rescue_wallet_threshold')), 'rescue_loss_threshold': _to_int(data.get('rescue_loss_threshold')), 'jackpot_chance_percent': _to_float(data.get('jackpot_chance_percent')), 'jackpot_multiplier': _to_float(data.get('jackpot_multiplier')), 'deal_bonus_enabled': bool(data.get('deal_bonus_enabled')), 'underdog_rank_threshold': _to_int(data.get('underdog_rank_threshold')), 'underdog_bonus_percent': _to_float(data.get('underdog_bonus_percent')), 'diversify_milestones': milestones, 'diversify_bonus_percent': _to_float(data.get('diversify_bonus_percent')), 'instant_bonus_enabled': bool(data.get('instant_bonus_enabled')), 'instant_win_chance': _to_float(data.get('instant_win_chance')), 'instant_loss_chance': _to_float(data.get('instant_loss_chance')), 'instant_neutral_chance': _to_float(data.get('instant_neutral_chance')), 'instant_win_max_percent': _to_float(data.get('instant_win_max_percent')), 'instant_loss_max_percent': _to_float(data.get('instant_loss_max_percent')) }
         db.reference('site_settings/market_governor').set(settings)
-        if scheduler.get_job('market_justice_job'):
-            scheduler.remove_job('market_justice_job')
-            print(">> Removed old 'market_justice_job'.")
-        if settings['enabled']:
-            scheduler.add_job(id='market_justice_job',func=scheduled_tasks.automated_market_balance,trigger='interval',seconds=total_seconds,args=[current_app._get_current_object()])
-            print(f">> Rescheduled 'market_justice_job' to run every {total_seconds} seconds.")
-        else:
-            print(">> Market Governor is now disabled. Job not scheduled.")
+        site_settings.apply('market_governor', settings)
+        # العمال الآخرون يعيدون الجدولة عند ملاحظة تغير الإعدادات (scheduler_lease.coordinator)
+        scheduled_tasks.sync_market_job(current_app._get_current_object())
         return jsonify(success=True, message="تم حفظ إعدادات حاكم السوق وإعادة جدولة المهمة بنجاح.")
     except Exception as e:
         print(f"!!! Save Governor Settings Error (General): {e}", file=sys.stderr)
         return jsonify(success=False, message=f"خطأ في الخادم: {e}"), 500
 
+@bp.route('/log_rollups/<log_name>', methods=['GET'])
+@admin_required
+def get_log_rollups(log_name):
+    if log_name not in scheduled_tasks.LOG_ROLLUP_DIMENSIONS:
+        return jsonify(success=False, message="سجل غير معروف."), 400
+    query = db.reference(f'log_rollups/{log_name}').order_by_key()
+    start_day, end_day = request.args.get('from'), request.args.get('to')
+    if start_day: query = query.start_at(start_day)
+    if end_day: query = query.end_at(end_day)
+    if not (start_day or end_day): query = query.limit_to_last(30)
+    try:
+        return jsonify(success=True, log_name=log_name, rollups=query.get() or {})
+    except Exception as e:
+        print(f"!!! Get Log Rollups Error: {e}", file=sys.stderr)
+        return jsonify(success=False, message="خطأ في الخادم."), 500
+
+@bp.route('/cache_stats', methods=['GET'])
+@admin_required
+def get_cache_stats():
+    return jsonify(success=True, site_settings=site_settings.stats(), crawler_roster=roster.stats(),
+                   side_effects=side_effects.stats(), portfolios=portfolio_cache.stats(),
+                   richest_leaderboard=richest.stats())
+
+@bp.route('/job_metrics', methods=['GET'])
+@admin_required
+def get_job_metrics():
+    return jsonify(success=True, scheduler_leader=coordinator.is_leader(), holder=coordinator.holder_id,
+                   jobs=telemetry.snapshot())
+
+@bp.route('/metrics', methods=['GET'])
+def get_prometheus_metrics():
+    # Prometheus لا يملك جلسة دخول، فيُقبل أيضاً رمز METRICS_TOKEN في ترويسة Authorization
+    token = os.getenv('METRICS_TOKEN')
+    authorized = session.get('role') == 'admin' or bool(
+        token and hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode()))
+    if not authorized:
+        return jsonify(success=False, message="الوصول مرفوض. صلاحيات المسؤول مطلوبة."), 403
+    leader = f"# HELP rkhas_scheduler_leader 1 if this process runs the scheduled jobs.\n# TYPE rkhas_scheduler_leader gauge\nrkhas_scheduler_leader {int(coordinator.is_leader())}\n"
+    return Response(leader + telemetry.prometheus(), mimetype='text/plain; version=0.0.4')
+
 # --- END OF FILE project/admin_api.py ---
\ No newline at end of file
@@ -9,8 +9,10 @@ from flask import (
     Blueprint, render_template, request, redirect, url_for, session, flash, jsonify
 )
 import pyrebase # <-- الإضافة الجديدة
-from firebase_admin import auth, db
+from firebase_admin import auth
+from .storage import db
 from .utils import check_user_status, login_required
+from .live_cache import get_settings
 
 # --- تهيئة Pyrebase للمصادقة ---
 try:
@@ -78,7 +80,7 @@ def login_page():
             return jsonify(success=False, message="بيانات الدخول غير صحيحة. يرجى التأكد من البريد الإلكتروني وكلمة المرور.")
     
     # GET Request
-    announcements_raw = db.reference('site_settings/announcements').get()
+    announcements_raw = get_settings('announcements')
     announcements = list(announcements_raw.values()) if announcements_raw else []
     return render_template('login.html', announcements=announcements)
 
@@ -0,0 +1,74 @@
+﻿# --- START OF FILE project/contest_payouts.py ---
+import sys
+import time
+from .storage import db, generate_push_id
+from . import wallet_service
+
+PAYOUTS_ROOT = 'contest_payouts'
+PAYOUT_CHUNK = 500
+
+
+def open_payout_updates(payout_id, winner_name, voter_uids, voter_reward):
+    """
+    Multi-path update entries that open a payout record: the winner, the reward and
+    every winning voter marked unpaid. Callers write them in the same update that
+    completes the contest, so a contest is never completed without its payout record.
+    """
+    return {
+        f'{PAYOUTS_ROOT}/{payout_id}': {
+            'winner': winner_name,
+            'reward': voter_reward,
+            'status': 'pending' if voter_uids else 'done',
+            'created_at': int(time.time()),
+            'voters': {uid: False for uid in voter_uids},
+        }
+    }
+
+
+def run_payout(payout_id):
+    """
+    Pays every voter still marked unpaid, PAYOUT_CHUNK at a time.
+
+    Each chunk credits the wallets, posts the inbox messages and flips the voters to
+    paid in a single multi-path update, so the checkpoint and the money always move
+    together. After a crash the next run picks up only the voters that are still unpaid.
+    Returns the number of voters paid by this run.
+    """
+    payout_ref = db.reference(f'{PAYOUTS_ROOT}/{payout_id}', memoize=False)
+    payout = payout_ref.get()
+    if not payout or payout.get('status') == 'done':
+        return 0
+
+    winner_name = payout.get('winner')
+    reward = payout.get('reward', 0)
+    unpaid = [uid for uid, paid in (payout.get('voters') or {}).items() if not paid]
+    message = {'text': f"🎉 مبروك! لقد فزت بـ {reward} SP لتصويتك للزاحف الفائز '{winner_name}'.", 'timestamp': int(time.time())}
+
+    paid = 0
+    for start in range(0, len(unpaid), PAYOUT_CHUNK):
+        updates = {}
+        chunk = unpaid[start:start + PAYOUT_CHUNK]
+        for uid in chunk:
+            updates.update(wallet_service.credit_updates(uid, 'sp', reward))
+            updates[f'user_messages/{uid}/{generate_push_id()}'] = message
+            updates[f'{PAYOUTS_ROOT}/{payout_id}/voters/{uid}'] = True
+        db.reference(memoize=False).update(updates)
+        for uid in chunk:
+            wallet_service.changed(uid, 'sp')
+        paid += len(chunk)
+
+    payout_ref.update({'status': 'done', 'completed_at': int(time.time())})
+    print(f"Contest payout '{payout_id}' paid {paid} voters of '{winner_name}'.")
+    return paid
+
+
+def resume_pending_payouts():
+    """Finishes payouts left pending by an interrupted run."""
+    pending = db.reference(PAYOUTS_ROOT, memoize=False).order_by_child('status').equal_to('pending').get() or {}
+    for payout_id in pending:
+        try:
+            run_payout(payout_id)
+        except Exception as e:
+            print(f"!!! Contest payout '{payout_id}' failed, will resume on the next run: {e}", file=sys.stderr)
+
+# --- END OF FILE project/contest_payouts.py ---
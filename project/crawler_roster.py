@@ -0,0 +1,59 @@
+﻿# --- START OF FILE project/crawler_roster.py ---
+from .live_cache import LiveNodeCache
+from .rank_index import RankIndex
+
+
+class CrawlerRoster(LiveNodeCache):
+    """
+    Process-wide live view of the `users` node (the crawlers).
+
+    `users` is downloaded once at startup; after that only the changed children
+    arrive through the listen() stream, so endpoints and scheduled jobs can look up
+    or iterate crawlers without fetching the whole tree on every call.
+    `ranks` is a points leaderboard index kept in step with the same events.
+    """
+
+    def __init__(self):
+        self.ranks = RankIndex()
+        super().__init__('users', ttl_seconds=15)
+
+    def _on_change(self, parts, event):
+        if parts:
+            changed = [parts[0]]
+        elif event is not None and event.event_type == 'patch' and isinstance(event.data, dict):
+            changed = {key.strip('/').split('/')[0] for key in event.data}
+        else:
+            self.ranks.rebuild(self._peek())
+            return
+        for name in changed:
+            data = self._peek(name)
+            self.ranks.update(name, data.get('points', 0) if isinstance(data, dict) else None)
+
+    def lookup(self, name):
+        """Returns a copy of one crawler's data, or None if it does not exist."""
+        if not name:
+            return None
+        return self.get(name)
+
+    def exists(self, name):
+        return bool(name) and self.snapshot(name) is not None
+
+    def names(self):
+        return list((self.snapshot() or {}).keys())
+
+    def all(self):
+        """Read-only snapshot of every crawler keyed by name."""
+        return self.snapshot() or {}
+
+    def ranked(self):
+        """The points RankIndex, after making sure the mirror is loaded and fresh."""
+        self._ensure_loaded()
+        return self.ranks
+
+    def __len__(self):
+        return len(self.snapshot() or {})
+
+
+roster = CrawlerRoster()
+
+# --- END OF FILE project/crawler_roster.py ---
@@ -0,0 +1,262 @@
+﻿# --- START OF FILE project/job_telemetry.py ---
+import time
+import threading
+import traceback
+from functools import wraps
+from apscheduler.events import EVENT_JOB_ADDED, EVENT_JOB_SUBMITTED, EVENT_JOB_MISSED, EVENT_JOB_MAX_INSTANCES
+
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+LAG_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60)
+METRIC_PREFIX = 'rkhas_job'
+
+_calls = threading.local()
+
+
+# --- database call accounting ---
+def current_counter():
+    """The call counter bound to this thread (a one-item list), or None when nothing is counting."""
+    return getattr(_calls, 'counter', None)
+
+
+def bind_counter(counter):
+    """Binds `counter` to this thread, e.g. in a pool thread doing reads for a job. Returns the previous one."""
+    previous = current_counter()
+    _calls.counter = counter
+    return previous
+
+
+_COUNTED_CALLS = {'get', 'get_if_changed', 'set', 'update', 'push', 'delete', 'transaction', 'listen'}
+
+
+class CountedReference:
+    """
+    Proxy that adds one to the bound counter for every call that reaches the backend.
+    References and queries derived from it (child, parent, order_by_*, ...) are counted too.
+    """
+
+    def __init__(self, target, counter):
+        self._target = target
+        self._counter = counter
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name == 'parent':
+            return CountedReference(attr, self._counter) if attr is not None else None
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            if name in _COUNTED_CALLS:
+                self._counter[0] += 1
+            result = attr(*args, **kwargs)
+            if name not in _COUNTED_CALLS and hasattr(result, 'get') and not isinstance(result, dict):
+                return CountedReference(result, self._counter)
+            return result
+        return call
+
+
+def counted(reference):
+    counter = current_counter()
+    return CountedReference(reference, counter) if counter is not None else reference
+
+
+# --- metrics ---
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.total += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def snapshot(self):
+        return {'buckets': dict(zip((str(b) for b in self.buckets), self.counts)),
+                'sum': round(self.total, 6), 'count': self.count}
+
+
+class _JobStats:
+    def __init__(self):
+        self.runs = 0
+        self.failures = 0
+        self.running = 0
+        self.overlaps = 0
+        self.missed = 0
+        self.coalesced = 0
+        self.skipped_max_instances = 0
+        self.db_calls_total = 0
+        self.last_db_calls = None
+        self.last_duration = None
+        self.last_lag = None
+        self.last_run_at = None
+        self.last_error = None
+        self.duration = Histogram(DURATION_BUCKETS)
+        self.lag = Histogram(LAG_BUCKETS)
+
+    def snapshot(self):
+        return {
+            'runs': self.runs, 'failures': self.failures, 'running': self.running,
+            'overlaps': self.overlaps, 'missed': self.missed, 'coalesced': self.coalesced,
+            'skipped_max_instances': self.skipped_max_instances,
+            'db_calls_total': self.db_calls_total, 'last_db_calls': self.last_db_calls,
+            'last_duration': self.last_duration, 'last_lag': self.last_lag,
+            'last_run_at': self.last_run_at, 'last_error': self.last_error,
+            'duration_seconds': self.duration.snapshot(), 'lag_seconds': self.lag.snapshot(),
+        }
+
+
+class JobTelemetry:
+    """
+    Per-job run metrics for the scheduled tasks, keyed by the job function's name.
+
+    instrumented() measures each run (duration, overlap with a still-running call,
+    database calls made by the job and by read_parallel on its behalf, last error).
+    attach() listens to the scheduler for what the function itself cannot see:
+    the lag between the scheduled and the actual start, coalesced runs, missed runs
+    and runs skipped because the previous one was still going.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._job_names = {}
+        self._scheduler = None
+
+    def _stats(self, name):
+        stats = self._jobs.get(name)
+        if stats is None:
+            stats = self._jobs[name] = _JobStats()
+        return stats
+
+    def instrumented(self, func):
+        name = func.__name__
+
+        @wraps(func)
+        def run(*args, **kwargs):
+            with self._lock:
+                stats = self._stats(name)
+                stats.running += 1
+                if stats.running > 1:
+                    stats.overlaps += 1
+            counter = [0]
+            previous = bind_counter(counter)
+            started = time.time()
+            error = None
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                duration = time.time() - started
+                bind_counter(previous)
+                with self._lock:
+                    stats.running -= 1
+                    stats.runs += 1
+                    stats.last_run_at = int(started)
+                    stats.last_duration = round(duration, 6)
+                    stats.duration.observe(duration)
+                    stats.last_db_calls = counter[0]
+                    stats.db_calls_total += counter[0]
+                    if error is not None:
+                        stats.failures += 1
+                        stats.last_error = {'message': str(error), 'at': int(time.time()),
+                                            'traceback': traceback.format_exc(limit=5)}
+        return run
+
+    def record_error(self, name, error):
+        """For jobs that catch and print their own exceptions: counts the failure and keeps the error."""
+        with self._lock:
+            stats = self._stats(name)
+            stats.failures += 1
+            stats.last_error = {'message': str(error), 'at': int(time.time()), 'traceback': traceback.format_exc(limit=5)}
+
+    # --- scheduler events ---
+    def attach(self, scheduler):
+        if self._scheduler is scheduler:
+            return
+        self._scheduler = scheduler
+        scheduler.add_listener(self._on_event, EVENT_JOB_ADDED | EVENT_JOB_SUBMITTED | EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES)
+        for job in scheduler.get_jobs():
+            self._job_names[job.id] = job.func.__name__
+
+    def _job_name(self, job_id):
+        # أسماء المهام تُحفظ عند الإضافة، لأن مهام المرة الواحدة تُحذف قبل وصول بعض الأحداث
+        name = self._job_names.get(job_id)
+        if name is None:
+            job = self._scheduler.get_job(job_id) if self._scheduler is not None else None
+            name = getattr(getattr(job, 'func', None), '__name__', job_id)
+            self._job_names[job_id] = name
+        return name
+
+    def _on_event(self, event):
+        name = self._job_name(event.job_id)
+        if event.code == EVENT_JOB_ADDED:
+            return
+        with self._lock:
+            stats = self._stats(name)
+            if event.code == EVENT_JOB_SUBMITTED:
+                run_times = getattr(event, 'scheduled_run_times', None) or []
+                if run_times:
+                    lag = max(0.0, time.time() - run_times[-1].timestamp())
+                    stats.last_lag = round(lag, 6)
+                    stats.lag.observe(lag)
+                    stats.coalesced += len(run_times) - 1
+            elif event.code == EVENT_JOB_MISSED:
+                stats.missed += 1
+            elif event.code == EVENT_JOB_MAX_INSTANCES:
+                stats.skipped_max_instances += 1
+
+    # --- exports ---
+    def snapshot(self):
+        with self._lock:
+            return {name: stats.snapshot() for name, stats in sorted(self._jobs.items())}
+
+    def prometheus(self):
+        """The metrics in the Prometheus text exposition format."""
+        jobs = self.snapshot()
+        lines = []
+
+        def metric(name, kind, help_text, field):
+            lines.append(f'# HELP {METRIC_PREFIX}_{name} {help_text}')
+            lines.append(f'# TYPE {METRIC_PREFIX}_{name} {kind}')
+            for job, stats in jobs.items():
+                value = stats[field]
+                if value is not None:
+                    lines.append(f'{METRIC_PREFIX}_{name}{{job="{job}"}} {value}')
+
+        def histogram(name, help_text, field):
+            lines.append(f'# HELP {METRIC_PREFIX}_{name} {help_text}')
+            lines.append(f'# TYPE {METRIC_PREFIX}_{name} histogram')
+            for job, stats in jobs.items():
+                snapshot = stats[field]
+                for bound, count in snapshot['buckets'].items():
+                    lines.append(f'{METRIC_PREFIX}_{name}_bucket{{job="{job}",le="{bound}"}} {count}')
+                lines.append(f'{METRIC_PREFIX}_{name}_bucket{{job="{job}",le="+Inf"}} {snapshot["count"]}')
+                lines.append(f'{METRIC_PREFIX}_{name}_sum{{job="{job}"}} {snapshot["sum"]}')
+                lines.append(f'{METRIC_PREFIX}_{name}_count{{job="{job}"}} {snapshot["count"]}')
+
+        metric('runs_total', 'counter', 'Completed runs.', 'runs')
+        metric('failures_total', 'counter', 'Runs that raised.', 'failures')
+        metric('overlaps_total', 'counter', 'Runs started while another run of the job was active.', 'overlaps')
+        metric('missed_total', 'counter', 'Runs missed past their misfire grace time.', 'missed')
+        metric('coalesced_total', 'counter', 'Overdue runs merged into a single run.', 'coalesced')
+        metric('skipped_max_instances_total', 'counter', 'Runs skipped because the previous one was still running.', 'skipped_max_instances')
+        metric('db_calls_total', 'counter', 'Database calls made by the job.', 'db_calls_total')
+        metric('running', 'gauge', 'Runs in progress.', 'running')
+        metric('last_duration_seconds', 'gauge', 'Duration of the last run.', 'last_duration')
+        metric('last_run_timestamp_seconds', 'gauge', 'Start time of the last run.', 'last_run_at')
+        histogram('duration_seconds', 'Run duration.', 'duration_seconds')
+        histogram('lag_seconds', 'Delay between the scheduled and the actual start.', 'lag_seconds')
+        return '\n'.join(lines) + '\n'
+
+
+telemetry = JobTelemetry()
+instrumented = telemetry.instrumented
+
+# --- END OF FILE project/job_telemetry.py ---
@@ -0,0 +1,216 @@
+﻿# --- START OF FILE project/leaderboards.py ---
+import os
+import sys
+import time
+import atexit
+import threading
+from .storage import db
+from .read_fanout import read_parallel
+from .crawler_roster import roster
+from .valuation import lot_arrays, lot_values
+from . import wallet_service
+
+RICHEST_PATH = 'leaderboards/richest'
+RICHEST_INDEX_PATH = 'leaderboards/richest_index'
+VARIANTS = ('wallet', 'net_worth')
+SCORE_PAGE_SIZE = 200
+
+
+def _eligible(profile):
+    return isinstance(profile, dict) and profile.get('role') != 'admin' and profile.get('show_on_leaderboard') is not False
+
+
+def _net_worth(uid, wallet, investments, crawlers):
+    positions, _, lots = lot_arrays({uid: investments or {}}, crawlers)
+    return wallet + (float(lot_values(lots).sum()) if positions else 0.0)
+
+
+class RichestLeaderboard:
+    """
+    Server-maintained richest investors, so clients read a few hundred bytes instead of
+    every wallet and every registered user.
+
+    Every eligible user (not an admin, not hidden with show_on_leaderboard) has a score
+    per variant under leaderboards/richest_index/{variant}/{uid}: 'wallet' is the SP
+    balance and 'net_worth' adds the current value of their investment lots. The top
+    `top_n` of each variant is read back with an ordered limit query and published to
+    leaderboards/richest/{variant} as a list of {uid, name, avatar, value}.
+
+    touch() marks a user whose wallet or privacy changed (wallet_service calls it through
+    its change hook once the write is committed). A background thread re-scores the
+    touched users every `flush_interval` seconds and republishes only when a change can
+    reach the published top. Net worth also moves
+    with the market, so rebuild() re-scores every wallet from the scheduled job.
+    RICHEST_TOP_N overrides `top_n` (the index needs ".indexOn": ".value" in the rules).
+    """
+
+    def __init__(self, top_n=10, flush_interval=1.0):
+        self.top_n = top_n
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._dirty = {}
+        self._thread = None
+        self._stopping = threading.Event()
+        self._stats = {'touched': 0, 'scored': 0, 'published': 0, 'skipped_publishes': 0, 'errors': 0}
+
+    # --- lifecycle ---
+    def start(self):
+        if self._thread:
+            return
+        self.top_n = int(os.getenv('RICHEST_TOP_N', self.top_n))
+        wallet_service.on_change(self._on_wallet_change)
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='richest-leaderboard', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        print(f">> Richest leaderboard maintained incrementally (top {self.top_n}).")
+
+    def stop(self):
+        self._stopping.set()
+        try:
+            self.flush()
+        except Exception as e:
+            self._stats['errors'] += 1
+            print(f"!!! Richest leaderboard final flush failed: {e}", file=sys.stderr)
+
+    def _run(self):
+        while not self._stopping.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                self._stats['errors'] += 1
+                print(f"!!! Richest leaderboard flush failed: {e}", file=sys.stderr)
+
+    # --- producers ---
+    def _on_wallet_change(self, uid, currency, balance):
+        if currency == 'sp':
+            self.touch(uid, balance)
+
+    def touch(self, uid, balance=None):
+        """Queues `uid` for re-scoring; `balance` is its SP balance when the caller knows it."""
+        if not uid or self._thread is None:
+            return
+        with self._lock:
+            self._stats['touched'] += 1
+            # آخر تغيير هو المعتمد: رصيد معروف يُستخدم كما هو، وNone يعني قراءة المحفظة عند الدمج
+            self._dirty[uid] = balance
+
+    # --- scoring ---
+    def _score(self, balances):
+        """{uid: {variant: score} or None when the user must not be listed} for the given users."""
+        uids = list(balances)
+        reads = {}
+        for uid in uids:
+            reads[f'u:{uid}'] = f'registered_users/{uid}'
+            reads[f'i:{uid}'] = f'investments/{uid}'
+            if balances[uid] is None:
+                reads[f'w:{uid}'] = f'wallets/{uid}/sp'
+        results = read_parallel(reads)
+        crawlers = roster.all()
+        scores = {}
+        for uid in uids:
+            if not _eligible(results.get(f'u:{uid}')):
+                scores[uid] = None
+                continue
+            wallet = balances[uid]
+            if wallet is None:
+                wallet = wallet_service.balance(uid, 'sp', results.get(f'w:{uid}') or 0)
+            wallet = float(wallet or 0)
+            scores[uid] = {
+                'wallet': round(wallet, 2),
+                'net_worth': round(_net_worth(uid, wallet, results.get(f'i:{uid}'), crawlers), 2),
+            }
+        self._stats['scored'] += len(uids)
+        return scores
+
+    def _write_scores(self, scores):
+        updates = {}
+        for uid, score in scores.items():
+            for variant in VARIANTS:
+                updates[f'{RICHEST_INDEX_PATH}/{variant}/{uid}'] = score[variant] if score else None
+        if updates:
+            db.reference(memoize=False).update(updates)
+
+    def flush(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, {}
+        if not dirty:
+            return
+        uids = list(dirty)
+        scores = {}
+        for start in range(0, len(uids), SCORE_PAGE_SIZE):
+            page = {uid: dirty[uid] for uid in uids[start:start + SCORE_PAGE_SIZE]}
+            try:
+                page_scores = self._score(page)
+                self._write_scores(page_scores)
+            except Exception:
+                # المستخدمون الذين لم يُكتبوا يعودون للقائمة ليُعاد حسابهم في الدورة التالية
+                with self._lock:
+                    for uid in uids[start:]:
+                        self._dirty.setdefault(uid, None)
+                raise
+            scores.update(page_scores)
+        if self._reaches_top(scores):
+            self.publish()
+        else:
+            self._stats['skipped_publishes'] += 1
+
+    def _reaches_top(self, scores):
+        """Whether any of the re-scored users is, or could now be, on a published list."""
+        # القائمة المنشورة تُقرأ من القاعدة لأن عاملاً آخر قد يكون نشرها
+        current = db.reference(RICHEST_PATH, memoize=False).get()
+        if not isinstance(current, dict):
+            return True
+        for variant in VARIANTS:
+            published = [entry for entry in (current.get(variant) or []) if isinstance(entry, dict)]
+            if len(published) < self.top_n:
+                return True
+            listed = {entry['uid'] for entry in published}
+            lowest = min(entry['value'] for entry in published)
+            for uid, score in scores.items():
+                if uid in listed or (score and score[variant] >= lowest):
+                    return True
+        return False
+
+    # --- publishing ---
+    def publish(self):
+        tops = {}
+        for variant in VARIANTS:
+            top = db.reference(f'{RICHEST_INDEX_PATH}/{variant}', memoize=False).order_by_value().limit_to_last(self.top_n).get() or {}
+            tops[variant] = sorted(top.items(), key=lambda item: item[1], reverse=True)
+        uids = {uid for top in tops.values() for uid, _ in top}
+        profiles = read_parallel({uid: f'registered_users/{uid}' for uid in uids}) if uids else {}
+        leaderboard = {'updated_at': int(time.time())}
+        for variant, top in tops.items():
+            leaderboard[variant] = [{
+                'uid': uid,
+                'name': (profiles.get(uid) or {}).get('name', ''),
+                'avatar': (profiles.get(uid) or {}).get('current_avatar', ''),
+                'value': value,
+            } for uid, value in top]
+        db.reference(RICHEST_PATH, memoize=False).set(leaderboard)
+        self._stats['published'] += 1
+        return leaderboard
+
+    def rebuild(self):
+        """Re-scores every wallet in pages, drops index entries of wallets that no longer exist and republishes."""
+        uids = sorted((db.reference('wallets', memoize=False).get(shallow=True) or {}).keys())
+        for start in range(0, len(uids), SCORE_PAGE_SIZE):
+            self._write_scores(self._score({uid: None for uid in uids[start:start + SCORE_PAGE_SIZE]}))
+        known = set(uids)
+        stale = {}
+        for variant in VARIANTS:
+            indexed = db.reference(f'{RICHEST_INDEX_PATH}/{variant}', memoize=False).get(shallow=True) or {}
+            stale.update({f'{RICHEST_INDEX_PATH}/{variant}/{uid}': None for uid in indexed if uid not in known})
+        if stale:
+            db.reference(memoize=False).update(stale)
+        return self.publish()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, pending=len(self._dirty))
+
+
+richest = RichestLeaderboard()
+
+# --- END OF FILE project/leaderboards.py ---
@@ -0,0 +1,194 @@
+﻿# --- START OF FILE project/live_cache.py ---
+import sys
+import copy
+import time
+import threading
+from .storage import db
+
+
+def _split_path(path):
+    return [part for part in (path or '').strip('/').split('/') if part]
+
+
+def _get_in(tree, parts):
+    node = tree
+    for part in parts:
+        if not isinstance(node, dict):
+            return None
+        node = node.get(part)
+        if node is None:
+            return None
+    return node
+
+
+def _set_in(tree, parts, value):
+    """
+    Returns a new root with `value` written at `parts`.
+    Only the dicts along the path are copied, so earlier roots handed out by
+    snapshot() stay unchanged while the mirror keeps applying events.
+    """
+    if not parts:
+        return value
+    root = dict(tree) if isinstance(tree, dict) else {}
+    node = root
+    for part in parts[:-1]:
+        child = node.get(part)
+        child = dict(child) if isinstance(child, dict) else {}
+        node[part] = child
+        node = child
+    if value is None:
+        node.pop(parts[-1], None)
+    else:
+        node[parts[-1]] = value
+    return root
+
+
+class LiveNodeCache:
+    """
+    In-process mirror of one database subtree.
+
+    The mirror is loaded once and then kept fresh by a background listen() stream.
+    If the stream cannot be opened (or goes quiet for longer than `max_age_seconds`)
+    reads fall back to a plain TTL reload, so callers never see data older than that.
+    """
+
+    def __init__(self, path, ttl_seconds=30, max_age_seconds=600):
+        self.path = path.strip('/')
+        self.ttl_seconds = ttl_seconds
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.RLock()
+        self._data = None
+        self._loaded = False
+        self._refreshed_at = 0.0
+        self._listener = None
+        self._stats = {'hits': 0, 'misses': 0, 'stale_reloads': 0, 'stream_events': 0, 'stream_errors': 0}
+
+    # --- lifecycle ---
+    def start(self):
+        """Opens the listen() stream. Safe to call more than once."""
+        with self._lock:
+            if self._listener is not None:
+                return
+            try:
+                self._listener = db.reference(self.path, memoize=False).listen(self._on_event)
+                print(f">> Live cache listening on '{self.path}'.")
+            except Exception as e:
+                self._stats['stream_errors'] += 1
+                print(f"!!! Live cache stream for '{self.path}' failed, using TTL reloads: {e}", file=sys.stderr)
+
+    def stop(self):
+        with self._lock:
+            if self._listener is not None:
+                try:
+                    self._listener.close()
+                except Exception as e:
+                    print(f"!!! Error closing live cache stream for '{self.path}': {e}", file=sys.stderr)
+                self._listener = None
+
+    # --- stream handling ---
+    def _on_event(self, event):
+        try:
+            parts = _split_path(event.path)
+            with self._lock:
+                self._stats['stream_events'] += 1
+                if event.event_type == 'put':
+                    self._data = _set_in(self._data, parts, event.data)
+                elif event.event_type == 'patch' and isinstance(event.data, dict):
+                    for key, value in event.data.items():
+                        self._data = _set_in(self._data, parts + _split_path(key), value)
+                self._loaded = True
+                self._refreshed_at = time.time()
+            self._on_change(parts, event)
+        except Exception as e:
+            self._stats['stream_errors'] += 1
+            print(f"!!! Live cache event error on '{self.path}': {e}", file=sys.stderr)
+
+    def _on_change(self, parts, event):
+        """Hook for subclasses that maintain derived indexes."""
+        pass
+
+    # --- reads ---
+    def _is_fresh(self):
+        age = time.time() - self._refreshed_at
+        limit = self.max_age_seconds if self._listener is not None else self.ttl_seconds
+        return age < limit
+
+    def reload(self):
+        data = db.reference(self.path, memoize=False).get()
+        with self._lock:
+            self._data = data
+            self._loaded = True
+            self._refreshed_at = time.time()
+        self._on_change([], None)
+        return data
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if self._loaded and self._is_fresh():
+                self._stats['hits'] += 1
+                return
+            if self._loaded:
+                self._stats['stale_reloads'] += 1
+            else:
+                self._stats['misses'] += 1
+        self.reload()
+
+    def get(self, path='', default=None):
+        """Returns a deep copy of the value at `path` (relative to the mirrored node)."""
+        self._ensure_loaded()
+        with self._lock:
+            value = _get_in(self._data, _split_path(path))
+            return copy.deepcopy(value) if value is not None else default
+
+    def _peek(self, path=''):
+        """Current value at `path` without freshness checks or stats (for derived indexes)."""
+        with self._lock:
+            return _get_in(self._data, _split_path(path))
+
+    def snapshot(self, path=''):
+        """
+        Returns the current value at `path` without copying it.
+        The result is a consistent point-in-time view that later events never
+        modify, but callers must treat it as read-only.
+        """
+        self._ensure_loaded()
+        with self._lock:
+            return _get_in(self._data, _split_path(path))
+
+    # --- local write-through ---
+    def apply(self, path, value):
+        """Mirrors a set() that this process just made so the next read sees it immediately."""
+        parts = _split_path(path)
+        with self._lock:
+            if not self._loaded:
+                return
+            self._data = _set_in(self._data, parts, copy.deepcopy(value))
+        self._on_change(parts, None)
+
+    def apply_update(self, path, values):
+        """Mirrors an update() that this process just made."""
+        for key, value in (values or {}).items():
+            self.apply(f"{path}/{key}", value)
+
+    def invalidate(self):
+        with self._lock:
+            self._refreshed_at = 0.0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['path'] = self.path
+            stats['streaming'] = self._listener is not None
+            stats['loaded'] = self._loaded
+            stats['age_seconds'] = round(time.time() - self._refreshed_at, 1) if self._loaded else None
+            return stats
+
+
+site_settings = LiveNodeCache('site_settings')
+
+
+def get_settings(name, default=None):
+    """Cached replacement for db.reference(f'site_settings/{name}').get()."""
+    return site_settings.get(name, default)
+
+# --- END OF FILE project/live_cache.py ---
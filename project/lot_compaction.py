@@ -0,0 +1,110 @@
+﻿# --- START OF FILE project/lot_compaction.py ---
+import numpy as np
+from .storage import db, generate_push_id
+from .read_fanout import read_parallel
+from .valuation import lot_arrays
+
+COMPACTION_PAGE_SIZE = 200
+DEFAULT_MIN_LOTS = 10
+
+
+def merged_lots(positions, lot_position, lots, lock_seconds, now, min_lots=DEFAULT_MIN_LOTS):
+    """
+    Merges the unlocked lots (bought more than `lock_seconds` ago) of every position that
+    has at least `min_lots` of them into one lot. Returns {position index: (merged lot ids,
+    new lot)}.
+
+    The new lot keeps the value of the lots it replaces at any points level: its sp and
+    original_sp are the sums, and its entry points are the SP-weighted harmonic mean
+    p = Σ sp / Σ (sp / p), so sp × (points / p) equals the sum of the lots' values.
+    Only the sell tax can differ: it is charged per lot on its own profit, so winning and
+    losing lots merged together are taxed on their net profit afterwards.
+    """
+    unlocked = lots['t'] <= now - lock_seconds
+    where = lot_position[unlocked]
+    size = len(positions)
+    counts = np.bincount(where, minlength=size)
+    sp = np.bincount(where, weights=lots['sp'][unlocked], minlength=size)
+    units = np.bincount(where, weights=(lots['sp'] / lots['points_at'])[unlocked], minlength=size)
+    cost = np.bincount(where, weights=lots['cost'][unlocked], minlength=size)
+    latest = np.zeros(size)
+    np.maximum.at(latest, where, lots['t'][unlocked])
+
+    merges = {}
+    for index in np.flatnonzero(counts >= max(2, min_lots)).tolist():
+        ids = [lots['ids'][i] for i in np.flatnonzero(unlocked & (lot_position == index)).tolist()]
+        merges[index] = (ids, {
+            'sp': float(sp[index]),
+            'p': float(sp[index] / units[index]) if units[index] > 0 else 1.0,
+            't': int(latest[index]),
+            'original_sp': float(cost[index]),
+            'merged_lots': len(ids),
+        })
+    return merges
+
+
+class _LotsChanged(Exception):
+    pass
+
+
+class LotCompaction:
+    """
+    Streams over investments/ page by page and replaces the unlocked lots of crowded
+    positions with one consolidated lot. Pages are read in parallel only to find the
+    positions worth merging; each merge is then a transaction on that position's lots
+    and is skipped when its lot set no longer matches the page read (a lot was sold,
+    bought or the position closed meanwhile), so no lot is ever paid out and merged.
+    """
+
+    def __init__(self, crawlers, lock_seconds, now, min_lots=DEFAULT_MIN_LOTS):
+        self.crawlers = crawlers
+        self.lock_seconds = lock_seconds
+        self.now = now
+        self.min_lots = min_lots
+        self.stats = {'users': 0, 'positions': 0, 'lots_merged': 0, 'skipped': 0}
+
+    def run(self):
+        uids = sorted((db.reference('investments', memoize=False).get(shallow=True) or {}).keys())
+        for start in range(0, len(uids), COMPACTION_PAGE_SIZE):
+            self._compact_page(uids[start:start + COMPACTION_PAGE_SIZE])
+        return self.stats
+
+    def _compact_page(self, page_uids):
+        results = read_parallel({uid: f'investments/{uid}' for uid in page_uids})
+        positions, lot_position, lots = lot_arrays({uid: results.get(uid) for uid in page_uids}, self.crawlers)
+        self.stats['users'] += len(page_uids)
+        if not positions:
+            return
+        merges = merged_lots(positions, lot_position, lots, self.lock_seconds, self.now, self.min_lots)
+        for index, (ids, new_lot) in merges.items():
+            uid, crawler_name, _ = positions[index]
+            read_ids = set(results[uid][crawler_name]['lots'])
+            if self._merge_position(f'investments/{uid}/{crawler_name}/lots', read_ids, ids, new_lot):
+                self.stats['positions'] += 1
+                self.stats['lots_merged'] += len(ids)
+            else:
+                self.stats['skipped'] += 1
+
+    @staticmethod
+    def _merge_position(lots_path, read_ids, ids, new_lot):
+        new_id = generate_push_id()
+
+        def merge(current):
+            # أي بيع أو شراء أو إغلاق بعد القراءة يغير مجموعة الدفعات، فيُترك المركز لدورة لاحقة
+            if not isinstance(current, dict) or set(current) != read_ids:
+                raise _LotsChanged()
+            merged = {lot_id: lot for lot_id, lot in current.items() if lot_id not in ids}
+            merged[new_id] = new_lot
+            return merged
+
+        try:
+            db.reference(lots_path, memoize=False).transaction(merge)
+        except _LotsChanged:
+            return False
+        return True
+
+
+def compact_lots(crawlers, lock_seconds, now, min_lots=DEFAULT_MIN_LOTS):
+    return LotCompaction(crawlers, lock_seconds, now, min_lots).run()
+
+# --- END OF FILE project/lot_compaction.py ---
@@ -0,0 +1,177 @@
+﻿# --- START OF FILE project/market_scan.py ---
+import sys
+import time
+import numpy as np
+from .storage import db, generate_push_id
+from .read_fanout import read_parallel
+from .market_volatility import shared_rng
+from .valuation import lot_arrays, value_positions
+
+SCAN_PAGE_SIZE = 200
+SCAN_FLUSH_PATHS = 500
+WATCHLIST_PATH = 'market_watchlist'
+
+
+class PortfolioScan:
+    """
+    The SAM balance / rescue / jackpot passes as one streaming scan.
+
+    User ids are listed with a shallow read and processed SCAN_PAGE_SIZE at a time, so
+    only one page of investments and wallets is held in memory. Position values are
+    computed vectorized per page. Positions past the thresholds are written to
+    market_watchlist and corrected through their personal multiplier:
+    - balance: profit above `balance_profit_threshold` % and `balance_value_threshold` SP
+      is brought back down to the percentage threshold.
+    - rescue: holders with less than `rescue_wallet_threshold` SP in the wallet and a loss
+      above `rescue_loss_threshold` % are lifted back up to that loss.
+    - jackpot: with `jackpot_chance_percent` per run, one holder picked uniformly during
+      the scan gets `jackpot_multiplier` on their largest position.
+    Interventions are committed in multi-path updates of about SCAN_FLUSH_PATHS paths.
+    """
+
+    def __init__(self, settings, crawlers, rng=None):
+        self.settings = settings
+        self.crawlers = crawlers
+        self.rng = rng or shared_rng()
+        self.profit_threshold = float(settings.get('balance_profit_threshold') or 0)
+        self.value_threshold = float(settings.get('balance_value_threshold') or 0)
+        self.wallet_threshold = float(settings.get('rescue_wallet_threshold') or 0)
+        self.loss_threshold = float(settings.get('rescue_loss_threshold') or 0)
+        self.jackpot_multiplier = float(settings.get('jackpot_multiplier') or 0)
+        self.jackpot_armed = (self.jackpot_multiplier > 0 and
+                              self.rng.uniform(0, 100) < float(settings.get('jackpot_chance_percent', 0.5) or 0))
+        self.watchlist = {}
+        self.updates = {}
+        self.stats = {'users': 0, 'positions': 0, 'balanced': 0, 'rescued': 0, 'jackpot': None}
+        self._jackpot_pick = None
+        self._jackpot_seen = 0
+
+    @property
+    def balance_enabled(self):
+        return self.profit_threshold > 0 or self.value_threshold > 0
+
+    @property
+    def rescue_enabled(self):
+        return self.wallet_threshold > 0 and self.loss_threshold > 0
+
+    # --- scan ---
+    def run(self):
+        if not (self.balance_enabled or self.rescue_enabled or self.jackpot_armed):
+            return self.stats
+        uids = sorted((db.reference('investments', memoize=False).get(shallow=True) or {}).keys())
+        for start in range(0, len(uids), SCAN_PAGE_SIZE):
+            self._scan_page(uids[start:start + SCAN_PAGE_SIZE])
+        self._apply_jackpot()
+        self.updates[WATCHLIST_PATH] = self.watchlist or None
+        self._flush()
+        return self.stats
+
+    def _scan_page(self, page_uids):
+        reads = {f'i:{uid}': f'investments/{uid}' for uid in page_uids}
+        if self.rescue_enabled:
+            reads.update({f'w:{uid}': f'wallets/{uid}/sp' for uid in page_uids})
+        results = read_parallel(reads)
+        page_investments = {uid: results.get(f'i:{uid}') for uid in page_uids}
+
+        positions, lot_position, lots = lot_arrays(page_investments, self.crawlers)
+        self.stats['users'] += len(page_uids)
+        self.stats['positions'] += len(positions)
+        if not positions:
+            return
+        totals = value_positions(positions, lot_position, lots)
+        values, costs = totals['value'], totals['cost']
+        ratios = np.divide(values, costs, out=np.ones_like(values), where=costs > 0)
+        profits = values - costs
+
+        if self.balance_enabled:
+            over = (costs > 0) & (ratios - 1 > self.profit_threshold / 100.0) & (profits > self.value_threshold)
+            for index in np.flatnonzero(over).tolist():
+                target = 1 + self.profit_threshold / 100.0
+                self._correct(positions[index], values[index], costs[index], target, 'balanced',
+                              f"ربح مفرط: {(ratios[index] - 1) * 100:,.0f}%")
+
+        if self.rescue_enabled:
+            wallets = np.array([float(results.get(f'w:{uid}') or 0) for uid, _, _ in positions])
+            under = (costs > 0) & (wallets < self.wallet_threshold) & (1 - ratios > self.loss_threshold / 100.0)
+            for index in np.flatnonzero(under).tolist():
+                target = 1 - self.loss_threshold / 100.0
+                self._correct(positions[index], values[index], costs[index], target, 'rescued',
+                              f"خسارة قاسية: {(1 - ratios[index]) * 100:,.0f}%")
+
+        if self.jackpot_armed:
+            self._consider_jackpot(positions, values)
+
+        if len(self.updates) >= SCAN_FLUSH_PATHS:
+            self._flush()
+
+    def _correct(self, position, value, cost, target_ratio, stat, reason):
+        """Scales the personal multiplier so the position is worth `target_ratio` × cost."""
+        uid, crawler_name, personal_multiplier = position
+        if value <= 0:
+            return
+        new_multiplier = personal_multiplier * (cost * target_ratio) / value
+        self.updates[f'investments/{uid}/{crawler_name}/personal_multiplier'] = new_multiplier
+        self.stats[stat] += 1
+        previous = self.watchlist.get(uid)
+        # مستخدم واحد = سطر واحد في قائمة المراقبة، نبقي الحالة ذات الفارق الأكبر
+        if previous is None or abs(value - cost) > previous['_gap']:
+            self.watchlist[uid] = {
+                '_gap': abs(value - cost),
+                'reason': reason,
+                'details': (f"{crawler_name}: القيمة {value:,.2f} SP مقابل تكلفة {cost:,.2f} SP، "
+                            f"المضاعف الشخصي {personal_multiplier:.3f} ← {new_multiplier:.3f}"),
+                'value': f"{value:,.0f} SP",
+                'timestamp': int(time.time()),
+            }
+
+    # --- jackpot ---
+    def _consider_jackpot(self, positions, values):
+        """Reservoir sampling over holders, so the pick is uniform without keeping the list."""
+        best = {}
+        for (uid, crawler_name, personal_multiplier), value in zip(positions, values.tolist()):
+            if uid not in best or value > best[uid][3]:
+                best[uid] = (uid, crawler_name, personal_multiplier, value)
+        for candidate in best.values():
+            self._jackpot_seen += 1
+            if self.rng.integers(self._jackpot_seen) == 0:
+                self._jackpot_pick = candidate
+
+    def _apply_jackpot(self):
+        if not self._jackpot_pick:
+            return
+        uid, crawler_name, personal_multiplier, _ = self._jackpot_pick
+        path = f'investments/{uid}/{crawler_name}/personal_multiplier'
+        # قد يكون المركز نفسه عُدل في هذه الدورة، فنبني على القيمة الجديدة
+        base = self.updates.get(path, personal_multiplier)
+        self.updates[path] = base * self.jackpot_multiplier
+        now = int(time.time())
+        self.updates[f'activity_log/{generate_push_id()}'] = {
+            'type': 'admin_edit',
+            'text': f"💎 الضربة الكبرى! استثمار في '{crawler_name}' حصل على مضاعف x{self.jackpot_multiplier:g}.",
+            'timestamp': now,
+        }
+        self.updates[f'user_messages/{uid}/{generate_push_id()}'] = {
+            'text': f"💎 مبروك! حصل استثمارك في '{crawler_name}' على مضاعف الضربة الكبرى x{self.jackpot_multiplier:g}.",
+            'timestamp': now,
+        }
+        self.stats['jackpot'] = uid
+
+    def _flush(self):
+        if not self.updates:
+            return
+        watchlist = self.updates.get(WATCHLIST_PATH)
+        if isinstance(watchlist, dict):
+            self.updates[WATCHLIST_PATH] = {uid: {k: v for k, v in item.items() if k != '_gap'} for uid, item in watchlist.items()}
+        try:
+            db.reference(memoize=False).update(self.updates)
+        except Exception as e:
+            print(f"!!! Portfolio scan update of {len(self.updates)} paths failed: {e}", file=sys.stderr)
+            raise
+        finally:
+            self.updates = {}
+
+
+def scan_portfolios(settings, crawlers, rng=None):
+    return PortfolioScan(settings, crawlers, rng).run()
+
+# --- END OF FILE project/market_scan.py ---
@@ -0,0 +1,119 @@
+﻿# --- START OF FILE project/market_volatility.py ---
+import os
+import time
+import numpy as np
+from .storage import generate_push_id
+
+MULTIPLIER_FLOOR = 0.20
+
+# ترتيب الأحداث ثابت: (اسم الحدث، مفتاح الحد الأدنى، مفتاح الحد الأعلى، مفتاح الفرصة، القيم الافتراضية، اتجاه الصعود)
+EVENTS = (
+    ('up', 'up_min_percent', 'up_max_percent', 'up_chance', (1.0, 5.0, 45), True),
+    ('down', 'down_min_percent', 'down_max_percent', 'down_chance', (1.0, 3.0, 40), False),
+    ('strong_up', 'strong_up_min_percent', 'strong_up_max_percent', 'strong_up_chance', (10.0, 25.0, 7.5), True),
+    ('crash', 'crash_min_percent', 'crash_max_percent', 'crash_chance', (8.0, 20.0, 7.5), False),
+)
+
+LOG_TEXTS = {
+    'up': "📈 ارتفاع طفيف بنسبة {percent:.1f}% في سوق الزاحف '{name}'!",
+    'down': "📉 انخفاض طفيف بنسبة {percent:.1f}% في سوق الزاحف '{name}'.",
+    'strong_up': "🚀 ارتفاع قوي بنسبة {percent:.1f}% في سوق الزاحف '{name}'!",
+    'crash': "💥 انهيار مفاجئ بنسبة {percent:.1f}% في سوق الزاحف '{name}'!",
+}
+
+
+def make_rng(seed=None):
+    """NumPy generator for the volatility tick; MARKET_RNG_SEED makes runs reproducible."""
+    if seed is None and os.getenv('MARKET_RNG_SEED'):
+        seed = int(os.getenv('MARKET_RNG_SEED'))
+    return np.random.default_rng(seed)
+
+
+_rng = make_rng()
+
+
+def shared_rng():
+    """The process-wide generator used by the scheduled market passes."""
+    return _rng
+
+
+def _event_table(volatility_settings):
+    lows, highs, weights, rising = [], [], [], []
+    for _, min_key, max_key, chance_key, defaults, up in EVENTS:
+        lows.append(float(volatility_settings.get(min_key, defaults[0])))
+        highs.append(float(volatility_settings.get(max_key, defaults[1])))
+        weights.append(float(volatility_settings.get(chance_key, defaults[2])))
+        rising.append(up)
+    return np.array(lows), np.array(highs), np.array(weights), np.array(rising)
+
+
+def volatility_tick(multipliers, volatility_settings, rng=None):
+    """
+    One volatility pass over all crawlers at once.
+
+    `multipliers` holds the current multiplier of each crawler. Every crawler rolls against
+    `chance_percent`; the ones that hit draw an event type by the configured weights and
+    a magnitude within that event's range, and rising events add it while falling ones
+    subtract it, floored at MULTIPLIER_FLOOR. Returns (indices, new multipliers, event
+    indices, percents) for the crawlers that moved, all as NumPy arrays.
+    """
+    rng = rng or _rng
+    current = np.asarray(multipliers, dtype=float)
+    empty = (np.array([], dtype=int), np.array([]), np.array([], dtype=int), np.array([]))
+    if current.size == 0:
+        return empty
+
+    lows, highs, weights, rising = _event_table(volatility_settings)
+    if weights.sum() <= 0:
+        return empty
+
+    chance = float(volatility_settings.get('chance_percent', 0))
+    hit = np.flatnonzero(rng.uniform(0, 100, current.size) < chance)
+    if hit.size == 0:
+        return empty
+
+    events = rng.choice(len(EVENTS), size=hit.size, p=weights / weights.sum())
+    percents = rng.uniform(lows[events], highs[events])
+    change = percents / 100.0
+    new_multipliers = np.maximum(MULTIPLIER_FLOOR, current[hit] + np.where(rising[events], change, -np.abs(change)))
+    return hit, new_multipliers, events, percents
+
+
+def volatility_step(multipliers, volatility_settings, rng=None):
+    """
+    The same draw as volatility_tick for an array of any shape (e.g. paths × crawlers in
+    the offline simulation), returning the full array of new multipliers.
+    """
+    rng = rng or _rng
+    current = np.asarray(multipliers, dtype=float)
+    lows, highs, weights, rising = _event_table(volatility_settings)
+    if current.size == 0 or weights.sum() <= 0:
+        return current.copy()
+
+    chance = float(volatility_settings.get('chance_percent', 0))
+    hit = rng.uniform(0, 100, current.shape) < chance
+    events = rng.choice(len(EVENTS), size=current.shape, p=weights / weights.sum())
+    change = rng.uniform(lows[events], highs[events]) / 100.0
+    moved = np.maximum(MULTIPLIER_FLOOR, current + np.where(rising[events], change, -np.abs(change)))
+    return np.where(hit, moved, current)
+
+
+def volatility_updates(crawlers, volatility_settings, rng=None):
+    """
+    Runs volatility_tick over the roster and returns one multi-path update holding the
+    new multipliers and their activity log entries, plus the number of crawlers moved.
+    """
+    names = list(crawlers.keys())
+    multipliers = [float((crawlers[name] or {}).get('stock_multiplier', 1.0)) for name in names]
+    hit, new_multipliers, events, percents = volatility_tick(multipliers, volatility_settings, rng)
+
+    updates = {}
+    now = int(time.time())
+    for index, multiplier, event, percent in zip(hit.tolist(), new_multipliers.tolist(), events.tolist(), percents.tolist()):
+        name = names[index]
+        updates[f'users/{name}/stock_multiplier'] = multiplier
+        text = LOG_TEXTS[EVENTS[event][0]].format(percent=abs(percent), name=name)
+        updates[f'activity_log/{generate_push_id()}'] = {'type': 'admin_edit', 'text': text, 'timestamp': now}
+    return updates, len(hit)
+
+# --- END OF FILE project/market_volatility.py ---
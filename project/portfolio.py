@@ -0,0 +1,131 @@
+﻿# --- START OF FILE project/portfolio.py ---
+import time
+import threading
+from collections import OrderedDict
+from .storage import db
+from .crawler_roster import roster
+from .live_cache import get_settings
+from .valuation import lot_arrays, sale_breakdown, value_positions
+
+_SETTINGS_FIELDS = ('investment_lock_hours', 'sell_tax_percent', 'sell_fee_sp', 'withdrawal_approval_limit')
+
+
+def _fingerprint(investments, crawlers, settings):
+    """Everything besides the lots that a portfolio's numbers depend on."""
+    market = tuple(sorted(
+        (name, (crawlers.get(name) or {}).get('points'), (crawlers.get(name) or {}).get('stock_multiplier'))
+        for name in (investments or {})
+    ))
+    return market, tuple(settings.get(field) for field in _SETTINGS_FIELDS)
+
+
+def build_portfolio(user_id, investments, crawlers, settings):
+    """
+    One user's positions valued like sell_lot would sell them: every lot with its value,
+    profit, tax and net proceeds after sell_fee_sp, and when its lock expires.
+    """
+    lock_seconds = int(settings.get('investment_lock_hours', 0) or 0) * 3600
+    tax_percent = settings.get('sell_tax_percent', 0.0)
+    fee = float(settings.get('sell_fee_sp', 0.0) or 0)
+    approval_limit = settings.get('withdrawal_approval_limit', 500000)
+
+    positions, lot_position, lots = lot_arrays({user_id: investments or {}}, crawlers)
+    rows = []
+    if positions:
+        sale = sale_breakdown(lots, tax_percent)
+        totals = value_positions(positions, lot_position, lots, tax_percent)
+        unlocks_at = lots['t'] + lock_seconds
+        for index, (_, crawler_name, personal_multiplier) in enumerate(positions):
+            crawler = crawlers.get(crawler_name) or {}
+            lot_rows = []
+            for i in (lot_position == index).nonzero()[0].tolist():
+                lot_rows.append({
+                    'id': lots['ids'][i], 'sp': float(lots['sp'][i]), 'original_sp': float(lots['cost'][i]),
+                    'p': float(lots['points_at'][i]), 't': int(lots['t'][i]), 'unlocks_at': int(unlocks_at[i]),
+                    'value': float(sale['value'][i]), 'profit': float(sale['profit'][i]), 'tax': float(sale['tax'][i]),
+                    'net': float(sale['net'][i]) - fee, 'needs_approval': bool(sale['value'][i] > approval_limit),
+                })
+            lot_rows.sort(key=lambda lot: lot['t'])
+            rows.append({
+                'crawler_name': crawler_name, 'personal_multiplier': personal_multiplier,
+                'points': crawler.get('points', 0), 'stock_multiplier': crawler.get('stock_multiplier', 1.0),
+                'value': float(totals['value'][index]), 'cost': float(totals['cost'][index]),
+                'profit': float(totals['profit'][index]), 'tax': float(totals['tax'][index]),
+                # بيع كل الدفعات واحدة تلو الأخرى: الرسوم تُخصم من كل دفعة
+                'net': float(totals['net'][index]) - fee * len(lot_rows),
+                'lots': lot_rows,
+            })
+    rows.sort(key=lambda row: row['value'], reverse=True)
+    summary = {key: sum(row[key] for row in rows) for key in ('value', 'cost', 'profit', 'tax', 'net')}
+    summary.update({'positions': len(rows), 'lots': sum(len(row['lots']) for row in rows)})
+    return {'positions': rows, 'summary': summary,
+            'settings': {field: settings.get(field) for field in _SETTINGS_FIELDS}}
+
+
+class PortfolioCache:
+    """
+    Built portfolios per user, so /api/portfolio only recomputes when something changed.
+
+    An entry is reused while investments/{uid} keeps the same ETag (checked with a
+    conditional read that carries no data when nothing changed) and the points and
+    stock multipliers of the crawlers it holds, taken from the live roster, and the
+    investment settings are the ones it was built with. Least recently used entries
+    are dropped past `max_entries`. Lock state is derived per response from unlocks_at.
+    """
+
+    def __init__(self, max_entries=2000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._stats = {'hits': 0, 'misses': 0, 'lot_changes': 0, 'market_changes': 0}
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+        reference = db.reference(f'investments/{user_id}', memoize=False)
+        if entry is not None:
+            changed, investments, etag = reference.get_if_changed(entry['etag'])
+            if not changed:
+                investments, etag = entry['investments'], entry['etag']
+        else:
+            changed = True
+            investments, etag = reference.get(etag=True)
+
+        crawlers, settings = roster.all(), get_settings('investment_settings', {}) or {}
+        fingerprint = _fingerprint(investments, crawlers, settings)
+        with self._lock:
+            if entry is not None and not changed and entry['fingerprint'] == fingerprint:
+                self._stats['hits'] += 1
+                self._entries.move_to_end(user_id)
+                return self._serve(entry['portfolio'])
+            self._stats['misses'] += 1
+            if entry is not None:
+                self._stats['lot_changes' if changed else 'market_changes'] += 1
+
+        portfolio = build_portfolio(user_id, investments, crawlers, settings)
+        with self._lock:
+            self._entries[user_id] = {'etag': etag, 'investments': investments, 'fingerprint': fingerprint, 'portfolio': portfolio}
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return self._serve(portfolio)
+
+    @staticmethod
+    def _serve(portfolio):
+        now = int(time.time())
+        positions = [dict(row, lots=[dict(lot, locked=lot['unlocks_at'] > now) for lot in row['lots']])
+                     for row in portfolio['positions']]
+        return dict(portfolio, positions=positions, server_time=now)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries))
+
+
+portfolio_cache = PortfolioCache()
+
+# --- END OF FILE project/portfolio.py ---
@@ -0,0 +1,92 @@
+﻿# --- START OF FILE project/rank_index.py ---
+import threading
+from sortedcontainers import SortedList
+
+
+def _to_points(value):
+    try:
+        return float(value or 0)
+    except (ValueError, TypeError):
+        return 0.0
+
+
+def _as_number(points):
+    return int(points) if float(points).is_integer() else points
+
+
+class RankIndex:
+    """
+    Order-statistic index of crawlers by points (highest first, ties by name).
+
+    Backed by a SortedList keyed by (-points, name), so rank lookups, neighbours
+    and top-N are logarithmic instead of sorting every crawler per request.
+    Rank 0 is the leader.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = SortedList()
+        self._points = {}
+
+    def rebuild(self, crawlers):
+        entries, points = [], {}
+        for name, data in (crawlers or {}).items():
+            if not isinstance(data, dict):
+                continue
+            p = _to_points(data.get('points', 0))
+            entries.append((-p, name))
+            points[name] = p
+        with self._lock:
+            self._entries = SortedList(entries)
+            self._points = points
+
+    def update(self, name, points):
+        """Inserts or moves one crawler. `points=None` removes it."""
+        with self._lock:
+            old = self._points.pop(name, None)
+            if old is not None:
+                self._entries.discard((-old, name))
+            if points is not None:
+                p = _to_points(points)
+                self._points[name] = p
+                self._entries.add((-p, name))
+
+    def remove(self, name):
+        self.update(name, None)
+
+    def rank_of(self, name):
+        """0-based rank of `name`, or None if it is not indexed."""
+        with self._lock:
+            p = self._points.get(name)
+            if p is None:
+                return None
+            return self._entries.index((-p, name))
+
+    def _neighbour(self, name, offset):
+        with self._lock:
+            p = self._points.get(name)
+            if p is None:
+                return None
+            i = self._entries.index((-p, name)) + offset
+            if i < 0 or i >= len(self._entries):
+                return None
+            neg_points, other = self._entries[i]
+            return other, _as_number(-neg_points)
+
+    def neighbour_above(self, name):
+        """(name, points) of the crawler ranked directly above, or None for the leader."""
+        return self._neighbour(name, -1)
+
+    def neighbour_below(self, name):
+        """(name, points) of the crawler ranked directly below, or None for the last one."""
+        return self._neighbour(name, 1)
+
+    def top(self, n):
+        with self._lock:
+            return [(name, _as_number(-neg_points)) for neg_points, name in self._entries[:max(0, n)]]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+# --- END OF FILE project/rank_index.py ---
@@ -0,0 +1,74 @@
+﻿# --- START OF FILE project/read_fanout.py ---
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .storage import db
+from .request_cache import current_cache, MISSING
+from .job_telemetry import current_counter, bind_counter
+
+READ_WORKERS = int(os.getenv('DB_READ_WORKERS', '16'))
+
+_pool = ThreadPoolExecutor(max_workers=READ_WORKERS, thread_name_prefix='db-read')
+_local = threading.local()
+
+
+def _run(read, counter=None):
+    _local.in_pool = True
+    previous = bind_counter(counter)
+    try:
+        if callable(read):
+            return read()
+        return db.reference(read, memoize=False).get()
+    finally:
+        bind_counter(previous)
+        _local.in_pool = False
+
+
+def _read_inline(reads):
+    return {name: (read() if callable(read) else db.reference(read).get()) for name, read in reads.items()}
+
+
+def read_parallel(reads):
+    """
+    Runs independent reads concurrently and returns their results under the same keys.
+
+    `reads` maps a name to a database path (read with .get()) or to a zero-argument
+    callable for anything else. The request waits for the slowest read instead of the
+    sum of all of them. If any read fails its exception is raised once all have finished.
+    Calls made from inside a pool thread run inline so nested fan-outs cannot starve the pool,
+    and so do calls made once interpreter shutdown has closed the pool.
+    Path reads go through the request read cache: hits are not re-fetched and
+    fetched values are stored for later reads in the same request.
+    """
+    if len(reads) <= 1 or getattr(_local, 'in_pool', False):
+        return _read_inline(reads)
+
+    cache = current_cache()
+    results, pending = {}, {}
+    for name, read in reads.items():
+        cached = cache.lookup(read) if cache is not None and not callable(read) else MISSING
+        if cached is MISSING:
+            pending[name] = read
+        else:
+            results[name] = cached
+
+    counter = current_counter()
+    try:
+        futures = {name: _pool.submit(_run, read, counter) for name, read in pending.items()}
+    except RuntimeError:
+        # بعد بدء إغلاق المفسر لا يقبل المجمع مهاماً جديدة (مثل التفريغ الأخير في atexit)، فتُقرأ بالتتابع
+        results.update(_read_inline(pending))
+        return results
+    error = None
+    for name, future in futures.items():
+        try:
+            results[name] = future.result()
+            if cache is not None and not callable(pending[name]):
+                cache.store(pending[name], results[name])
+        except Exception as e:
+            error = error or e
+    if error is not None:
+        raise error
+    return results
+
+# --- END OF FILE project/read_fanout.py ---
@@ -0,0 +1,125 @@
+﻿# --- START OF FILE project/request_cache.py ---
+import copy
+from flask import g, has_request_context
+
+MISSING = object()
+
+
+def _split(path):
+    return [part for part in (path or '').strip('/').split('/') if part]
+
+
+def _child_of(value, parts):
+    node = value
+    for part in parts:
+        if isinstance(node, list) and part.isdigit() and int(part) < len(node):
+            node = node[int(part)]
+        elif isinstance(node, dict):
+            node = node.get(part)
+        else:
+            return None
+        if node is None:
+            return None
+    return node
+
+
+class RequestReadCache:
+    """
+    Values read during one request, keyed by path.
+
+    A cached parent also answers reads of anything below it, and a write drops the
+    written path together with its cached ancestors and descendants.
+    Values are copied on the way in and out, so callers may mutate what they get.
+    """
+
+    def __init__(self):
+        self._entries = {}
+
+    def lookup(self, path):
+        parts = _split(path)
+        for i in range(len(parts), -1, -1):
+            value = self._entries.get('/'.join(parts[:i]), MISSING)
+            if value is not MISSING:
+                return copy.deepcopy(_child_of(value, parts[i:]))
+        return MISSING
+
+    def store(self, path, value):
+        self._entries['/'.join(_split(path))] = copy.deepcopy(value)
+
+    def invalidate(self, path):
+        key = '/'.join(_split(path))
+        prefix = key + '/' if key else ''
+        for cached in list(self._entries):
+            if cached == key or cached.startswith(prefix) or key.startswith(cached + '/') or cached == '':
+                del self._entries[cached]
+
+
+def current_cache():
+    """The read cache of the current request, or None outside a request."""
+    if not has_request_context():
+        return None
+    if 'read_cache' not in g:
+        g.read_cache = RequestReadCache()
+    return g.read_cache
+
+
+class MemoizedReference:
+    """
+    Wraps a backend reference so plain get() calls are served from the request cache
+    and writes through it invalidate what they touch. Everything else is delegated.
+    """
+
+    def __init__(self, reference):
+        self._reference = reference
+
+    def __getattr__(self, name):
+        return getattr(self._reference, name)
+
+    def _invalidate(self, *relative_paths):
+        cache = current_cache()
+        if cache is None:
+            return
+        base = self._reference.path or '/'
+        for relative in relative_paths or ('',):
+            cache.invalidate(f"{base.rstrip('/')}/{relative}")
+
+    @property
+    def parent(self):
+        parent = self._reference.parent
+        return MemoizedReference(parent) if parent is not None else None
+
+    def child(self, path):
+        return MemoizedReference(self._reference.child(path))
+
+    def get(self, etag=False, shallow=False):
+        cache = current_cache()
+        if cache is None or etag or shallow:
+            return self._reference.get(etag=etag, shallow=shallow)
+        value = cache.lookup(self._reference.path)
+        if value is MISSING:
+            value = self._reference.get()
+            cache.store(self._reference.path, value)
+        return value
+
+    def set(self, value):
+        self._invalidate()
+        return self._reference.set(value)
+
+    def update(self, value):
+        if isinstance(value, dict):
+            self._invalidate(*value.keys())
+        return self._reference.update(value)
+
+    def push(self, value=''):
+        self._invalidate()
+        return self._reference.push(value)
+
+    def delete(self):
+        self._invalidate()
+        return self._reference.delete()
+
+    def transaction(self, transaction_update):
+        self._invalidate()
+        return self._reference.transaction(transaction_update)
+
+# --- END OF FILE project/request_cache.py ---
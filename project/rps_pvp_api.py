@@ -3,18 +3,24 @@ import time
 import random
 import sys
 from flask import Blueprint, request, jsonify, session
-from firebase_admin import db
+from .storage import db
 from .utils import login_required
+from .live_cache import get_settings, site_settings
+from . import wallet_service
 
 bp = Blueprint('rps_pvp_api', __name__)
 
 CHALLENGES_REF = db.reference('rps_challenges')
-WALLETS_REF = db.reference('wallets')
 SETTINGS_REF = db.reference('site_settings/rps_game')
 
 
 def get_game_settings():
-    return SETTINGS_REF.get() or {}
+    return get_settings('rps_game', {})
+
+def _lock_game(cooldown_seconds):
+    lock_until = int(time.time()) + cooldown_seconds
+    SETTINGS_REF.update({'lock_until': lock_until})
+    site_settings.apply('rps_game/lock_until', lock_until)
 
 @bp.route('/challenge/create', methods=['POST'])
 @login_required
@@ -44,13 +50,10 @@ def create_challenge():
     if bet_amount > max_bet:
         return jsonify(success=False, message=f"الحد الأقصى للرهان هو {max_bet} SP."), 400
 
-    wallet_ref = WALLETS_REF.child(user_id).child('sp')
-    current_sp = wallet_ref.get() or 0
-    if current_sp < bet_amount:
+    if not wallet_service.debit(user_id, 'sp', bet_amount):
         return jsonify(success=False, message="رصيد SP لديك غير كافٍ لإنشاء هذا التحدي."), 400
 
     try:
-        wallet_ref.set(current_sp - bet_amount)
         new_challenge = CHALLENGES_REF.push()
         challenge_data = {
             'player1': {'uid': user_id, 'name': user_name},
@@ -66,7 +69,7 @@ def create_challenge():
         new_challenge.set(challenge_data)
         return jsonify(success=True, message="تم إنشاء التحدي بنجاح!", challenge_id=new_challenge.key)
     except Exception as e:
-        wallet_ref.set(current_sp)
+        wallet_service.credit(user_id, 'sp', bet_amount)
         print(f"!!! Create RPS Challenge Error: {e}", file=sys.stderr)
         return jsonify(success=False, message="حدث خطأ في الخادم أثناء إنشاء التحدي."), 500
 
@@ -89,20 +92,27 @@ def join_challenge():
         return jsonify(success=False, message="معرف التحدي مفقود."), 400
 
     challenge_ref = CHALLENGES_REF.child(challenge_id)
-    
-    def transaction_join(challenge_data):
+
+    def check_joinable(challenge_data):
         if not challenge_data or challenge_data.get('status') != 'open':
             raise ValueError("التحدي لم يعد متاحاً.")
         if challenge_data['player1']['uid'] == user_id:
             raise ValueError("لا يمكنك الانضمام لتحدي أنشأته بنفسك.")
-        
-        bet_amount = challenge_data.get('bet_amount', 0)
-        wallet_ref = WALLETS_REF.child(user_id).child('sp')
-        current_sp = wallet_ref.get() or 0
-        if current_sp < bet_amount:
-            raise ValueError("رصيد SP لديك غير كافٍ للانضمام لهذا التحدي.")
-            
-        wallet_ref.set(current_sp - bet_amount)
+
+    # الخصم يتم مرة واحدة خارج الـ transaction (التي قد تُعاد عدة مرات عند التعارض)
+    try:
+        challenge_data = challenge_ref.get()
+        check_joinable(challenge_data)
+    except ValueError as e:
+        return jsonify(success=False, message=str(e)), 400
+    bet_amount = challenge_data.get('bet_amount', 0)
+    if not wallet_service.debit(user_id, 'sp', bet_amount):
+        return jsonify(success=False, message="رصيد SP لديك غير كافٍ للانضمام لهذا التحدي."), 400
+
+    def transaction_join(challenge_data):
+        check_joinable(challenge_data)
+        if challenge_data.get('bet_amount', 0) != bet_amount:
+            raise ValueError("التحدي لم يعد متاحاً.")
         
         if 'game_state' not in challenge_data:
             challenge_data['game_state'] = {
@@ -121,9 +131,11 @@ def join_challenge():
         challenge_ref.transaction(transaction_join)
         return jsonify(success=True, message="لقد انضممت للتحدي! اللعبة ستبدأ الآن.")
     except ValueError as e:
+        wallet_service.credit(user_id, 'sp', bet_amount)
         return jsonify(success=False, message=str(e)), 400
     except Exception as e:
         print(f"!!! Join RPS Challenge Error: {e}", file=sys.stderr)
+        wallet_service.credit(user_id, 'sp', bet_amount)
         return jsonify(success=False, message="حدث خطأ في الخادم."), 500
 
 @bp.route('/challenge/play', methods=['POST'])
@@ -210,18 +222,18 @@ def play_challenge_round():
             if winner_key and winner_key != 'draw':
                 winner_uid = final_state[winner_key]['uid']
                 total_pot = bet_amount * 2
-                WALLETS_REF.child(winner_uid).child('sp').transaction(lambda current: (current or 0) + total_pot)
+                wallet_service.credit(winner_uid, 'sp', total_pot)
             elif winner_key == 'draw':
                 p1_uid = final_state['player1']['uid']
                 p2_uid = final_state.get('player2', {}).get('uid')
-                WALLETS_REF.child(p1_uid).child('sp').transaction(lambda current: (current or 0) + bet_amount)
+                wallet_service.credit(p1_uid, 'sp', bet_amount)
                 if p2_uid:
-                    WALLETS_REF.child(p2_uid).child('sp').transaction(lambda current: (current or 0) + bet_amount)
+                    wallet_service.credit(p2_uid, 'sp', bet_amount)
             
             settings = get_game_settings()
             cooldown_seconds = settings.get('cooldown_seconds', 60)
             if cooldown_seconds > 0:
-                SETTINGS_REF.update({'lock_until': int(time.time()) + cooldown_seconds})
+                _lock_game(cooldown_seconds)
 
         return jsonify(success=True, message="تم تسجيل حركتك.")
 
@@ -267,7 +279,7 @@ def surrender_challenge():
         total_pot = bet_amount * 2
 
         # 1. دفع الأرباح للفائز
-        WALLETS_REF.child(winner_uid).child('sp').transaction(lambda current: (current or 0) + total_pot)
+        wallet_service.credit(winner_uid, 'sp', total_pot)
         
         # 2. تحديث حالة اللعبة
         challenge_ref.update({
@@ -280,7 +292,7 @@ def surrender_challenge():
         settings = get_game_settings()
         cooldown_seconds = settings.get('cooldown_seconds', 60)
         if cooldown_seconds > 0:
-            SETTINGS_REF.update({'lock_until': int(time.time()) + cooldown_seconds})
+            _lock_game(cooldown_seconds)
         
         return jsonify(success=True, message="لقد استسلمت. تم تحويل الرهان للخصم.")
 
@@ -304,7 +316,7 @@ def cancel_challenge():
 
     try:
         bet_amount = challenge_data.get('bet_amount', 0)
-        WALLETS_REF.child(user_id).child('sp').transaction(lambda current: (current or 0) + bet_amount)
+        wallet_service.credit(user_id, 'sp', bet_amount)
         challenge_ref.delete()
         return jsonify(success=True, message="تم إلغاء التحدي وإعادة الرهان.")
     except Exception as e:
@@ -3,31 +3,83 @@
 import time
 import random
 import sys
+from datetime import datetime
 from flask import current_app
-from firebase_admin import db
+from .storage import db
+from .live_cache import get_settings
+from .crawler_roster import roster
+from .read_fanout import read_parallel
+from . import sharded_counter
+from . import contest_payouts
+from . import market_volatility
+from . import market_scan
+from . import lot_compaction
+from .leaderboards import richest
+from .job_telemetry import telemetry, instrumented
+from .utils import LIVE_FEED_ROOT, live_feed_bucket, is_live_feed_bucket, NUDGE_EXPIRY_ROOT, nudge_expiry_bucket
 
+@instrumented
 def clean_old_notifications(app):
     with app.app_context():
         print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Running Old Notifications Cleaner...")
         try:
-            settings = db.reference('site_settings/cleanup_settings').get() or {}
+            settings = get_settings('cleanup_settings', {})
             lifespan_hours = settings.get('notifications_lifespan_hours', 24)
             
-            feed_ref = db.reference('live_feed')
+            feed_ref = db.reference(LIVE_FEED_ROOT, memoize=False)
             cutoff_timestamp = int(time.time()) - (lifespan_hours * 3600)
-            old_notifications = feed_ref.order_by_child('timestamp').end_at(cutoff_timestamp).get()
-            if old_notifications:
-                updates = {key: None for key in old_notifications.keys()}
+            # الإشعارات مقسمة إلى دلاء ساعية، فنقرأ أسماء الدلاء فقط (shallow) ونحذف
+            # كل دلو انتهت ساعته بالكامل قبل الحد، بدون أي استعلام على المحتوى.
+            cutoff_bucket = live_feed_bucket(cutoff_timestamp)
+            keys = feed_ref.get(shallow=True) or {}
+            updates = {key: None for key in keys if is_live_feed_bucket(key) and key < cutoff_bucket}
+
+            # إشعارات قديمة مكتوبة بالشكل المسطح السابق (قبل الدلاء) تُحذف بالاستعلام القديم حتى تنفد.
+            if any(not is_live_feed_bucket(key) for key in keys):
+                legacy = feed_ref.order_by_child('timestamp').end_at(cutoff_timestamp).get() or {}
+                updates.update({key: None for key in legacy if not is_live_feed_bucket(key)})
+
+            if updates:
                 feed_ref.update(updates)
-                print(f"Cleaner removed {len(updates)} old notifications.")
+                print(f"Cleaner removed {len(updates)} old notification buckets/entries.")
         except Exception as e:
             print(f"!!! Error in clean_old_notifications: {e}", file=sys.stderr)
+            telemetry.record_error('clean_old_notifications', e)
+
+@instrumented
+def fold_counter_shards(app):
+    with app.app_context():
+        try:
+            folded = sharded_counter.fold_all()
+            if folded:
+                print(f"Counter fold merged pending increments for {folded} keys.")
+        except Exception as e:
+            print(f"!!! Error in fold_counter_shards: {e}", file=sys.stderr)
+            telemetry.record_error('fold_counter_shards', e)
+
+# نكزات ما قبل فهرس الانتهاء لا تظهر فيه، فيبقى المسح القديم لكل user_nudges حتى يتجاوز حد
+# الانتهاء وقت بدء هذه العملية مرة واحدة؛ بعدها تكون كل نكزة قديمة قد حُذفت.
+_LEGACY_NUDGES_BEFORE = int(time.time())
+_legacy_nudges_cleared = False
 
+def _legacy_incoming_nudges(cutoff_timestamp):
+    updates = {}
+    all_user_nudges = db.reference('user_nudges').get()
+    if all_user_nudges:
+        for user_id, nudges in all_user_nudges.items():
+            if 'incoming' in nudges:
+                for nudge_id, nudge_data in nudges['incoming'].items():
+                    if nudge_data.get('timestamp', 0) < cutoff_timestamp:
+                        updates[f'user_nudges/{user_id}/incoming/{nudge_id}'] = None
+    return updates
+
+@instrumented
 def clean_old_nudges(app):
+    global _legacy_nudges_cleared
     with app.app_context():
         print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Running Old Nudges Cleaner...")
         try:
-            settings = db.reference('site_settings/cleanup_settings').get() or {}
+            settings = get_settings('cleanup_settings', {})
             lifespan_minutes = settings.get('nudges_lifespan_minutes', 5)
             
             updates = {}
@@ -39,89 +91,267 @@ def clean_old_nudges(app):
                 for key in old_public_nudges:
                     updates[f'public_nudges/{key}'] = None
             
-            all_user_nudges = db.reference('user_nudges').get()
-            if all_user_nudges:
-                for user_id, nudges in all_user_nudges.items():
-                    if 'incoming' in nudges:
-                        for nudge_id, nudge_data in nudges['incoming'].items():
-                            if nudge_data.get('timestamp', 0) < cutoff_timestamp:
-                                updates[f'user_nudges/{user_id}/incoming/{nudge_id}'] = None
+            # النكزات الخاصة: نقرأ من فهرس الانتهاء الدلاء التي انتهت دقيقتها بالكامل قبل الحد فقط،
+            # ونحذف المسارات المشار إليها مع الدلاء نفسها في نفس التحديث.
+            last_expired_bucket = nudge_expiry_bucket(cutoff_timestamp - 60)
+            expired_buckets = db.reference(NUDGE_EXPIRY_ROOT, memoize=False).order_by_key().end_at(last_expired_bucket).get()
+            for bucket, entries in (expired_buckets or {}).items():
+                for nudge_path in (entries or {}).values():
+                    if isinstance(nudge_path, str) and nudge_path.startswith('user_nudges/'):
+                        updates[nudge_path] = None
+                updates[f'{NUDGE_EXPIRY_ROOT}/{bucket}'] = None
+            
+            if not _legacy_nudges_cleared:
+                updates.update(_legacy_incoming_nudges(cutoff_timestamp))
             
             # <<< بداية التعديل: استخدام المرجع الفارغ بدلاً من الجذر >>>
             if updates:
                 db.reference().update(updates)
                 print(f"Nudge Cleaner removed {len(updates)} old nudges.")
             # <<< نهاية التعديل >>>
+            if not _legacy_nudges_cleared and cutoff_timestamp >= _LEGACY_NUDGES_BEFORE:
+                _legacy_nudges_cleared = True
+                print("Nudge Cleaner: pre-index nudges cleared, legacy scan disabled.")
         except Exception as e:
             print(f"!!! Error in clean_old_nudges: {e}", file=sys.stderr)
+            telemetry.record_error('clean_old_nudges', e)
+
+
+# --- الاحتفاظ بالسجلات: السجلات الأقدم من المدة المحددة تُلخص في تجميعات يومية ثم تُحذف ---
+LOG_ROLLUP_CHUNK = 500
+LOG_ROLLUP_MAX_CHUNKS = 20
+LOG_ROLLUP_DIMENSIONS = {
+    # log name: (type field, user field, crawler field, SP amount field)
+    'activity_log': ('type', 'user_id', None, None),
+    'investment_log': ('action', 'investor_id', 'target_name', 'sp_amount'),
+}
+
+def _rollup_key(value):
+    key = str(value) if value not in (None, '') else 'unknown'
+    for char in '.$#[]/':
+        key = key.replace(char, '_')
+    return key
+
+def _rollup_chunk(log_name, entries):
+    """Per-day counts (and SP sums) by type, user and crawler, as server increments."""
+    type_field, user_field, crawler_field, sp_field = LOG_ROLLUP_DIMENSIONS[log_name]
+    totals = {}
+
+    def add(path, amount):
+        totals[path] = totals.get(path, 0) + amount
+
+    for entry in entries.values():
+        if not isinstance(entry, dict):
+            continue
+        day = time.strftime('%Y-%m-%d', time.localtime(int(entry.get('timestamp') or 0)))
+        base = f'log_rollups/{log_name}/{day}'
+        sp = entry.get(sp_field) if sp_field else None
+        sp = sp if isinstance(sp, (int, float)) and not isinstance(sp, bool) else None
+        dimensions = [('by_type', entry.get(type_field)), ('by_user', entry.get(user_field))]
+        if crawler_field:
+            dimensions.append(('by_crawler', entry.get(crawler_field)))
+
+        add(f'{base}/count', 1)
+        if sp is not None:
+            add(f'{base}/sp', sp)
+        for dimension, value in dimensions:
+            add(f'{base}/{dimension}/{_rollup_key(value)}/count', 1)
+            if sp is not None:
+                add(f'{base}/{dimension}/{_rollup_key(value)}/sp', sp)
+
+    return {path: {'.sv': {'increment': amount}} for path, amount in totals.items()}
+
+@instrumented
+def rollup_old_logs(app):
+    with app.app_context():
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Running Log Retention & Rollup...")
+        settings = get_settings('cleanup_settings', {})
+        for log_name in LOG_ROLLUP_DIMENSIONS:
+            try:
+                retention_days = settings.get(f'{log_name}_retention_days', 30)
+                cutoff_timestamp = int(time.time()) - int(retention_days * 86400)
+                rolled = 0
+                for _ in range(LOG_ROLLUP_MAX_CHUNKS):
+                    old_entries = db.reference(log_name).order_by_child('timestamp').end_at(cutoff_timestamp).limit_to_first(LOG_ROLLUP_CHUNK).get()
+                    if not old_entries:
+                        break
+                    # التجميع وحذف السجلات في نفس التحديث، فلا يُحسب أي سجل مرتين
+                    updates = _rollup_chunk(log_name, old_entries)
+                    updates.update({f'{log_name}/{key}': None for key in old_entries})
+                    db.reference().update(updates)
+                    rolled += len(old_entries)
+                    if len(old_entries) < LOG_ROLLUP_CHUNK:
+                        break
+                if rolled:
+                    print(f"Log Rollup folded {rolled} '{log_name}' entries older than {retention_days} days.")
+            except Exception as e:
+                print(f"!!! Error in rollup_old_logs for '{log_name}': {e}", file=sys.stderr)
+                telemetry.record_error('rollup_old_logs', e)
+
+
+@instrumented
+def compact_investment_lots(app):
+    with app.app_context():
+        settings = get_settings('investment_settings', {}) or {}
+        if not settings.get('lot_compaction_enabled'):
+            return
+        print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Running Investment Lot Compaction...")
+        try:
+            lock_seconds = int(settings.get('investment_lock_hours', 0) or 0) * 3600
+            min_lots = int(settings.get('lot_compaction_min_lots') or lot_compaction.DEFAULT_MIN_LOTS)
+            stats = lot_compaction.compact_lots(roster.all(), lock_seconds, int(time.time()), min_lots)
+            print(f"Lot compaction: {stats}")
+        except Exception as e:
+            print(f"!!! Error in compact_investment_lots: {e}", file=sys.stderr)
+            telemetry.record_error('compact_investment_lots', e)
+
+
+@instrumented
+def rebuild_richest_leaderboard(app):
+    with app.app_context():
+        try:
+            leaderboard = richest.rebuild()
+            print(f"Richest leaderboard rebuilt ({len(leaderboard.get('wallet', []))} listed).")
+        except Exception as e:
+            print(f"!!! Error in rebuild_richest_leaderboard: {e}", file=sys.stderr)
+            telemetry.record_error('rebuild_richest_leaderboard', e)
+
 
+# --- المنافسة: مهمة لمرة واحدة (date job) عند end_timestamp بدل الفحص كل دقيقة ---
+CONTEST_JOB_ID = 'manage_contest_job'
+CONTEST_RETRY_SECONDS = 60
+CONTEST_META_FIELDS = ('status', 'end_timestamp', 'contestant1_name', 'contestant2_name',
+                       'contestant1_original_multiplier', 'contestant2_original_multiplier')
 
+def schedule_contest_job(app, run_at=None):
+    """
+    (Re)registers the one-shot contest job. Without `run_at` it runs in a few seconds,
+    which is how startup recovery and settings changes hand control back to
+    manage_popularity_contest; that run then schedules itself for the contest's end.
+    """
+    from . import scheduler
+    run_at = max(run_at or 0, time.time() + 2)
+    scheduler.add_job(id=CONTEST_JOB_ID, func=manage_popularity_contest, trigger='date',
+                      run_date=datetime.fromtimestamp(run_at), args=[app],
+                      replace_existing=True, misfire_grace_time=None)
+    print(f">> Popularity Contest job scheduled for {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(run_at))}.")
+
+def _read_contest_meta(contest_ref):
+    """Reads the contest fields in parallel, each on its own, so the vote map is never downloaded."""
+    reads = {field: contest_ref.child(field).get for field in CONTEST_META_FIELDS}
+    reads['.exists'] = lambda: contest_ref.get(shallow=True)
+    results = read_parallel(reads)
+    if not results.pop('.exists'):
+        return None
+    return results
+
+def _contest_vote_count(contest_ref, name):
+    """Running counter kept by claim_contest_vote."""
+    if not name:
+        return 0
+    return contest_ref.child(f'vote_counts/{name}').get() or 0
+
+def _backfill_vote_index(contest_ref, current_contest):
+    """
+    One-off for a contest started before the voters index existed: builds voters/{uid}
+    and vote_counts from the ballots once, so claims and finalization can rely on them.
+    """
+    if contest_ref.child('vote_counts').get(shallow=True) is not None:
+        return
+    votes = contest_ref.child('votes').get() or {}
+    updates = {}
+    for name in (current_contest.get('contestant1_name'), current_contest.get('contestant2_name')):
+        if not name:
+            continue
+        ballots = votes.get(name) or {}
+        updates[f'vote_counts/{name}'] = len(ballots)
+        for uid in ballots:
+            updates[f'voters/{uid}'] = name
+    contest_ref.update(updates)
+    print(f"Backfilled contest vote index for {len(updates)} entries.")
+
+def _finalize_contest(contest_ref, users_ref, current_contest, settings):
+    c1_name = current_contest.get('contestant1_name')
+    c2_name = current_contest.get('contestant2_name')
+
+    c1_orig_multi = current_contest.get('contestant1_original_multiplier') or 1.0
+    c2_orig_multi = current_contest.get('contestant2_original_multiplier') or 1.0
+    if c1_name: users_ref.child(c1_name).child('stock_multiplier').set(c1_orig_multi)
+    if c2_name: users_ref.child(c2_name).child('stock_multiplier').set(c2_orig_multi)
+    print(f"Resetting multipliers: {c1_name} -> {c1_orig_multi}, {c2_name} -> {c2_orig_multi}")
+
+    votes1_count = _contest_vote_count(contest_ref, c1_name)
+    votes2_count = _contest_vote_count(contest_ref, c2_name)
+
+    winner_name = c1_name if votes1_count > votes2_count else c2_name if votes2_count > votes1_count else None
+
+    # إغلاق المنافسة ونقاط الفائز وسجل الدفع تُكتب في تحديث واحد، ثم يدفع محرك الدفع
+    # للمصوتين على دفعات؛ إن توقف في المنتصف يكمل لاحقاً من نقطة التوقف دون دفع مكرر.
+    updates = {'popularity_contest/status': 'completed'}
+    payout_id = None
+    if winner_name:
+        winner_reward = settings.get('winner_points_reward', 0)
+        voter_reward = settings.get('voter_sp_reward', 0)
+
+        if winner_reward > 0:
+            # زيادة ذرية على الحقل نفسه، فتُقرأ النقاط الجديدة مباشرة بعد الإغلاق
+            updates[f'users/{winner_name}/points'] = {'.sv': {'increment': winner_reward}}
+
+        # أسماء المصوتين للفائز فقط (shallow) عند وجود مكافأة
+        winning_voters = (contest_ref.child(f'votes/{winner_name}').get(shallow=True) or {}) if voter_reward > 0 else {}
+        if winning_voters:
+            payout_id = str(current_contest.get('end_timestamp') or int(time.time()))
+            updates.update(contest_payouts.open_payout_updates(payout_id, winner_name, list(winning_voters), voter_reward))
+
+    db.reference(memoize=False).update(updates)
+    if payout_id:
+        contest_payouts.run_payout(payout_id)
+
+@instrumented
 def manage_popularity_contest(app):
     with app.app_context():
         print(f"[{time.strftime('%Y-%m-%d %H:%M:%S')}] Running Popularity Contest check...")
-        contest_ref = db.reference('popularity_contest')
-        settings_ref = db.reference('site_settings/contest_settings')
-        users_ref = db.reference('users')
-        
+        contest_ref = db.reference('popularity_contest', memoize=False)
+        users_ref = db.reference('users', memoize=False)
+
         try:
-            all_crawlers_now = users_ref.get() or {}
-            settings = settings_ref.get() or {}
+            contest_payouts.resume_pending_payouts()
+
+            all_crawlers_now = roster.all()
+            settings = get_settings('contest_settings', {})
 
             if not settings.get('is_enabled', False):
-                if contest_ref.get(): contest_ref.set(None)
-                print("Contest system is disabled. Exiting task.")
+                if contest_ref.get(shallow=True): contest_ref.set(None)
+                print("Contest system is disabled. No contest job until settings change.")
                 return
 
-            current_contest = contest_ref.get()
-            
+            current_contest = _read_contest_meta(contest_ref)
+
             if current_contest and current_contest.get('status') == 'active':
-                end_timestamp = current_contest.get('end_timestamp', 0)
-                
-                if time.time() >= end_timestamp:
-                    print("Contest finished. Processing results...")
-                    c1_name = current_contest.get('contestant1_name')
-                    c2_name = current_contest.get('contestant2_name')
-
-                    c1_orig_multi = current_contest.get('contestant1_original_multiplier', 1.0)
-                    c2_orig_multi = current_contest.get('contestant2_original_multiplier', 1.0)
-                    if c1_name: users_ref.child(c1_name).child('stock_multiplier').set(c1_orig_multi)
-                    if c2_name: users_ref.child(c2_name).child('stock_multiplier').set(c2_orig_multi)
-                    print(f"Resetting multipliers: {c1_name} -> {c1_orig_multi}, {c2_name} -> {c2_orig_multi}")
-
-                    votes = current_contest.get('votes', {})
-                    votes1_count = len(votes.get(c1_name, {}))
-                    votes2_count = len(votes.get(c2_name, {}))
-                    
-                    winner_name, winning_voters = (c1_name, votes.get(c1_name, {})) if votes1_count > votes2_count else (c2_name, votes.get(c2_name, {})) if votes2_count > votes1_count else (None, {})
-                    
-                    if winner_name:
-                        winner_reward = settings.get('winner_points_reward', 0)
-                        voter_reward = settings.get('voter_sp_reward', 0)
-                        
-                        if winner_reward > 0:
-                            users_ref.child(winner_name).child('points').transaction(lambda p: (p or 0) + winner_reward)
-                        
-                        if voter_reward > 0 and winning_voters:
-                            for uid in winning_voters.keys():
-                                db.reference(f'wallets/{uid}/sp').transaction(lambda sp: (sp or 0) + voter_reward)
-                                db.reference(f'user_messages/{uid}').push({'text': f"🎉 مبروك! لقد فزت بـ {voter_reward} SP لتصويتك للزاحف الفائز '{winner_name}'.", 'timestamp': int(time.time())})
-                    
-                    contest_ref.child('status').set('completed')
-                    current_contest = None
+                end_timestamp = current_contest.get('end_timestamp') or 0
+                _backfill_vote_index(contest_ref, current_contest)
+
+                if time.time() < end_timestamp:
+                    schedule_contest_job(app, end_timestamp)
+                    return
+
+                print("Contest finished. Processing results...")
+                _finalize_contest(contest_ref, users_ref, current_contest, settings)
+                current_contest = None
 
             if not current_contest and len(all_crawlers_now) >= 2:
                 print("Starting a new contest...")
-                
+
                 contestants = random.sample(list(all_crawlers_now.keys()), 2)
                 name1, name2 = contestants[0], contestants[1]
-                
-                c1_data = all_crawlers_now.get(name1, {})
-                c2_data = all_crawlers_now.get(name2, {})
-                c1_orig_multi = c1_data.get('stock_multiplier', 1.0)
-                c2_orig_multi = c2_data.get('stock_multiplier', 1.0)
-                
+
+                # المضاعف الحالي يُقرأ من قاعدة البيانات لا من مرآة الزواحف، لأن إنهاء المنافسة
+                # السابقة قد أعاده للتو ولم تصل المرآة بعد
+                c1_orig_multi = users_ref.child(f'{name1}/stock_multiplier').get() or 1.0
+                c2_orig_multi = users_ref.child(f'{name2}/stock_multiplier').get() or 1.0
+
                 multiplier_boost = float(settings.get('multiplier_boost', 0.2))
-                
+
                 users_ref.child(name1).child('stock_multiplier').set(c1_orig_multi + multiplier_boost)
                 users_ref.child(name2).child('stock_multiplier').set(c2_orig_multi + multiplier_boost)
                 print(f"Boosting multipliers by {multiplier_boost}: {name1} -> {c1_orig_multi + multiplier_boost}, {name2} -> {c2_orig_multi + multiplier_boost}")
@@ -129,81 +359,81 @@ def manage_popularity_contest(app):
                 new_contest_data = {
                     'contestant1_name': name1, 'contestant2_name': name2,
                     'contestant1_original_multiplier': c1_orig_multi, 'contestant2_original_multiplier': c2_orig_multi,
-                    'end_timestamp': int(time.time()) + 86400, 'status': 'active', 'votes': {}
+                    'end_timestamp': int(time.time()) + 86400, 'status': 'active', 'votes': {},
+                    'vote_counts': {name1: 0, name2: 0}, 'voters': {}
                 }
                 contest_ref.set(new_contest_data)
+                schedule_contest_job(app, new_contest_data['end_timestamp'])
+            elif not current_contest:
+                # لا يوجد زواحف كافية الآن، نعيد المحاولة لاحقاً
+                schedule_contest_job(app, time.time() + CONTEST_RETRY_SECONDS)
 
         except Exception as e:
             print(f"!!! Error in manage_popularity_contest: {e}", file=sys.stderr)
+            telemetry.record_error('manage_popularity_contest', e)
+            try:
+                schedule_contest_job(app, time.time() + CONTEST_RETRY_SECONDS)
+            except Exception as schedule_error:
+                print(f"!!! Could not reschedule contest job: {schedule_error}", file=sys.stderr)
+
 
+MARKET_JOB_ID = 'market_justice_job'
 
+def sync_market_job(app):
+    """
+    Registers, reschedules or removes the SAM job to match site_settings/market_governor.
+    Called at startup, after the settings are saved and by the scheduler coordinator's
+    watch, so every worker ends up with the same schedule.
+    """
+    from . import scheduler
+    governor_settings = get_settings('market_governor', {}) or {}
+    if scheduler.get_job(MARKET_JOB_ID):
+        scheduler.remove_job(MARKET_JOB_ID)
+    if not governor_settings.get('enabled', False):
+        print(">> Automated Market Justice System (SAM) is disabled in settings. Job not scheduled.")
+        return
+
+    hours = governor_settings.get('interval_hours', 0)
+    minutes = governor_settings.get('interval_minutes', 10)
+    seconds = governor_settings.get('interval_seconds', 0)
+    total_seconds = (hours * 3600) + (minutes * 60) + seconds
+    # التأكد من أن القيمة لا تقل عن 10 ثواني
+    if total_seconds < 10:
+        total_seconds = 600 # قيمة افتراضية آمنة (10 دقائق)
+
+    scheduler.add_job(id=MARKET_JOB_ID, func=automated_market_balance, trigger='interval', seconds=total_seconds, args=[app])
+    print(f">> Automated Market Justice System (SAM) job scheduled to run every {total_seconds} seconds.")
+
+@instrumented
 def automated_market_balance(app):
     with app.app_context():
         print(f"\n[{time.strftime('%Y-%m-%d %H:%M:%S')}] --- Running Market Volatility Engine ---")
         
         try:
-            settings = db.reference('site_settings/market_governor').get()
-            if not settings or not settings.get('enabled') or not settings.get('market_volatility', {}).get('enabled'):
-                print("Market Volatility system is disabled. Exiting.")
+            settings = get_settings('market_governor')
+            if not settings or not settings.get('enabled'):
+                print("Market Governor is disabled. Exiting.")
                 return
 
-            all_users = db.reference('users').get() or {}
+            all_users = roster.all()
             if not all_users:
                 print("No crawlers found to apply volatility. Exiting.")
                 return
 
             volatility_settings = settings.get('market_volatility', {})
-            db_updates = {}
-            activity_logs = []
-
-            for crawler_name, crawler_data in all_users.items():
-                if random.uniform(0, 100) >= float(volatility_settings.get('chance_percent', 0)):
-                    continue
-
-                events_config = {
-                    'up': (volatility_settings.get('up_min_percent', 1.0), volatility_settings.get('up_max_percent', 5.0), volatility_settings.get('up_chance', 45)),
-                    'down': (-volatility_settings.get('down_min_percent', 1.0), -volatility_settings.get('down_max_percent', 3.0), volatility_settings.get('down_chance', 40)),
-                    'strong_up': (volatility_settings.get('strong_up_min_percent', 10.0), volatility_settings.get('strong_up_max_percent', 25.0), volatility_settings.get('strong_up_chance', 7.5)),
-                    'crash': (-volatility_settings.get('crash_min_percent', 8.0), -volatility_settings.get('crash_max_percent', 20.0), volatility_settings.get('crash_chance', 7.5))
-                }
-                event_names, event_weights = list(events_config.keys()), [v[2] for v in events_config.values()]
-
-                if sum(event_weights) <= 0: continue
-                
-                chosen_event_type = random.choices(event_names, weights=event_weights, k=1)[0]
-                min_percent, max_percent, _ = events_config[chosen_event_type]
-                random_percent = random.uniform(min_percent, max_percent)
-                change_amount = random_percent / 100.0
-                
-                current_multiplier = float(crawler_data.get('stock_multiplier', 1.0))
-                new_multiplier = max(0.20, current_multiplier + (change_amount if 'up' in chosen_event_type else -abs(change_amount)))
-                
-                db_updates[f'users/{crawler_name}/stock_multiplier'] = new_multiplier
-                
-                log_text_map = {
-                    'up': f"📈 ارتفاع طفيف بنسبة {abs(random_percent):.1f}% في سوق الزاحف '{crawler_name}'!",
-                    'down': f"📉 انخفاض طفيف بنسبة {abs(random_percent):.1f}% في سوق الزاحف '{crawler_name}'.",
-                    'strong_up': f"🚀 ارتفاع قوي بنسبة {abs(random_percent):.1f}% في سوق الزاحف '{crawler_name}'!",
-                    'crash': f"💥 انهيار مفاجئ بنسبة {abs(random_percent):.1f}% في سوق الزاحف '{crawler_name}'!"
-                }
-                log_text = log_text_map.get(chosen_event_type, "تقلب في السوق.")
-                activity_logs.append({'type': 'admin_edit', 'text': log_text, 'timestamp': int(time.time())})
-
-            jackpot_chance = float(settings.get('jackpot_chance_percent', 0.5))
-            if random.uniform(0, 100) < jackpot_chance:
-                # (Jackpot logic remains the same, but will be applied with the multi-path update)
-                pass
-
-            if db_updates:
-                # <<< بداية التعديل: استخدام المرجع الفارغ بدلاً من الجذر >>>
-                db.reference().update(db_updates)
-                # <<< نهاية التعديل >>>
-            
-            if activity_logs:
-                for log in activity_logs:
-                    db.reference('activity_log').push(log)
+            if volatility_settings.get('enabled'):
+                # مرحلة متجهة واحدة (NumPy) لكل الزواحف، ثم تحديث واحد للمضاعفات وسجلاتها
+                db_updates, moved = market_volatility.volatility_updates(all_users, volatility_settings)
+                if db_updates:
+                    db.reference().update(db_updates)
+                print(f"Volatility moved {moved} crawlers.")
+
+            # الموازنة والإنقاذ والضربة الكبرى: مسح متدفق للمحافظ الاستثمارية صفحةً صفحة
+            stats = market_scan.scan_portfolios(settings, all_users)
+            print(f"Portfolio scan: {stats}")
             
             print(f"--- Market Volatility Engine finished. ---")
         except Exception as e:
             print(f"!!! Error in automated_market_balance: {e}", file=sys.stderr)
+            telemetry.record_error('automated_market_balance', e)
 # --- END OF FILE project/scheduled_tasks.py ---
\ No newline at end of file
@@ -0,0 +1,175 @@
+﻿# --- START OF FILE project/scheduler_lease.py ---
+import os
+import sys
+import copy
+import time
+import uuid
+import atexit
+import socket
+import threading
+from .storage import db, uses_firebase
+from .live_cache import get_settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: لا يوجد قفل ملفات بهذه الطريقة، فتعمل العملية كقائد دائماً
+    fcntl = None
+
+LEASE_PATH = 'scheduler_lease'
+
+
+class _LeaseHeld(Exception):
+    pass
+
+
+class SchedulerCoordinator:
+    """
+    Makes exactly one process run the scheduled jobs when gunicorn starts several workers.
+
+    Every worker registers the same jobs but keeps its scheduler paused. A background
+    thread holds a lease and only the holder resumes its scheduler; if the holder dies the
+    lease expires after `ttl` seconds and another worker takes over (date jobs such as the
+    contest end run on takeover because they never misfire).
+
+    SCHEDULER_LEASE selects the lease: 'rtdb' (a transaction on scheduler_lease, the
+    default with Firebase), 'file' (an exclusive lock on SCHEDULER_LOCK_FILE, by default
+    scheduler.lock in the instance folder; the default with the local backend) or 'off'
+    (every process leads, the old behaviour).
+
+    watch() registers a callback for a site_settings node; the thread compares the live
+    cache copy on every tick, so a reschedule saved through one worker reaches them all.
+    """
+
+    def __init__(self, ttl=30, tick=5):
+        self.ttl = ttl
+        self.tick = tick
+        self.holder_id = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}'
+        self.mode = None
+        self.lock_path = None
+        self._scheduler = None
+        self._leader = False
+        self._lock_file = None
+        self._watches = []
+        self._thread = None
+        self._stopping = threading.Event()
+
+    # --- lifecycle ---
+    def start(self, scheduler, instance_path='instance'):
+        if self._thread:
+            return
+        self._scheduler = scheduler
+        self.mode = os.getenv('SCHEDULER_LEASE', 'rtdb' if uses_firebase() else 'file')
+        self.lock_path = os.getenv('SCHEDULER_LOCK_FILE') or os.path.join(instance_path, 'scheduler.lock')
+        self.ttl = int(os.getenv('SCHEDULER_LEASE_TTL', self.ttl))
+        self._step()
+        self._thread = threading.Thread(target=self._run, name='scheduler-lease', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+        print(f">> Scheduler coordinator started ({self.mode} lease, holder {self.holder_id}).")
+
+    def stop(self):
+        self._stopping.set()
+        if self._leader:
+            self._release()
+            self._set_leader(False)
+
+    def is_leader(self):
+        return self._leader
+
+    def watch(self, settings_key, callback):
+        """Calls `callback()` whenever site_settings/{settings_key} changes."""
+        self._watches.append([settings_key, copy.deepcopy(get_settings(settings_key)), callback])
+
+    # --- loop ---
+    def _run(self):
+        while not self._stopping.wait(self.tick):
+            self._step()
+
+    def _step(self):
+        try:
+            self._set_leader(self._acquire())
+        except Exception as e:
+            print(f"!!! Scheduler lease check failed: {e}", file=sys.stderr)
+            self._set_leader(False)
+        for watch in self._watches:
+            settings_key, seen, callback = watch
+            current = get_settings(settings_key)
+            if current != seen:
+                watch[1] = copy.deepcopy(current)
+                try:
+                    callback()
+                except Exception as e:
+                    print(f"!!! Scheduler watch for '{settings_key}' failed: {e}", file=sys.stderr)
+
+    def _set_leader(self, leader):
+        if leader == self._leader:
+            return
+        self._leader = leader
+        if self._scheduler is None:
+            return
+        if leader:
+            self._scheduler.resume()
+            print(f">> This process ({self.holder_id}) is now the scheduler leader; jobs resumed.")
+        else:
+            self._scheduler.pause()
+            print(f">> This process ({self.holder_id}) is no longer the scheduler leader; jobs paused.")
+
+    # --- leases ---
+    def _acquire(self):
+        if self.mode == 'off':
+            return True
+        if self.mode == 'file':
+            return self._acquire_file()
+        return self._acquire_rtdb()
+
+    def _acquire_rtdb(self):
+        now = time.time()
+
+        def claim(current):
+            if current and current.get('holder') != self.holder_id and current.get('expires_at', 0) > now:
+                raise _LeaseHeld()
+            return {'holder': self.holder_id, 'expires_at': now + self.ttl}
+
+        try:
+            db.reference(LEASE_PATH, memoize=False).transaction(claim)
+            return True
+        except _LeaseHeld:
+            return False
+
+    def _acquire_file(self):
+        if fcntl is None:
+            return True
+        if self._lock_file is not None:
+            return True
+        if os.path.dirname(self.lock_path):
+            os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+        lock_file = open(self.lock_path, 'a+')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _release(self):
+        try:
+            if self.mode == 'rtdb':
+                def release(current):
+                    if current and current.get('holder') == self.holder_id:
+                        return None
+                    raise _LeaseHeld()
+                db.reference(LEASE_PATH, memoize=False).transaction(release)
+            elif self.mode == 'file' and self._lock_file is not None:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                self._lock_file.close()
+                self._lock_file = None
+        except _LeaseHeld:
+            pass
+        except Exception as e:
+            print(f"!!! Scheduler lease release failed: {e}", file=sys.stderr)
+
+
+coordinator = SchedulerCoordinator()
+
+# --- END OF FILE project/scheduler_lease.py ---
@@ -0,0 +1,165 @@
+﻿# --- START OF FILE project/sharded_counter.py ---
+import os
+import sys
+import random
+from .storage import db
+from .crawler_roster import roster
+
+SHARDS_ROOT = 'counter_shards'
+
+
+def _increment(amount):
+    return {'.sv': {'increment': amount}}
+
+
+class _NothingToPrune(Exception):
+    pass
+
+
+class ShardedCounter:
+    """
+    A numeric field whose writes are spread over N shard children.
+
+    add() bumps one random shard under counter_shards/{name}/{key} with a server-side
+    increment, so bursts on one hot key never contend on a single node. The canonical
+    field (`path_template` formatted with the key) only changes when fold() moves the
+    shard totals into it; value() is canonical + shards for callers that need it exact.
+    `key_exists` lets fold() drop shards of keys whose canonical node was deleted.
+
+    Shards left at zero by a fold are pruned, so counter_shards/{name} only holds keys
+    with recent writes. `active` says whether add() is in use; an inactive counter is only
+    folded until its shards are gone (it is then marked `drained` and fold_all skips it).
+    """
+
+    def __init__(self, name, path_template, shards=8, key_exists=None, active=None):
+        self.name = name
+        self.path_template = path_template
+        self.shards = shards
+        self.key_exists = key_exists
+        self.active = active
+        self.drained = False
+
+    def canonical_path(self, key):
+        return self.path_template.format(key=key)
+
+    def shards_path(self, key=None):
+        return f'{SHARDS_ROOT}/{self.name}/{key}' if key else f'{SHARDS_ROOT}/{self.name}'
+
+    def is_active(self):
+        return self.active is None or bool(self.active())
+
+    def stage(self, key, amount):
+        """The multi-path update entry add() would write, for callers batching it with other writes."""
+        shard = random.randrange(self.shards)
+        return {f'{self.shards_path(key)}/{shard}': _increment(amount)}
+
+    def add(self, key, amount):
+        db.reference().update(self.stage(key, amount))
+
+    def pending(self, key):
+        """Sum of the increments not folded into the canonical field yet."""
+        return sum(_shard_values(db.reference(self.shards_path(key)).get()).values())
+
+    def value(self, key, canonical=None):
+        if canonical is None:
+            canonical = db.reference(self.canonical_path(key)).get() or 0
+        return canonical + self.pending(key)
+
+    def fold(self, key=None):
+        """
+        Moves shard totals into the canonical field in one multi-path update.
+        Each shard is decremented by exactly what was read, so increments that land
+        while folding stay in their shard for the next pass; shards at zero are pruned
+        afterwards. A shallow read skips the whole pass when no key has shards.
+        Returns the number of keys folded.
+        """
+        if key is not None:
+            all_shards = {key: db.reference(self.shards_path(key)).get()}
+        else:
+            if not db.reference(self.shards_path(), memoize=False).get(shallow=True):
+                if not self.is_active():
+                    self.drained = True
+                return 0
+            all_shards = db.reference(self.shards_path(), memoize=False).get() or {}
+
+        updates = {}
+        to_prune = []
+        folded = 0
+        for counter_key, shards in all_shards.items():
+            read = _shard_values(shards)
+            values = {shard: amount for shard, amount in read.items() if amount}
+            if not values:
+                if read:
+                    to_prune.append(counter_key)
+                continue
+            if self.key_exists is not None and not self.key_exists(counter_key):
+                updates[self.shards_path(counter_key)] = None
+                continue
+            updates[self.canonical_path(counter_key)] = _increment(sum(values.values()))
+            for shard, amount in values.items():
+                updates[f'{self.shards_path(counter_key)}/{shard}'] = _increment(-amount)
+            to_prune.append(counter_key)
+            folded += 1
+        if updates:
+            db.reference().update(updates)
+        for counter_key in to_prune:
+            self._prune(counter_key)
+        return folded
+
+    def _prune(self, key):
+        """Deletes the zeroed shards of `key` in a transaction, so a concurrent add() is never lost."""
+        def prune(current):
+            shards = _shard_values(current)
+            kept = {shard: amount for shard, amount in shards.items() if amount}
+            if len(kept) == len(shards):
+                raise _NothingToPrune()
+            return kept or None
+
+        try:
+            db.reference(self.shards_path(key), memoize=False).transaction(prune)
+        except _NothingToPrune:
+            pass
+        except Exception as e:
+            print(f"!!! Pruning shards of '{self.name}/{key}' failed: {e}", file=sys.stderr)
+
+
+def _shard_values(shards):
+    if isinstance(shards, list):
+        shards = {str(i): amount for i, amount in enumerate(shards) if amount is not None}
+    if not isinstance(shards, dict):
+        return {}
+    return {shard: amount for shard, amount in shards.items() if isinstance(amount, (int, float))}
+
+
+crawler_likes = ShardedCounter('likes', 'users/{key}/likes', key_exists=roster.exists)
+# نقاط الزواحف لا تُجزأ: التقييم والترتيب يقرآن users/{name}/points مباشرة بعد كل كتابة.
+# هذا العداد يبقى فقط لدمج شظايا كُتبت قبل ذلك، ولا يُضاف إليه شيء جديد.
+legacy_crawler_points = ShardedCounter('points', 'users/{key}/points', key_exists=roster.exists, active=lambda: False)
+
+
+def wallet_credits_sharded():
+    """المحافظ اختيارية: WALLET_SHARDED_CREDITS=1 يوزع الإيداعات على شظايا تُدمج قبل كل خصم."""
+    return os.getenv('WALLET_SHARDED_CREDITS', '0') == '1'
+
+
+# بدون WALLET_SHARDED_CREDITS تُدمج شظايا المحافظ المتبقية فقط حتى تنفد
+wallet_counters = {
+    currency: ShardedCounter(f'wallets_{currency}', f'wallets/{{key}}/{currency}', active=wallet_credits_sharded)
+    for currency in ('sp', 'cc')
+}
+
+COUNTERS = [crawler_likes, legacy_crawler_points] + list(wallet_counters.values())
+
+
+def fold_all():
+    total = 0
+    for counter in COUNTERS:
+        if counter.drained:
+            continue
+        try:
+            total += counter.fold()
+        except Exception as e:
+            print(f"!!! Counter fold failed for '{counter.name}': {e}", file=sys.stderr)
+    return total
+
+# --- END OF FILE project/sharded_counter.py ---
@@ -0,0 +1,166 @@
+﻿# --- START OF FILE project/side_effects.py ---
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import threading
+from .storage import db, generate_push_id
+from .write_batch import WriteBatch
+
+DEAD_LETTER_FILE = 'side_effects_dead_letter.jsonl'
+
+
+class SideEffectQueue:
+    """
+    Background writer for side effects that must not hold up a response:
+    activity/investment logs, the live feed and user inbox messages.
+
+    push()/set() only stage the write (push keys are generated immediately, so
+    ordering is kept) and return. Worker threads drain the bounded queue and commit
+    everything gathered within `flush_interval` as one multi-path update. A batch that
+    still fails after `retries` attempts is appended to the dead-letter file as JSON lines
+    (DEAD_LETTER_FILE under the app's instance folder unless a path is configured).
+    When the queue is full the write is done inline instead of being dropped.
+    """
+
+    def __init__(self, maxsize=10000, workers=2, flush_interval=0.25, max_batch=500,
+                 retries=2, dead_letter_path=None):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.retries = retries
+        self.dead_letter_path = dead_letter_path
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._workers = workers
+        self._threads = []
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._stats = {'queued': 0, 'committed': 0, 'batches': 0, 'inline': 0, 'dead_lettered': 0}
+
+    # --- lifecycle ---
+    def start(self, instance_path='instance'):
+        """Starts the workers (SIDE_EFFECT_WORKERS / SIDE_EFFECT_DEAD_LETTER override the defaults)."""
+        with self._lock:
+            if self._threads:
+                return
+            self._workers = int(os.getenv('SIDE_EFFECT_WORKERS', self._workers))
+            self.dead_letter_path = (os.getenv('SIDE_EFFECT_DEAD_LETTER') or self.dead_letter_path
+                                     or os.path.join(instance_path, DEAD_LETTER_FILE))
+            self._stopping.clear()
+            for i in range(self._workers):
+                thread = threading.Thread(target=self._run, name=f'side-effects-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            atexit.register(self.stop)
+        print(f">> Side-effect queue started with {self._workers} workers.")
+
+    def stop(self, timeout=10):
+        """Stops the workers after they drain whatever is still queued."""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        if not threads:
+            return
+        self._stopping.set()
+        for thread in threads:
+            thread.join(timeout)
+        self.flush()
+
+    # --- producers ---
+    def push(self, path, value):
+        """Queues a push under `path` and returns the generated key."""
+        key = generate_push_id()
+        self.set(f"{path.rstrip('/')}/{key}", value)
+        return key
+
+    def set(self, path, value):
+        item = (path, value)
+        if not self._threads:
+            self._commit([item])
+            return
+        try:
+            self._queue.put_nowait(item)
+            with self._lock:
+                self._stats['queued'] += 1
+        except queue.Full:
+            with self._lock:
+                self._stats['inline'] += 1
+            self._commit([item])
+
+    # --- consumers ---
+    def _drain(self, first=None):
+        items = [first] if first is not None else []
+        deadline = time.time() + self.flush_interval
+        while len(items) < self.max_batch:
+            remaining = deadline - time.time()
+            try:
+                items.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            self._commit(self._drain(first))
+
+    def flush(self):
+        """Commits everything currently queued from the calling thread."""
+        while True:
+            items = []
+            while len(items) < self.max_batch:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not items:
+                return
+            self._commit(items)
+
+    def _commit(self, items):
+        batch = WriteBatch()
+        for path, value in items:
+            batch.set(path, value)
+        updates = batch.staged()
+        error = None
+        for attempt in range(self.retries + 1):
+            try:
+                db.reference(memoize=False).update(updates)
+                with self._lock:
+                    self._stats['committed'] += len(items)
+                    self._stats['batches'] += 1
+                return
+            except Exception as e:
+                error = e
+                if attempt < self.retries:
+                    time.sleep(0.2 * (attempt + 1))
+        self._dead_letter(updates, error)
+
+    def _dead_letter(self, updates, error):
+        print(f"!!! Side-effect batch of {len(updates)} writes failed, dead-lettered: {error}", file=sys.stderr)
+        with self._lock:
+            self._stats['dead_lettered'] += len(updates)
+            try:
+                path = self.dead_letter_path or os.path.join('instance', DEAD_LETTER_FILE)
+                if os.path.dirname(path):
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps({'timestamp': int(time.time()), 'error': str(error), 'updates': updates},
+                                       ensure_ascii=False, default=str) + '\n')
+            except Exception as e:
+                print(f"!!! Could not write side-effect dead letter: {e}", file=sys.stderr)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['pending'] = self._queue.qsize()
+        stats['running'] = bool(self._threads)
+        return stats
+
+
+side_effects = SideEffectQueue()
+
+# --- END OF FILE project/side_effects.py ---
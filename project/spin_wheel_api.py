@@ -5,26 +5,32 @@ import sys
 from flask import (
     Blueprint, request, jsonify, session
 )
-from firebase_admin import db
-from .utils import login_required
+from .storage import db
+from .utils import login_required, LIVE_FEED_ROOT, live_feed_bucket
+from .live_cache import get_settings
+from . import wallet_service
+from .side_effects import side_effects
 
 bp = Blueprint('spin_wheel', __name__)
 
 try:
     from .user_interactions_api import _log_public_notification
 except ImportError:
-    def _log_public_notification(text):
+    def _log_public_notification(text, user_avatar=None):
         user_id = session.get('user_id')
         user_name = session.get('name')
         if not all([user_id, user_name]):
             return
         try:
-            user_avatar = db.reference(f'registered_users/{user_id}/current_avatar').get()
-            db.reference('live_feed').push({
+            if user_avatar is None:
+                user_avatar = db.reference(f'registered_users/{user_id}/current_avatar').get()
+            now = int(time.time())
+            notification = {
                 'user_id': user_id, 'user_name': user_name,
                 'user_avatar': user_avatar or '', 'text': text,
-                'timestamp': int(time.time())
-            })
+                'timestamp': now
+            }
+            side_effects.push(f'{LIVE_FEED_ROOT}/{live_feed_bucket(now)}', notification)
         except Exception as e:
             print(f"!!! Public Notification Log Error (Fallback): {e}", file=sys.stderr)
 
@@ -52,7 +58,7 @@ def get_prize_from_settings(settings):
 def check_and_update_state():
     user_id = session.get('user_id')
     try:
-        settings = db.reference('site_settings/spin_wheel_settings').get() or {}
+        settings = get_settings('spin_wheel_settings', {})
         user_state_ref = db.reference(f'user_spin_state/{user_id}')
         user_state = user_state_ref.get()
         free_attempts = settings.get('maxAttempts', 1)
@@ -85,7 +91,7 @@ def initiate_spin(attempt_type):
     db_attempt_key = 'freeAttempts' if attempt_type == 'free' else 'purchasedAttempts'
     user_state_ref = db.reference(f'user_spin_state/{user_id}')
     
-    settings = db.reference('site_settings/spin_wheel_settings').get() or {}
+    settings = get_settings('spin_wheel_settings', {})
     if not settings.get('enabled', False):
         return jsonify(success=False, message="عجلة الحظ معطلة حالياً."), 403
 
@@ -134,11 +140,11 @@ def claim_prize():
     
     try:
         # إضافة الجائزة إلى المحفظة
-        db.reference(f'wallets/{user_id}/cc').transaction(lambda current_cc: (current_cc or 0) + prize_value)
+        wallet_service.credit(user_id, 'cc', prize_value)
         
         # تسجيل النشاط
         log_text_admin = f"'{user_name}' ربح وطالب بـ {prize_value:,} CC من عجلة الحظ."
-        db.reference('activity_log').push({
+        side_effects.push('activity_log', {
             'type': 'gift', 'text': log_text_admin, 'timestamp': int(time.time()),
             'user_id': user_id, 'user_name': user_name
         })
@@ -2,14 +2,17 @@
 import random
 import sys
 from flask import Blueprint, request, jsonify, session
-from firebase_admin import db
+from .storage import db
 from .utils import login_required
+from .live_cache import get_settings
+from .crawler_roster import roster
+from . import wallet_service
 
 bp = Blueprint('stock_prediction_api', __name__)
 
 # --- دالة مساعدة لجلب إعدادات اللعبة ---
 def get_game_settings():
-    return db.reference('site_settings/stock_prediction_game').get() or {}
+    return get_settings('stock_prediction_game', {})
 
 # --- 1. نقطة النهاية لبدء جولة جديدة ---
 @bp.route('/start', methods=['POST'])
@@ -34,18 +37,13 @@ def start_game():
     if bet_amount > max_bet:
         return jsonify(success=False, message=f"الحد الأقصى للرهان هو {max_bet} SP."), 400
 
-    wallet_ref = db.reference(f'wallets/{user_id}')
-    current_sp = (wallet_ref.child('sp').get() or 0)
-    
-    if current_sp < bet_amount:
-        return jsonify(success=False, message="رصيد SP لديك غير كافٍ لبدء اللعبة."), 400
-
-    all_crawlers = db.reference('users').get()
+    all_crawlers = roster.all()
     if not all_crawlers:
         return jsonify(success=False, message="لا يوجد زواحف متاحون للعب حالياً."), 500
 
     # خصم مبلغ الرهان من المحفظة
-    wallet_ref.child('sp').set(current_sp - bet_amount)
+    if not wallet_service.debit(user_id, 'sp', bet_amount):
+        return jsonify(success=False, message="رصيد SP لديك غير كافٍ لبدء اللعبة."), 400
 
     chosen_crawler_name = random.choice(list(all_crawlers.keys()))
     chosen_crawler_data = all_crawlers[chosen_crawler_name]
@@ -117,8 +115,7 @@ def cash_out():
 
     try:
         # إضافة الأرباح إلى محفظة المستخدم
-        wallet_ref = db.reference(f'wallets/{user_id}/sp')
-        wallet_ref.transaction(lambda current_sp: (current_sp or 0) + winnings)
+        wallet_service.credit(user_id, 'sp', winnings)
         
         # حذف حالة اللعبة من الجلسة
         session.pop('stock_game_state', None)
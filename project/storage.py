@@ -0,0 +1,591 @@
+﻿# --- START OF FILE project/storage.py ---
+import os
+import sys
+import copy
+import json
+import time
+import queue
+import random
+import atexit
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+import requests
+import firebase_admin
+from firebase_admin import credentials
+from firebase_admin import _http_client as firebase_http_client
+from firebase_admin import db as firebase_db
+from .request_cache import MemoizedReference
+from .job_telemetry import counted
+
+PUSH_CHARS = '-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+
+_push_lock = threading.Lock()
+_last_push_time = 0
+_last_rand_chars = [0] * 12
+
+
+def generate_push_id():
+    """
+    Generates a Firebase-style push key locally (same algorithm as the client SDKs):
+    8 chars of millisecond timestamp followed by 12 random chars, incremented when
+    two keys are generated in the same millisecond so keys stay ordered.
+    """
+    global _last_push_time
+    with _push_lock:
+        now = int(time.time() * 1000)
+        duplicate_time = (now == _last_push_time)
+        _last_push_time = now
+
+        time_chars = []
+        for _ in range(8):
+            time_chars.append(PUSH_CHARS[now % 64])
+            now //= 64
+        push_id = ''.join(reversed(time_chars))
+
+        if not duplicate_time:
+            for i in range(12):
+                _last_rand_chars[i] = random.randrange(64)
+        else:
+            i = 11
+            while i >= 0 and _last_rand_chars[i] == 63:
+                _last_rand_chars[i] = 0
+                i -= 1
+            if i >= 0:
+                _last_rand_chars[i] += 1
+        return push_id + ''.join(PUSH_CHARS[c] for c in _last_rand_chars)
+
+
+def _split(path):
+    return [part for part in (path or '').strip('/').split('/') if part]
+
+
+def _get_in(tree, parts):
+    node = tree
+    for part in parts:
+        if isinstance(node, list) and part.isdigit() and int(part) < len(node):
+            node = node[int(part)]
+        elif isinstance(node, dict):
+            node = node.get(part)
+        else:
+            return None
+        if node is None:
+            return None
+    return node
+
+
+def _normalize(value):
+    """Drops null children and empty objects, the way RTDB stores values."""
+    if isinstance(value, dict):
+        out = {}
+        for key, child in value.items():
+            child = _normalize(child)
+            if child is not None:
+                out[str(key)] = child
+        return out or None
+    if isinstance(value, (list, tuple)):
+        out = [_normalize(child) for child in value]
+        return out if any(child is not None for child in out) else None
+    return value
+
+
+def _resolve_server_values(value, current):
+    """Replaces {'.sv': ...} placeholders (timestamp / increment) with concrete values."""
+    if not isinstance(value, dict):
+        return value
+    if '.sv' in value:
+        sv = value['.sv']
+        if sv == 'timestamp':
+            return int(time.time() * 1000)
+        if isinstance(sv, dict) and 'increment' in sv:
+            base = current if isinstance(current, (int, float)) and not isinstance(current, bool) else 0
+            return base + sv['increment']
+        raise ValueError(f"Unsupported server value: {sv!r}")
+    return {
+        key: _resolve_server_values(child, current.get(key) if isinstance(current, dict) else None)
+        for key, child in value.items()
+    }
+
+
+def _value_order(value):
+    """RTDB sort order: null < false < true < numbers < strings < objects."""
+    if value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, str):
+        return (3, value)
+    return (4, 0)
+
+
+def _key_order(key):
+    """Keys that look like 32-bit integers sort numerically before all other keys."""
+    try:
+        number = int(key)
+        if str(number) == key and -2 ** 31 <= number < 2 ** 31:
+            return (0, number, '')
+    except (ValueError, TypeError):
+        pass
+    return (1, 0, str(key))
+
+
+class Event:
+    """Same shape as firebase_admin.db.Event: event_type, path and data."""
+
+    def __init__(self, event_type, path, data):
+        self.event_type = event_type
+        self.path = path
+        self.data = data
+
+
+class LocalListenerRegistration:
+    def __init__(self, backend, parts, callback):
+        self._backend = backend
+        self.parts = parts
+        self.callback = callback
+
+    def close(self):
+        self._backend._remove_listener(self)
+
+
+class LocalQuery:
+    """order_by_* query over a LocalReference, mirroring firebase_admin.db.Query."""
+
+    def __init__(self, reference, order_by, child_path=None):
+        self._reference = reference
+        self._order_by = order_by
+        self._child_parts = _split(child_path)
+        self._start = None
+        self._end = None
+        self._limit_first = None
+        self._limit_last = None
+
+    def start_at(self, start):
+        if start is None:
+            raise ValueError('Start value must not be None.')
+        self._start = start
+        return self
+
+    def end_at(self, end):
+        if end is None:
+            raise ValueError('End value must not be None.')
+        self._end = end
+        return self
+
+    def equal_to(self, value):
+        if value is None:
+            raise ValueError('Equal to value must not be None.')
+        self._start = self._end = value
+        return self
+
+    def limit_to_first(self, limit):
+        if self._limit_last is not None:
+            raise ValueError('Cannot set both first and last limits.')
+        self._limit_first = limit
+        return self
+
+    def limit_to_last(self, limit):
+        if self._limit_first is not None:
+            raise ValueError('Cannot set both first and last limits.')
+        self._limit_last = limit
+        return self
+
+    def _sort_key(self, key, value):
+        if self._order_by == 'key':
+            return _key_order(key)
+        if self._order_by == 'value':
+            return (_value_order(value), _key_order(key))
+        child = _get_in(value, self._child_parts) if self._child_parts else value
+        return (_value_order(child), _key_order(key))
+
+    def _bound(self, bound):
+        return _key_order(str(bound)) if self._order_by == 'key' else _value_order(bound)
+
+    def get(self):
+        value = self._reference.get()
+        if isinstance(value, list):
+            value = {str(i): child for i, child in enumerate(value) if child is not None}
+        if not isinstance(value, dict):
+            return value
+        items = sorted(value.items(), key=lambda item: self._sort_key(*item))
+        if self._start is not None or self._end is not None:
+            def primary(key, child):
+                sort_key = self._sort_key(key, child)
+                return sort_key if self._order_by == 'key' else sort_key[0]
+            if self._start is not None:
+                start = self._bound(self._start)
+                items = [item for item in items if primary(*item) >= start]
+            if self._end is not None:
+                end = self._bound(self._end)
+                items = [item for item in items if primary(*item) <= end]
+        if self._limit_first is not None:
+            items = items[:self._limit_first]
+        elif self._limit_last is not None:
+            items = items[-self._limit_last:] if self._limit_last else []
+        return OrderedDict(items)
+
+
+class LocalReference:
+    """Drop-in for firebase_admin.db.Reference backed by a LocalBackend."""
+
+    def __init__(self, backend, path):
+        self._backend = backend
+        self._parts = _split(path)
+        self.key = self._parts[-1] if self._parts else None
+        self.path = '/' + '/'.join(self._parts)
+
+    @property
+    def parent(self):
+        if not self._parts:
+            return None
+        return LocalReference(self._backend, '/'.join(self._parts[:-1]))
+
+    def child(self, path):
+        if not path or not isinstance(path, str):
+            raise ValueError(f'Invalid path argument: "{path}". Path must be a non-empty string.')
+        return LocalReference(self._backend, '/'.join(self._parts + _split(path)))
+
+    def get(self, etag=False, shallow=False):
+        if etag and shallow:
+            raise ValueError('etag and shallow cannot both be set to True.')
+        value = self._backend._read(self._parts)
+        if shallow and isinstance(value, dict):
+            value = {key: True if isinstance(child, (dict, list)) else child for key, child in value.items()}
+        if etag:
+            return value, self._etag(value)
+        return value
+
+    def get_if_changed(self, etag):
+        if not isinstance(etag, str):
+            raise ValueError('ETag must be a string.')
+        value = self._backend._read(self._parts)
+        current = self._etag(value)
+        if current == etag:
+            return False, None, None
+        return True, value, current
+
+    @staticmethod
+    def _etag(value):
+        return hashlib.md5(json.dumps(value, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def set(self, value):
+        if value is None:
+            raise ValueError('Value must not be None.')
+        self._backend._set(self._parts, value)
+
+    def update(self, value):
+        if not value or not isinstance(value, dict):
+            raise ValueError('Value argument must be a non-empty dictionary.')
+        if None in value.keys():
+            raise ValueError('Dictionary must not contain None keys.')
+        self._backend._update(self._parts, value)
+
+    def push(self, value=''):
+        if value is None:
+            raise ValueError('Value must not be None.')
+        ref = self.child(generate_push_id())
+        ref.set(value)
+        return ref
+
+    def delete(self):
+        self._backend._set(self._parts, None)
+
+    def transaction(self, transaction_update):
+        if not callable(transaction_update):
+            raise ValueError('transaction_update must be a function.')
+        return self._backend._transaction(self._parts, transaction_update)
+
+    def listen(self, callback):
+        return self._backend._add_listener(self._parts, callback)
+
+    def order_by_child(self, path):
+        if path in ('$key', '$value', '$priority'):
+            raise ValueError(f'Illegal child path: {path}')
+        return LocalQuery(self, 'child', path)
+
+    def order_by_key(self):
+        return LocalQuery(self, 'key')
+
+    def order_by_value(self):
+        return LocalQuery(self, 'value')
+
+
+class FirebaseBackend:
+    """The production backend: Firebase Realtime Database through firebase_admin."""
+
+    name = 'firebase'
+
+    def initialize(self):
+        if firebase_admin._apps:
+            return
+        service_account_file = os.getenv('FIREBASE_SERVICE_ACCOUNT')
+        database_url = os.getenv('FIREBASE_DATABASE_URL')
+        if not service_account_file or not os.path.exists(service_account_file):
+            raise ValueError(f"ملف مفتاح الخدمة '{service_account_file}' غير موجود أو المسار خاطئ.")
+        creds = credentials.Certificate(service_account_file)
+        firebase_admin.initialize_app(creds, {'databaseURL': database_url})
+        print(">> Firebase Admin Initialized Successfully!")
+        self._widen_http_pool()
+
+    def _widen_http_pool(self):
+        """
+        firebase_admin keeps one keep-alive session per database, but requests' default
+        pool only holds 10 connections; parallel reads would keep reconnecting past that.
+        """
+        pool_size = int(os.getenv('DB_HTTP_POOL_SIZE', '64'))
+        try:
+            session = firebase_db.reference()._client.session
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=4, pool_maxsize=pool_size,
+                max_retries=firebase_http_client.DEFAULT_RETRY_CONFIG)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+        except Exception as e:
+            print(f"!!! Could not resize the Firebase HTTP pool, using defaults: {e}", file=sys.stderr)
+
+    def reference(self, path='/'):
+        return firebase_db.reference(path)
+
+
+class LocalBackend:
+    """
+    In-process stand-in for the Realtime Database, for local runs and load tests.
+
+    The whole tree lives in memory behind one lock; reads return deep copies, writes
+    understand multi-path updates and '.sv' server values, and listen() streams
+    put/patch events from a dispatcher thread like the Firebase SDK does.
+    With `sqlite_path` the tree is persisted per top-level node, flushed in the
+    background every `flush_seconds` and at exit. `seed_file` (a JSON export of the
+    real database) fills an empty store on first start.
+    """
+
+    name = 'local'
+
+    def __init__(self, sqlite_path=None, seed_file=None, flush_seconds=1.0):
+        self.sqlite_path = sqlite_path
+        self.seed_file = seed_file
+        self.flush_seconds = flush_seconds
+        self._lock = threading.RLock()
+        self._root = {}
+        self._listeners = []
+        self._events = queue.Queue()
+        self._dirty = set()
+        self._flush_lock = threading.Lock()
+        self._conn = None
+
+    # --- lifecycle ---
+    def initialize(self):
+        if self.sqlite_path:
+            self._conn = sqlite3.connect(self.sqlite_path, check_same_thread=False)
+            self._conn.execute('CREATE TABLE IF NOT EXISTS nodes (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            self._conn.commit()
+            for key, value in self._conn.execute('SELECT key, value FROM nodes'):
+                self._root[key] = json.loads(value)
+        if not self._root and self.seed_file:
+            with open(self.seed_file, 'r', encoding='utf-8') as f:
+                self._root = _normalize(json.load(f)) or {}
+            self._dirty.update(self._root.keys())
+            print(f">> Local storage seeded from '{self.seed_file}'.")
+
+        threading.Thread(target=self._dispatch_events, name='local-storage-events', daemon=True).start()
+        if self._conn is not None:
+            threading.Thread(target=self._flush_loop, name='local-storage-flush', daemon=True).start()
+            atexit.register(self.flush)
+        where = f"SQLite '{self.sqlite_path}'" if self.sqlite_path else 'memory only'
+        print(f">> Local storage backend ready ({where}, {len(self._root)} top-level nodes).")
+
+    def reference(self, path='/'):
+        return LocalReference(self, path)
+
+    # --- tree operations (callers hold no lock) ---
+    def _read(self, parts):
+        with self._lock:
+            return copy.deepcopy(_get_in(self._root, parts))
+
+    def _write_at(self, parts, value):
+        """Writes a normalized value in place and prunes parents left empty by a delete."""
+        if not parts:
+            self._root = value if isinstance(value, dict) else {}
+            self._dirty.add(None)
+            return
+        self._dirty.add(parts[0])
+        node = self._root
+        trail = []
+        for part in parts[:-1]:
+            child = node.get(part)
+            if isinstance(child, list):
+                child = {str(i): item for i, item in enumerate(child) if item is not None}
+                node[part] = child
+            elif not isinstance(child, dict):
+                if value is None:
+                    return
+                child = {}
+                node[part] = child
+            trail.append((node, part))
+            node = child
+        if value is None:
+            node.pop(parts[-1], None)
+            for parent, part in reversed(trail):
+                if parent[part]:
+                    break
+                del parent[part]
+        else:
+            node[parts[-1]] = value
+
+    def _set(self, parts, value):
+        with self._lock:
+            current = _get_in(self._root, parts)
+            self._write_at(parts, _normalize(_resolve_server_values(copy.deepcopy(value), current)))
+            self._notify(parts)
+
+    def _update(self, parts, values):
+        with self._lock:
+            for key, value in values.items():
+                target = parts + _split(key)
+                current = _get_in(self._root, target)
+                self._write_at(target, _normalize(_resolve_server_values(copy.deepcopy(value), current)))
+            self._notify(parts, patch_keys=list(values.keys()))
+
+    def _transaction(self, parts, transaction_update):
+        with self._lock:
+            current = copy.deepcopy(_get_in(self._root, parts))
+            new_value = transaction_update(current)
+            self._write_at(parts, _normalize(copy.deepcopy(new_value)))
+            self._notify(parts)
+            return new_value
+
+    # --- listeners ---
+    def _add_listener(self, parts, callback):
+        registration = LocalListenerRegistration(self, parts, callback)
+        with self._lock:
+            self._listeners.append(registration)
+            self._events.put((registration, Event('put', '/', copy.deepcopy(_get_in(self._root, parts)))))
+        return registration
+
+    def _remove_listener(self, registration):
+        with self._lock:
+            if registration in self._listeners:
+                self._listeners.remove(registration)
+
+    def _notify(self, parts, patch_keys=None):
+        """Queues events for every listener whose subtree overlaps the write at `parts`."""
+        for listener in self._listeners:
+            lp = listener.parts
+            if parts[:len(lp)] == lp:
+                rel = '/' + '/'.join(parts[len(lp):])
+                if patch_keys is None:
+                    event = Event('put', rel, copy.deepcopy(_get_in(self._root, parts)))
+                else:
+                    data = {key: copy.deepcopy(_get_in(self._root, parts + _split(key))) for key in patch_keys}
+                    event = Event('patch', rel, data)
+            elif lp[:len(parts)] == parts:
+                if patch_keys is not None:
+                    touched = [parts + _split(key) for key in patch_keys]
+                    if not any(t[:len(lp)] == lp or lp[:len(t)] == t for t in touched):
+                        continue
+                event = Event('put', '/', copy.deepcopy(_get_in(self._root, lp)))
+            else:
+                continue
+            self._events.put((listener, event))
+
+    def _dispatch_events(self):
+        while True:
+            listener, event = self._events.get()
+            if listener not in self._listeners:
+                continue
+            try:
+                listener.callback(event)
+            except Exception as e:
+                print(f"!!! Local storage listener error on '/{'/'.join(listener.parts)}': {e}", file=sys.stderr)
+
+    # --- persistence ---
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"!!! Local storage flush failed: {e}", file=sys.stderr)
+
+    def flush(self):
+        """Writes the top-level nodes changed since the last flush to SQLite."""
+        if self._conn is None:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            dirty, self._dirty = self._dirty, set()
+            if None in dirty:
+                rows = {key: json.dumps(value, ensure_ascii=False) for key, value in self._root.items()}
+                full = True
+            else:
+                rows = {key: json.dumps(self._root[key], ensure_ascii=False) if key in self._root else None for key in dirty}
+                full = False
+        with self._flush_lock:
+            with self._conn:
+                if full:
+                    self._conn.execute('DELETE FROM nodes')
+                for key, value in rows.items():
+                    if value is None:
+                        self._conn.execute('DELETE FROM nodes WHERE key = ?', (key,))
+                    else:
+                        self._conn.execute('INSERT OR REPLACE INTO nodes (key, value) VALUES (?, ?)', (key, value))
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def initialize():
+    """
+    Creates the backend selected by STORAGE_BACKEND ('firebase' by default, or 'local').
+    The local backend reads STORAGE_SQLITE_PATH and STORAGE_SEED_FILE.
+    """
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            name = os.getenv('STORAGE_BACKEND', 'firebase').strip().lower()
+            if name == 'firebase':
+                backend = FirebaseBackend()
+            elif name == 'local':
+                backend = LocalBackend(
+                    sqlite_path=os.getenv('STORAGE_SQLITE_PATH') or None,
+                    seed_file=os.getenv('STORAGE_SEED_FILE') or None,
+                    flush_seconds=float(os.getenv('STORAGE_FLUSH_SECONDS', '1')),
+                )
+            else:
+                raise ValueError(f"Unknown STORAGE_BACKEND '{name}' (expected 'firebase' or 'local').")
+            backend.initialize()
+            _backend = backend
+        return _backend
+
+
+def get_backend():
+    return _backend or initialize()
+
+
+def uses_firebase():
+    return get_backend().name == 'firebase'
+
+
+class _Database:
+    """
+    Module-style facade so app code can keep writing db.reference(...).
+    Inside a request, references read through the per-request cache unless
+    `memoize=False` (used by the live mirrors, which must see fresh data).
+    """
+
+    TransactionAbortedError = firebase_db.TransactionAbortedError
+
+    def reference(self, path='/', memoize=True):
+        # داخل مهمة مجدولة تُحسب استدعاءات قاعدة البيانات لقياسات job_telemetry
+        reference = counted(get_backend().reference(path))
+        return MemoizedReference(reference) if memoize else reference
+
+
+db = _Database()
+
+# --- END OF FILE project/storage.py ---
@@ -7,8 +7,18 @@ from datetime import datetime, timedelta
 from flask import (
     Blueprint, request, jsonify, session
 )
-from firebase_admin import db
-from .utils import login_required
+from .storage import db
+from .utils import login_required, LIVE_FEED_ROOT, live_feed_bucket, NUDGE_EXPIRY_ROOT, nudge_expiry_bucket
+from .live_cache import get_settings
+from .crawler_roster import roster
+from .write_batch import request_batch
+from .side_effects import side_effects
+from .read_fanout import read_parallel
+from .valuation import position_lots, sale_breakdown
+from .portfolio import portfolio_cache
+from .leaderboards import richest
+from . import wallet_service
+from .sharded_counter import crawler_likes
 
 bp = Blueprint('user_interactions_api', __name__)
 
@@ -21,7 +31,7 @@ BANNED_WORDS_PATTERN = re.compile(
 def is_abusive(text):
     return bool(BANNED_WORDS_PATTERN.search(text)) if text else False
 
-def _log_public_notification(text):
+def _log_public_notification(text, user_avatar=None):
     if session.get('role') == 'admin':
         return
 
@@ -31,15 +41,17 @@ def _log_public_notification(text):
         return
     
     try:
-        user_avatar = db.reference(f'registered_users/{user_id}/current_avatar').get()
-        notification_ref = db.reference('live_feed')
-        notification_ref.push({
+        if user_avatar is None:
+            user_avatar = db.reference(f'registered_users/{user_id}/current_avatar').get()
+        now = int(time.time())
+        notification = {
             'user_id': user_id,
             'user_name': user_name,
             'user_avatar': user_avatar or '',
             'text': text,
-            'timestamp': int(time.time())
-        })
+            'timestamp': now
+        }
+        side_effects.push(f'{LIVE_FEED_ROOT}/{live_feed_bucket(now)}', notification)
     except Exception as e:
         print(f"!!! Live Feed Broadcast Error: {e}", file=sys.stderr)
 
@@ -59,6 +71,7 @@ def set_privacy_settings():
         db.reference(f'registered_users/{user_id}').update({
             'show_on_leaderboard': show
         })
+        richest.touch(user_id)
         return jsonify(success=True, message="تم تحديث إعدادات الخصوصية بنجاح.")
     except Exception as e:
         print(f"!!! Set Privacy Settings Error for user {user_id}: {e}", file=sys.stderr)
@@ -76,8 +89,7 @@ def place_bet():
     except (ValueError, TypeError, AttributeError):
         return jsonify(success=False, message="مبلغ الرهان غير صالح."), 400
 
-    settings_ref = db.reference('site_settings/gambling_settings')
-    settings = settings_ref.get()
+    settings = get_settings('gambling_settings')
 
     if not settings or not settings.get('is_enabled'):
         return jsonify(success=False, message="نظام الرهان معطل حالياً من قبل الإدارة."), 403
@@ -91,37 +103,80 @@ def place_bet():
     if not is_double_down and bet_amount > max_bet:
         return jsonify(success=False, message=f"لا يمكنك المراهنة بأكثر من {max_bet:,.0f} SP في المرة الواحدة."), 400
 
-    wallet_sp_ref = db.reference(f'wallets/{user_id}/sp')
-    
+    is_winner = random.uniform(0, 100) < win_chance
+    winnings = bet_amount * 2 if is_winner else 0
+
     try:
-        current_sp = wallet_sp_ref.get() or 0
-        if current_sp < bet_amount:
+        # الرهان والربح يُسوّيان في transaction واحدة، فلا حاجة لإرجاع المبلغ عند الخطأ
+        if not wallet_service.debit(user_id, 'sp', bet_amount, payout=winnings):
             return jsonify(success=False, message="رصيد SP غير كافٍ للمراهنة."), 400
-        
-        wallet_sp_ref.set(current_sp - bet_amount)
 
-        is_winner = random.uniform(0, 100) < win_chance
-        
         if is_winner:
-            winnings = bet_amount * 2
-            wallet_sp_ref.transaction(lambda current: (current or 0) + winnings)
-            
             log_text_public = f"ربح {winnings:,.2f} SP في رهان الزاحف!"
             _log_public_notification(log_text_public)
             
             log_text = f"ربح {winnings:,.2f} SP في رهان الزاحف."
-            db.reference('activity_log').push({'type':'gamble_win', 'text': f"'{user_name}' {log_text}", 'timestamp': int(time.time()), 'user_id': user_id, 'user_name': user_name})
+            side_effects.push('activity_log', {'type':'gamble_win', 'text': f"'{user_name}' {log_text}", 'timestamp': int(time.time()), 'user_id': user_id, 'user_name': user_name})
             return jsonify(success=True, result='win', message=f"مبروك! لقد ربحت وضاعفت رهانك إلى {winnings:,.2f} SP.", winnings=winnings)
         else:
             log_text = f"خسر {bet_amount:,.2f} SP في رهان الزاحف."
-            db.reference('activity_log').push({'type':'gamble_loss', 'text': f"'{user_name}' {log_text}", 'timestamp': int(time.time()), 'user_id': user_id, 'user_name': user_name})
+            side_effects.push('activity_log', {'type':'gamble_loss', 'text': f"'{user_name}' {log_text}", 'timestamp': int(time.time()), 'user_id': user_id, 'user_name': user_name})
             return jsonify(success=True, result='loss', message=f"حظ أوفر في المرة القادمة! لقد خسرت {bet_amount:,.2f} SP.")
 
     except Exception as e:
         print(f"!!! Place Bet Error for user {user_id}: {e}", file=sys.stderr)
-        wallet_sp_ref.transaction(lambda current: (current or 0) + bet_amount)
         return jsonify(success=False, message="حدث خطأ في الخادم أثناء تنفيذ الرهان."), 500
 
+class _AlreadyVoted(Exception):
+    pass
+
+class _InvestmentNotEmpty(Exception):
+    pass
+
+def _drop_empty_investment(investment_path):
+    """
+    Removes a position once its last lot is sold. Decided inside a transaction on the
+    current data, so a lot bought meanwhile keeps the position alive.
+    """
+    def drop(current):
+        if not current or (current.get('lots') if isinstance(current, dict) else None):
+            raise _InvestmentNotEmpty()
+        return None
+
+    try:
+        db.reference(investment_path).transaction(drop)
+    except _InvestmentNotEmpty:
+        pass
+    except Exception as e:
+        # البيع نفسه تم؛ المركز بلا دفعات لا قيمة له ويتجاهله التقييم
+        print(f"!!! Could not remove empty investment '{investment_path}': {e}", file=sys.stderr)
+
+def claim_contest_vote(user_id, voted_for):
+    """
+    Claims the user's single vote with a transaction on popularity_contest/voters/{uid},
+    then records the ballot and bumps vote_counts/{name} in one multi-path update.
+    Returns False if the user already voted in this contest.
+    """
+    def claim(current):
+        if current is not None:
+            raise _AlreadyVoted()
+        return voted_for
+
+    try:
+        db.reference(f'popularity_contest/voters/{user_id}').transaction(claim)
+    except _AlreadyVoted:
+        return False
+
+    try:
+        db.reference('popularity_contest').update({
+            f'votes/{voted_for}/{user_id}': True,
+            f'vote_counts/{voted_for}': {'.sv': {'increment': 1}},
+        })
+    except Exception:
+        db.reference(f'popularity_contest/voters/{user_id}').delete()
+        raise
+    return True
+
 @bp.route('/contest/vote', methods=['POST'])
 @login_required
 def vote_in_contest():
@@ -132,10 +187,14 @@ def vote_in_contest():
     if not voted_for:
         return jsonify(success=False, message="اسم المتنافس مطلوب للتصويت."), 400
 
-    contest_ref = db.reference('popularity_contest')
-    contest_data = contest_ref.get()
+    # حقول المنافسة فقط، بدون خريطة الأصوات
+    contest_data = read_parallel({
+        'status': 'popularity_contest/status',
+        'contestant1_name': 'popularity_contest/contestant1_name',
+        'contestant2_name': 'popularity_contest/contestant2_name',
+    })
 
-    if not contest_data or contest_data.get('status') != 'active':
+    if contest_data.get('status') != 'active':
         return jsonify(success=False, message="لا توجد منافسة نشطة حالياً."), 403
 
     if voted_for not in [contest_data.get('contestant1_name'), contest_data.get('contestant2_name')]:
@@ -144,12 +203,9 @@ def vote_in_contest():
     if user_name.lower() == voted_for.lower():
         return jsonify(success=False, message="لا يمكنك التصويت لنفسك."), 400
 
-    if (contest_ref.child(f"votes/{contest_data.get('contestant1_name')}/{user_id}").get() or
-            contest_ref.child(f"votes/{contest_data.get('contestant2_name')}/{user_id}").get()):
-        return jsonify(success=False, message="لقد قمت بالتصويت في هذه المنافسة بالفعل."), 409
-    
     try:
-        contest_ref.child(f"votes/{voted_for}/{user_id}").set(True)
+        if not claim_contest_vote(user_id, voted_for):
+            return jsonify(success=False, message="لقد قمت بالتصويت في هذه المنافسة بالفعل."), 409
         _log_public_notification(f"صوّت لـِ '{voted_for}' في منافسة الشعبية.")
         return jsonify(success=True, message="تم تسجيل صوتك بنجاح!")
     except Exception as e:
@@ -162,7 +218,7 @@ def buy_shop_product():
     user_id = session.get('user_id')
     product_id = request.form.get('product_id')
     if not product_id: return jsonify(success=False, message="معرف المنتج مفقود."), 400
-    product = db.reference(f'site_settings/shop_products/{product_id}').get()
+    product = get_settings(f'shop_products/{product_id}')
     if not product: return jsonify(success=False, message="المنتج غير موجود أو تم حذفه."), 404
     cc_price = product.get('cc_price', 0)
     sp_amount = product.get('sp_amount', 0)
@@ -178,6 +234,7 @@ def buy_shop_product():
             wallet['sp'] = wallet.get('sp', 0) + sp_amount
             return wallet
         user_wallet_ref.transaction(transact_purchase)
+        wallet_service.changed(user_id, 'sp')
         _log_public_notification(f"اشترى {sp_amount:,} SP من المتجر.")
         return jsonify(success=True, message=f"تم بنجاح شراء {sp_amount:,} SP!")
     except ValueError as e:
@@ -194,7 +251,7 @@ def buy_spin_attempt():
     if not product_id:
         return jsonify(success=False, message="معرف المنتج مفقود."), 400
 
-    product = db.reference(f'site_settings/shop_products_spins/{product_id}').get()
+    product = get_settings(f'shop_products_spins/{product_id}')
     if not product:
         return jsonify(success=False, message="المنتج غير موجود أو تم حذفه."), 404
 
@@ -203,37 +260,39 @@ def buy_spin_attempt():
     if not isinstance(sp_price, int) or not isinstance(attempts_to_add, int) or sp_price <= 0 or attempts_to_add <= 0:
         return jsonify(success=False, message="بيانات المنتج غير صالحة."), 500
 
-    spin_settings = db.reference('site_settings/spin_wheel_settings').get() or {}
+    spin_settings = get_settings('spin_wheel_settings', {})
     purchase_limit = spin_settings.get('purchaseLimit', 20)
 
     try:
-        wallet_ref = db.reference(f'wallets/{user_id}')
         user_spin_state_ref = db.reference(f'user_spin_state/{user_id}')
         
-        current_wallet_sp = (wallet_ref.child('sp').get() or 0)
-        if current_wallet_sp < sp_price:
-            return jsonify(success=False, message="رصيد SP غير كافٍ لإتمام عملية الشراء."), 400
+        limit_ref = db.reference(f'user_daily_limits/{user_id}/spin_purchase')
+        reads = read_parallel({
+            'limit': f'user_daily_limits/{user_id}/spin_purchase',
+            'purchased': f'user_spin_state/{user_id}/purchasedAttempts',
+            'avatar': f'registered_users/{user_id}/current_avatar',
+        })
 
         today_str = datetime.now().strftime('%Y-%m-%d')
-        limit_ref = db.reference(f'user_daily_limits/{user_id}/spin_purchase')
-        limit_data = limit_ref.get() or {}
+        limit_data = reads['limit'] or {}
         
         purchased_today = limit_data.get('count', 0) if limit_data.get('date') == today_str else 0
         
         if purchased_today >= purchase_limit:
             return jsonify(success=False, message=f"لقد وصلت للحد اليومي لشراء المحاولات وهو {purchase_limit} محاولة."), 403
 
-        current_purchased_attempts = (user_spin_state_ref.child('purchasedAttempts').get() or 0)
+        current_purchased_attempts = (reads['purchased'] or 0)
         max_accumulation = spin_settings.get('maxAccumulation', 10) # Using accumulation limit as overall cap
         if current_purchased_attempts + attempts_to_add > max_accumulation:
             return jsonify(success=False, message=f"لا يمكنك تجميع أكثر من {max_accumulation} محاولة. استخدم ما لديك أولاً."), 403
 
-        wallet_ref.child('sp').set(current_wallet_sp - sp_price)
+        if not wallet_service.debit(user_id, 'sp', sp_price):
+            return jsonify(success=False, message="رصيد SP غير كافٍ لإتمام عملية الشراء."), 400
         user_spin_state_ref.child('purchasedAttempts').transaction(lambda current: (current or 0) + attempts_to_add)
         
         limit_ref.set({'count': purchased_today + 1, 'date': today_str})
         
-        _log_public_notification(f"اشترى {attempts_to_add} محاولة/محاولات إضافية لعجلة الحظ.")
+        _log_public_notification(f"اشترى {attempts_to_add} محاولة/محاولات إضافية لعجلة الحظ.", user_avatar=reads['avatar'] or '')
         return jsonify(success=True, message=f"تم بنجاح شراء {attempts_to_add} محاولة دوران إضافية!")
 
     except Exception as e:
@@ -252,10 +311,8 @@ def buy_points_product():
         return jsonify(success=False, message="البيانات المطلوبة غير مكتملة."), 400
 
     try:
-        all_crawlers_ref = db.reference('users')
-        all_crawlers = all_crawlers_ref.get()
-        product = db.reference(f'site_settings/shop_products_points/{product_id}').get()
-        target_crawler_data = all_crawlers.get(target_crawler_name)
+        product = get_settings(f'shop_products_points/{product_id}')
+        target_crawler_data = roster.lookup(target_crawler_name)
         
         if not product or not target_crawler_data:
             return jsonify(success=False, message="المنتج أو الزاحف غير موجود."), 404
@@ -264,51 +321,45 @@ def buy_points_product():
         daily_limit = product.get('daily_limit', 1)
         today_str = datetime.now().strftime('%Y-%m-%d')
         limit_ref = db.reference(f'user_daily_limits/{user_id}/{product_id}')
-        limit_data = limit_ref.get() or {}
+        reads = read_parallel({
+            'limit': f'user_daily_limits/{user_id}/{product_id}',
+            'avatar': f'registered_users/{user_id}/current_avatar',
+        })
+        limit_data = reads['limit'] or {}
         current_count = limit_data.get('count', 0) if limit_data.get('date') == today_str else 0
         
         if current_count >= daily_limit: 
             return jsonify(success=False, message=f"لقد استهلكت الحد اليومي لهذا المنتج ({daily_limit} مرة)."), 403
             
-        wallet_ref = db.reference(f'wallets/{user_id}')
-        current_sp = (wallet_ref.get() or {}).get('sp', 0)
-        if current_sp < sp_price: 
-            return jsonify(success=False, message="رصيد SP لديك غير كافٍ."), 400
-
         points_change = 0
         product_type = product.get('type')
         base_points_change = product.get('points_amount', 0)
         
-        sorted_crawlers = sorted(all_crawlers.items(), key=lambda item: item[1].get('points', 0), reverse=True)
-        
-        target_rank = -1
-        for i, (name, data) in enumerate(sorted_crawlers):
-            if name == target_crawler_name:
-                target_rank = i
-                break
+        ranks = roster.ranked()
+        target_rank = ranks.rank_of(target_crawler_name)
         
-        if target_rank == -1:
+        if target_rank is None:
             return jsonify(success=False, message="لم يتم العثور على الزاحف المستهدف في الترتيب."), 500
 
         target_current_points = target_crawler_data.get('points', 0)
 
         if product_type == 'raise':
-            if target_rank == 0:
+            crawler_ahead = ranks.neighbour_above(target_crawler_name)
+            if crawler_ahead is None:
                 points_change = base_points_change 
             else:
-                _ , crawler_ahead_data = sorted_crawlers[target_rank - 1]
-                points_ahead = crawler_ahead_data.get('points', 0)
+                _ , points_ahead = crawler_ahead
                 # الهدف الجديد هو أن يكون أقل بنقطة واحدة من المنافس
                 new_target_points = points_ahead - 1
                 # التغيير الفعلي هو الفارق المطلوب للوصول لهذه النقطة
                 points_change = max(0, new_target_points - target_current_points)
                     
         elif product_type == 'drop':
-            if target_rank == len(sorted_crawlers) - 1:
+            crawler_behind = ranks.neighbour_below(target_crawler_name)
+            if crawler_behind is None:
                 points_change = -base_points_change
             else:
-                _ , crawler_behind_data = sorted_crawlers[target_rank + 1]
-                points_behind = crawler_behind_data.get('points', 0)
+                _ , points_behind = crawler_behind
                 # الهدف الجديد هو أن يكون أعلى بنقطة واحدة من المنافس
                 new_target_points = points_behind + 1
                 # التغيير الفعلي هو الفارق المطلوب للوصول لهذه النقطة
@@ -319,8 +370,11 @@ def buy_points_product():
             return jsonify(success=False, message=f"الزاحف '{target_crawler_name}' في أفضل مركز ممكن حالياً ولا يمكن تحريكه بهذا المنتج.")
         
         # تطبيق التغييرات
-        wallet_ref.child('sp').set(current_sp - sp_price)
-        db.reference(f'users/{target_crawler_name}/points').transaction(lambda p: max(1, (p or 0) + points_change))
+        if not wallet_service.debit(user_id, 'sp', sp_price):
+            return jsonify(success=False, message="رصيد SP لديك غير كافٍ."), 400
+        # النقاط تُكتب مباشرة في users/{name}/points لأن التقييم والترتيب يقرآنها فوراً
+        new_points = db.reference(f'users/{target_crawler_name}/points').transaction(lambda p: max(1, (p or 0) + points_change))
+        roster.apply(f'{target_crawler_name}/points', new_points)
         
         limit_ref.set({'count': current_count + 1, 'date': today_str})
         
@@ -329,7 +383,7 @@ def buy_points_product():
         
         message = f"تمت العملية بنجاح! تم تغيير نقاط الزاحف '{target_crawler_name}' بمقدار {points_change:,} نقطة."
         
-        db.reference('activity_log').push({
+        side_effects.push('activity_log', {
             'type': log_type, 
             'text': f"'{user_name}' أثر على '{target_crawler_name}' بـ{points_change:,} نقطة.",
             'timestamp': int(time.time()),
@@ -337,7 +391,7 @@ def buy_points_product():
             'user_name': user_name
         })
         
-        _log_public_notification(f"{action_text} '{target_crawler_name}'.")
+        _log_public_notification(f"{action_text} '{target_crawler_name}'.", user_avatar=reads['avatar'] or '')
         
         return jsonify(success=True, message=message)
         
@@ -349,15 +403,14 @@ def buy_points_product():
 @bp.route('/like/<username>', methods=['POST'])
 @login_required 
 def like_user(username):
-    user_to_like_ref = db.reference(f'users/{username}')
-    if not user_to_like_ref.get():
+    if not roster.exists(username):
         return jsonify(success=False, message="لا يمكن الإعجاب بزاحف غير موجود في القائمة."), 404
 
     amount = 1 if request.args.get('action', 'like') == 'like' else -1
-    user_to_like_ref.child('likes').transaction(lambda current: (current or 0) + amount)
+    crawler_likes.add(username, amount)
     
     if amount > 0:
-        db.reference('activity_log').push({
+        side_effects.push('activity_log', {
             'type': 'like', 
             'text': f"'{session.get('name')}' أعجب بـ '{username}'", 
             'timestamp': int(time.time()), 
@@ -374,7 +427,7 @@ def nominate_user():
     name = request.form.get('name', '').strip()
     if not name: return jsonify(success=False, message="الاسم مطلوب للترشيح."), 400
     if is_abusive(name): return jsonify(success=False, message="الرجاء استخدام كلمات لائقة."), 403
-    db.reference('activity_log').push({
+    side_effects.push('activity_log', {
         'type': 'nomination',
         'text': f"طلب ترشيح من '{session.get('name')}' لإضافة: '{name}'",
         'timestamp': int(time.time()),
@@ -389,7 +442,7 @@ def report_user():
     reason = request.form.get('reason', '').strip(); reported_user = request.form.get('reported_user', '').strip()
     if not all([reason, reported_user]): return jsonify(success=False, message="يجب اختيار زاحف وذكر السبب."), 400
     if is_abusive(reason) or is_abusive(reported_user): return jsonify(success=False, message="الرجاء استخدام كلمات لائقة."), 403
-    db.reference('activity_log').push({'type': 'report', 'text': f"بلاغ من '{session.get('name')}' ضد '{reported_user}': {reason}", 'timestamp': int(time.time()), 'user_id': session.get('user_id'), 'user_name': session.get('name')})
+    side_effects.push('activity_log', {'type': 'report', 'text': f"بلاغ من '{session.get('name')}' ضد '{reported_user}': {reason}", 'timestamp': int(time.time()), 'user_id': session.get('user_id'), 'user_name': session.get('name')})
     return jsonify(success=True, message=f"تم إرسال بلاغك بخصوص {reported_user}. شكراً لك.")
 
 @bp.route('/user_history/<username>')
@@ -398,13 +451,22 @@ def get_user_history(username):
     history = db.reference(f'points_history/{username}').get() or {}
     history_list = list(history.values())
     if not history_list:
-        points = (db.reference(f'users/{username}').get() or {}).get('points', 0)
+        points = (roster.lookup(username) or {}).get('points', 0)
         now = int(time.time())
         return jsonify([{'timestamp': now - 86400, 'points': points}, {'timestamp': now, 'points': points}])
     if len(history_list) == 1:
         history_list.insert(0, {'points': history_list[0]['points'], 'timestamp': history_list[0]['timestamp'] - 86400})
     return jsonify(sorted(history_list, key=lambda x: x.get('timestamp', 0)))
 
+@bp.route('/portfolio')
+@login_required
+def get_portfolio():
+    try:
+        return jsonify(success=True, **portfolio_cache.get(session.get('user_id')))
+    except Exception as e:
+        print(f"!!! Portfolio Error: {e}", file=sys.stderr)
+        return jsonify(success=False, message="خطأ في الخادم أثناء جلب المحفظة الاستثمارية."), 500
+
 @bp.route('/invest', methods=['POST'])
 @login_required
 def invest_in_crawler():
@@ -418,38 +480,36 @@ def invest_in_crawler():
     if sp_to_invest <= 0:
         return jsonify(success=False, message="يجب استثمار كمية موجبة."), 400
 
-    settings = db.reference('site_settings/investment_settings').get() or {}
+    settings = get_settings('investment_settings', {})
     max_investments = settings.get('max_investments')
 
-    investment_ref = db.reference(f'investments/{user_id}/{crawler_name}')
-    current_investment = investment_ref.get()
-
-    all_user_investments = db.reference(f'investments/{user_id}').get() or {}
+    reads = read_parallel({
+        'investments': f'investments/{user_id}',
+        'avatar': f'registered_users/{user_id}/current_avatar',
+    })
+    all_user_investments = reads['investments'] or {}
+    current_investment = all_user_investments.get(crawler_name)
     num_current_investments = len(all_user_investments.keys())
     
     if not current_investment and max_investments and max_investments > 0:
         if num_current_investments >= max_investments:
             return jsonify(success=False, message=f"لقد وصلت للحد الأقصى وهو {max_investments} استثمارات مختلفة."), 403
 
-    all_crawlers_ref = db.reference('users')
-    all_crawlers = all_crawlers_ref.get()
-    crawler_data = all_crawlers.get(crawler_name)
+    crawler_data = roster.lookup(crawler_name)
 
     if not crawler_data:
         return jsonify(success=False, message="هذا الزاحف غير موجود."), 404
 
-    wallet_ref = db.reference(f'wallets/{user_id}')
-    current_sp = (wallet_ref.get() or {}).get('sp', 0)
-    if current_sp < sp_to_invest:
+    if not wallet_service.debit(user_id, 'sp', sp_to_invest):
         return jsonify(success=False, message="رصيد SP غير كافٍ للاستثمار."), 400
 
-    new_sp_balance = current_sp - sp_to_invest
-    wallet_ref.child('sp').set(new_sp_balance)
+    # باقي الكتابات تُجمع وتُرسل في تحديث واحد متعدد المسارات في نهاية الطلب
+    batch = request_batch()
     
     points_at_investment = crawler_data.get('points', 0)
     now_timestamp = int(time.time())
     
-    governor_settings = db.reference('site_settings/market_governor').get() or {}
+    governor_settings = get_settings('market_governor', {})
     final_sp_for_lot = sp_to_invest
     instant_bonus_details = ""
 
@@ -479,10 +539,6 @@ def invest_in_crawler():
         't': now_timestamp,
         'original_sp': sp_to_invest
     }
-    
-    new_lot_ref = investment_ref.child('lots').push()
-    new_lot_key = new_lot_ref.key
-    new_lot_ref.set(new_lot)
 
     bonus_message = ""
     bonus_sp_applied = 0
@@ -490,15 +546,11 @@ def invest_in_crawler():
         
         rank_threshold = governor_settings.get('underdog_rank_threshold', 0)
         if rank_threshold > 0:
-            sorted_crawlers = sorted(all_crawlers.values(), key=lambda x: x.get('points', 0), reverse=True)
-            try:
-                rank = [c.get('name') for c in sorted_crawlers].index(crawler_name) + 1
-                if rank > rank_threshold:
-                    bonus_percent = governor_settings.get('underdog_bonus_percent', 0)
-                    bonus_sp_applied += sp_to_invest * (bonus_percent / 100.0)
-                    bonus_message += f"<br>تمت إضافة مكافأة 'المستثمر المغامر' بقيمة {bonus_sp_applied:.2f} SP!"
-            except (ValueError, AttributeError):
-                pass
+            rank = roster.ranked().rank_of(crawler_name)
+            if rank is not None and rank + 1 > rank_threshold:
+                bonus_percent = governor_settings.get('underdog_bonus_percent', 0)
+                bonus_sp_applied += sp_to_invest * (bonus_percent / 100.0)
+                bonus_message += f"<br>تمت إضافة مكافأة 'المستثمر المغامر' بقيمة {bonus_sp_applied:.2f} SP!"
 
         milestones = governor_settings.get('diversify_milestones', [])
         if not current_investment and (num_current_investments + 1) in milestones:
@@ -508,16 +560,27 @@ def invest_in_crawler():
             bonus_message += f"<br>تمت إضافة مكافأة 'التنويع' بقيمة {diversify_bonus_sp:.2f} SP!"
 
         if bonus_sp_applied > 0:
-            new_lot_ref.child('sp').transaction(lambda current_val: (current_val or 0) + bonus_sp_applied)
-            new_lot_ref.child('bonus_applied').set(True)
+            # الدفعة لم تُكتب بعد، لذا تُضاف المكافأة مباشرة بدلاً من transaction منفصلة
+            new_lot['sp'] += bonus_sp_applied
+            new_lot['bonus_applied'] = True
             final_sp_for_lot += bonus_sp_applied
 
-    _log_public_notification(f"استثمر في '{crawler_name}' بمبلغ {sp_to_invest:,.2f} SP.")
-    db.reference('investment_log').push({
+    new_lot_key = batch.push(f'investments/{user_id}/{crawler_name}/lots', new_lot)
+
+    try:
+        batch.commit()
+    except Exception as e:
+        print(f"!!! Invest Error for user {user_id}: {e}", file=sys.stderr)
+        wallet_service.credit(user_id, 'sp', sp_to_invest)
+        return jsonify(success=False, message="حدث خطأ في الخادم أثناء الاستثمار."), 500
+
+    # السجلات تُكتب في الخلفية بعد نجاح الاستثمار
+    side_effects.push('investment_log', {
         'investor_id': user_id, 'investor_name': user_name,
         'target_name': crawler_name, 'action': 'invest',
         'sp_amount': sp_to_invest, 'timestamp': now_timestamp
     })
+    _log_public_notification(f"استثمر في '{crawler_name}' بمبلغ {sp_to_invest:,.2f} SP.", user_avatar=reads['avatar'] or '')
     
     final_message = (f"تم استثمار <strong>{sp_to_invest:,.2f} SP</strong> في {crawler_name} بنجاح!"
                      f"{instant_bonus_details}"
@@ -543,17 +606,22 @@ def sell_lot():
     if not all([crawler_name, lot_id]):
         return jsonify(success=False, message="بيانات غير مكتملة للبيع."), 400
 
-    lot_ref = db.reference(f'investments/{user_id}/{crawler_name}/lots/{lot_id}')
-    lot_data = lot_ref.get()
+    investment_path = f'investments/{user_id}/{crawler_name}'
+    lot_path = f'{investment_path}/lots/{lot_id}'
+    reads = read_parallel({
+        'investment': investment_path,
+        'avatar': f'registered_users/{user_id}/current_avatar',
+    })
+    investment_data = reads['investment']
+    lot_data = ((investment_data or {}).get('lots') or {}).get(lot_id)
     if not lot_data:
         return jsonify(success=False, message="دفعة الاستثمار هذه غير موجودة أو تم بيعها."), 404
 
-    investment_data = db.reference(f'investments/{user_id}/{crawler_name}').get()
-    crawler_data = db.reference(f'users/{crawler_name}').get()
+    crawler_data = roster.lookup(crawler_name)
     if not investment_data or not crawler_data:
         return jsonify(success=False, message="لا يمكن العثور على بيانات الزاحف أو الاستثمار."), 404
     
-    settings = db.reference('site_settings/investment_settings').get() or {}
+    settings = get_settings('investment_settings', {})
     lock_hours = settings.get('investment_lock_hours', 0)
     lock_seconds = lock_hours * 3600
     lot_timestamp = int(lot_data.get('t', 0))
@@ -564,17 +632,14 @@ def sell_lot():
     
     withdrawal_approval_limit = settings.get('withdrawal_approval_limit', 500000)
     
-    invested_sp = float(lot_data.get('sp', 0))
-    original_invested_sp = float(lot_data.get('original_sp', invested_sp))
-    points_at_inv = float(max(1, lot_data.get('p', 1)))
-    current_points = float(max(1, crawler_data.get('points', 1)))
-    stock_multiplier = float(crawler_data.get('stock_multiplier', 1.0))
-    personal_multiplier = float(investment_data.get('personal_multiplier', 1.0))
-    value_of_lot_before_tax = invested_sp * (current_points / points_at_inv) * stock_multiplier * personal_multiplier
+    sale = sale_breakdown(position_lots(investment_data, crawler_data, [lot_id]), settings.get('sell_tax_percent', 0.0))
+    value_of_lot_before_tax = float(sale['value'][0])
+    original_invested_sp = float(sale['cost'][0])
+
+    batch = request_batch()
 
     if value_of_lot_before_tax > withdrawal_approval_limit:
-        withdrawal_request_ref = db.reference('withdrawal_requests').push()
-        withdrawal_request_ref.set({
+        batch.push('withdrawal_requests', {
             'user_id': user_id,
             'user_name': user_name,
             'crawler_name': crawler_name,
@@ -584,31 +649,30 @@ def sell_lot():
             'status': 'pending',
             'timestamp': now
         })
-        lot_ref.delete()
+        batch.delete(lot_path)
+        try:
+            batch.commit()
+        except Exception as e:
+            print(f"!!! Sell Lot Error (withdrawal request): {e}", file=sys.stderr)
+            return jsonify(success=False, message="حدث خطأ في الخادم أثناء البيع."), 500
         return jsonify(success=True, status='pending', message=f"طلب سحب مبلغ {value_of_lot_before_tax:,.2f} SP قيد المراجعة من الإدارة.")
 
-    sell_tax_percent = settings.get('sell_tax_percent', 0.0)
     sell_fee_sp = settings.get('sell_fee_sp', 0.0)
-    
-    profit = value_of_lot_before_tax - original_invested_sp
-    
-    tax_amount = max(0, profit * (sell_tax_percent / 100.0))
-    
-    final_sp_to_return = value_of_lot_before_tax - tax_amount - sell_fee_sp
+    final_sp_to_return = float(sale['net'][0]) - sell_fee_sp
 
     try:
-        db.reference(f'wallets/{user_id}/sp').transaction(lambda current_sp: (current_sp or 0) + final_sp_to_return)
-        lot_ref.delete()
-        remaining_lots = db.reference(f'investments/{user_id}/{crawler_name}/lots').get()
-        if not remaining_lots:
-            db.reference(f'investments/{user_id}/{crawler_name}').delete()
+        # الإضافة للمحفظة تمر عبر خدمة المحافظ، فتُرسل مع حذف الدفعة في نفس التحديث الذري
+        wallet_service.stage_credit(batch, user_id, 'sp', final_sp_to_return)
+        batch.delete(lot_path)
+        batch.commit()
+        _drop_empty_investment(investment_path)
 
-        db.reference('investment_log').push({
+        side_effects.push('investment_log', {
             'investor_id': user_id, 'investor_name': user_name,
             'target_name': crawler_name, 'action': 'sell',
             'sp_amount': final_sp_to_return, 'timestamp': now
         })
-        _log_public_notification(f"باع حصة من أسهمه في '{crawler_name}' مقابل {final_sp_to_return:,.2f} SP.")
+        _log_public_notification(f"باع حصة من أسهمه في '{crawler_name}' مقابل {final_sp_to_return:,.2f} SP.", user_avatar=reads['avatar'] or '')
         
         message = f"تم بيع الدفعة بنجاح! لقد حصلت على {final_sp_to_return:.2f} SP."
         if final_sp_to_return < original_invested_sp:
@@ -626,25 +690,23 @@ def buy_avatar():
     avatar_id = request.form.get('avatar_id')
     if not avatar_id:
         return jsonify(success=False, message="معرّف الأفاتار مفقود."), 400
-    avatar_ref = db.reference(f'site_settings/shop_avatars/{avatar_id}')
-    avatar_data = avatar_ref.get()
+    avatar_data = get_settings(f'shop_avatars/{avatar_id}')
     if not avatar_data:
         return jsonify(success=False, message="الأفاتار المحدد غير موجود أو تم حذفه."), 404
     user_avatar_ref = db.reference(f'user_avatars/{user_id}/owned/{avatar_id}')
     if user_avatar_ref.get():
         return jsonify(success=False, message="أنت تمتلك هذا الأفاتار بالفعل."), 400
     price_sp = avatar_data.get('price_sp_personal', 0)
-    wallet_ref = db.reference(f'wallets/{user_id}')
+    # الخصم المشروط يبقى transaction، وباقي الكتابات تُرسل دفعة واحدة
+    if not wallet_service.debit(user_id, 'sp', price_sp):
+        return jsonify(success=False, message="رصيد SP غير كافٍ لإتمام عملية الشراء."), 400
+    batch = request_batch()
     try:
-        def transact_avatar_purchase(current_sp):
-            if (current_sp or 0) < price_sp:
-                raise ValueError("رصيد SP غير كافٍ لإتمام عملية الشراء.")
-            return current_sp - price_sp
-        wallet_ref.child('sp').transaction(transact_avatar_purchase)
-        user_avatar_ref.set({'purchased_at': int(time.time())})
+        batch.set(f'user_avatars/{user_id}/owned/{avatar_id}', {'purchased_at': int(time.time())})
+        batch.commit()
         
         log_text = f"اشترى أفاتار '{avatar_data.get('name')}'."
-        db.reference('activity_log').push({
+        side_effects.push('activity_log', {
             'type': 'purchase',
             'text': f"'{session.get('name')}' {log_text}",
             'timestamp': int(time.time()),
@@ -653,10 +715,9 @@ def buy_avatar():
         })
         _log_public_notification(log_text)
         return jsonify(success=True, message=f"تم شراء أفاتار '{avatar_data.get('name')}' بنجاح!")
-    except ValueError as e:
-        return jsonify(success=False, message=str(e)), 400
     except Exception as e:
         print(f"!!! Avatar Purchase Error for user {user_id}: {e}", file=sys.stderr)
+        wallet_service.credit(user_id, 'sp', price_sp)
         return jsonify(success=False, message="حدث خطأ في الخادم أثناء الشراء."), 500
 
 @bp.route('/user/set_avatar', methods=['POST'])
@@ -672,13 +733,13 @@ def set_user_avatar():
     if not db.reference(f'user_avatars/{user_id}/owned/{avatar_id}').get():
         return jsonify(success=False, message="أنت لا تمتلك هذا الأفاتار."), 403
     
-    avatar_image_url = db.reference(f'site_settings/shop_avatars/{avatar_id}/image_url').get()
+    avatar_image_url = get_settings(f'shop_avatars/{avatar_id}/image_url')
     if not avatar_image_url:
         return jsonify(success=False, message="لم يتم العثور على صورة الأفاتار."), 404
 
     try:
         db.reference(f'registered_users/{user_id}').update({'current_avatar': avatar_image_url})
-        if db.reference(f'users/{user_name}').get():
+        if roster.exists(user_name):
             db.reference(f'users/{user_name}').update({'avatar_url': avatar_image_url})
         return jsonify(success=True, message="تم تغيير الأفاتار بنجاح!")
     except Exception as e:
@@ -700,12 +761,11 @@ def submit_gift_request():
         if gifter_name.lower() == target_name.lower():
             return jsonify(success=False, message="لا يمكنك إهداء نفسك."), 400
         
-        avatar_data = db.reference(f'site_settings/shop_avatars/{avatar_id}').get()
+        avatar_data = get_settings(f'shop_avatars/{avatar_id}')
         if not avatar_data: 
             return jsonify(success=False, message="الأفاتار المحدد غير موجود."), 404
 
-        target_crawler_ref = db.reference(f'users/{target_name}')
-        if not target_crawler_ref.get():
+        if not roster.exists(target_name):
             return jsonify(success=False, message=f"لا يمكن العثور على زاحف بالاسم '{target_name}' في القائمة."), 404
         
         price_sp_gift = avatar_data.get('price_sp_gift', 0)
@@ -742,8 +802,7 @@ def buy_nudge():
     if not nudge_id:
         return jsonify(success=False, message="معرف النكزة مفقود."), 400
 
-    nudge_product_ref = db.reference(f'site_settings/shop_products_nudges/{nudge_id}')
-    nudge_product = nudge_product_ref.get()
+    nudge_product = get_settings(f'shop_products_nudges/{nudge_id}')
 
     if not nudge_product:
         return jsonify(success=False, message="هذه النكزة غير متوفرة في المتجر."), 404
@@ -754,25 +813,16 @@ def buy_nudge():
     
     sp_price = nudge_product.get('sp_price', 0)
     
+    if not wallet_service.debit(user_id, 'sp', sp_price):
+        return jsonify(success=False, message="رصيد SP غير كافٍ لإتمام عملية الشراء."), 400
+
     try:
-        wallet_ref = db.reference(f'wallets/{user_id}')
-        
-        def transact_nudge_purchase(current_wallet_data):
-            wallet = current_wallet_data or {'sp': 0}
-            current_sp = wallet.get('sp', 0)
-            if current_sp < sp_price:
-                raise ValueError("رصيد SP غير كافٍ لإتمام عملية الشراء.")
-            wallet['sp'] = current_sp - sp_price
-            return wallet
-            
-        wallet_ref.transaction(transact_nudge_purchase)
-        
         user_owned_ref.set({'purchased_at': int(time.time())})
         
         log_text = f"اشترى نكزة: '{nudge_product.get('text', '')[:30]}...'"
         _log_public_notification(log_text)
         
-        db.reference('activity_log').push({
+        side_effects.push('activity_log', {
             'type': 'purchase',
             'text': f"'{session.get('name')}' {log_text}",
             'timestamp': int(time.time()),
@@ -782,11 +832,9 @@ def buy_nudge():
         
         return jsonify(success=True, message="تم شراء النكزة بنجاح!")
     
-    except ValueError as e:
-        return jsonify(success=False, message=str(e)), 400
     except Exception as e:
         print(f"!!! Nudge Purchase Error for user {user_id}: {e}", file=sys.stderr)
-        db.reference(f'wallets/{user_id}/sp').transaction(lambda current: (current or 0) + sp_price)
+        wallet_service.credit(user_id, 'sp', sp_price)
         return jsonify(success=False, message="حدث خطأ في الخادم أثناء الشراء."), 500
 
 @bp.route('/send_nudge', methods=['POST'])
@@ -803,17 +851,21 @@ def send_nudge():
     if not all([target_uid, nudge_id, target_type]):
         return jsonify(success=False, message="بيانات الطلب غير مكتملة."), 400
         
-    if not db.reference(f'user_nudges/{sender_id}/owned/{nudge_id}').get():
+    reads = read_parallel({
+        'owned': f'user_nudges/{sender_id}/owned/{nudge_id}',
+        'avatar': f'registered_users/{sender_id}/current_avatar',
+    })
+    if not reads['owned']:
         return jsonify(success=False, message="أنت لا تمتلك هذه النكزة."), 403
     
-    nudge_product = db.reference(f'site_settings/shop_products_nudges/{nudge_id}').get()
+    nudge_product = get_settings(f'shop_products_nudges/{nudge_id}')
     if not nudge_product:
         return jsonify(success=False, message="لم يتم العثور على نص النكزة."), 404
         
     nudge_text = nudge_product.get('text')
     sp_price = nudge_product.get('sp_price', 0)
 
-    sender_avatar = db.reference(f'registered_users/{sender_id}/current_avatar').get()
+    sender_avatar = reads['avatar']
 
     nudge_payload = {
         "text": nudge_text,
@@ -826,15 +878,20 @@ def send_nudge():
     try:
         print(f"Sending nudge from '{sender_name}' to UID '{target_uid}' of type '{target_type}'") # For debugging
         
+        batch = request_batch()
         if target_type == 'user':
             print(f"Dispatching PRIVATE nudge to user_nudges/{target_uid}/incoming")
-            db.reference(f'user_nudges/{target_uid}/incoming').push(nudge_payload)
+            nudge_key = batch.push(f'user_nudges/{target_uid}/incoming', nudge_payload)
+            # فهرس انتهاء الصلاحية: المنظف يقرأ دلاء الدقائق المنتهية فقط بدل شجرة user_nudges كاملة
+            expiry_bucket = nudge_expiry_bucket(nudge_payload['timestamp'])
+            batch.set(f'{NUDGE_EXPIRY_ROOT}/{expiry_bucket}/{nudge_key}', f'user_nudges/{target_uid}/incoming/{nudge_key}')
         elif target_type == 'crawler':
             print(f"Dispatching PUBLIC nudge to public_nudges")
             nudge_payload['target_element_id'] = target_element_id
-            db.reference('public_nudges').push(nudge_payload)
+            batch.push('public_nudges', nudge_payload)
         else:
             return jsonify(success=False, message="نوع الهدف غير صحيح."), 400
+        batch.commit()
             
         return jsonify(success=True)
     except Exception as e:
@@ -1,9 +1,10 @@
 ﻿# --- START OF FILE project/utils.py ---
 
 import sys
+import time
 from functools import wraps
 from flask import session, redirect, url_for, flash, jsonify, request
-from firebase_admin import db
+from .storage import db
 from google.auth.exceptions import RefreshError, TransportError
 from firebase_admin.exceptions import FirebaseError
 
@@ -76,4 +77,24 @@ def check_user_status(uid):
         print(f"Error in check_user_status: {e}", file=sys.stderr)
         return 'db_error', None
 
+LIVE_FEED_ROOT = 'live_feed'
+
+def live_feed_bucket(timestamp=None):
+    """
+    Hour bucket (UTC, 'YYYYMMDDHH') that a live feed entry written at `timestamp` belongs to.
+    live_notifications.js derives the same key on the client, so both must stay in UTC.
+    """
+    if timestamp is None:
+        timestamp = time.time()
+    return time.strftime('%Y%m%d%H', time.gmtime(timestamp))
+
+def is_live_feed_bucket(key):
+    return isinstance(key, str) and len(key) == 10 and key.isdigit()
+
+NUDGE_EXPIRY_ROOT = 'nudge_expiry'
+
+def nudge_expiry_bucket(timestamp):
+    """Minute bucket (epoch minutes, zero-padded so keys sort numerically) of the expiry index."""
+    return f'{int(timestamp) // 60:010d}'
+
 # --- END OF FILE project/utils.py ---
\ No newline at end of file
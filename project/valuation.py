@@ -0,0 +1,143 @@
+﻿# --- START OF FILE project/valuation.py ---
+import numpy as np
+from .storage import db
+from .read_fanout import read_parallel
+
+VALUATION_PAGE_SIZE = 200
+
+_LOT_FIELDS = ('sp', 'cost', 'points_at', 'current_points', 'stock_multiplier', 'personal_multiplier', 't')
+
+
+def lot_arrays(investments, crawlers, lot_ids=None):
+    """
+    Flattens {uid: {crawler_name: investment}} into per-lot arrays plus the position each
+    lot belongs to. Positions whose crawler is missing from `crawlers` or that hold no lots
+    are skipped; `lot_ids` limits the lots taken from every position.
+
+    Returns (positions, lot_position, lots): positions are (uid, crawler_name,
+    personal_multiplier) tuples, lots a dict of arrays keyed by _LOT_FIELDS plus the
+    list of lot 'ids'.
+    """
+    positions, lot_position, ids = [], [], []
+    columns = {field: [] for field in _LOT_FIELDS}
+    for uid, user_investments in investments.items():
+        for crawler_name, investment in (user_investments or {}).items():
+            crawler = crawlers.get(crawler_name)
+            lots = (investment or {}).get('lots') or {}
+            if not crawler or not isinstance(lots, dict) or not lots:
+                continue
+            index = len(positions)
+            personal_multiplier = float(investment.get('personal_multiplier', 1.0))
+            current_points = float(max(1, crawler.get('points', 1)))
+            stock_multiplier = float(crawler.get('stock_multiplier', 1.0))
+            positions.append((uid, crawler_name, personal_multiplier))
+            for lot_id, lot in lots.items():
+                if lot_ids is not None and lot_id not in lot_ids:
+                    continue
+                ids.append(lot_id)
+                lot_position.append(index)
+                columns['sp'].append(float(lot.get('sp', 0)))
+                columns['cost'].append(float(lot.get('original_sp', lot.get('sp', 0))))
+                columns['points_at'].append(float(max(1, lot.get('p', 1))))
+                columns['current_points'].append(current_points)
+                columns['stock_multiplier'].append(stock_multiplier)
+                columns['personal_multiplier'].append(personal_multiplier)
+                columns['t'].append(float(lot.get('t', 0)))
+    lots = {field: np.array(values, dtype=float) for field, values in columns.items()}
+    lots['ids'] = ids
+    return positions, np.array(lot_position, dtype=int), lots
+
+
+def position_lots(investment, crawler, lot_ids=None):
+    """The lot arrays of a single position (one user, one crawler)."""
+    _, _, lots = lot_arrays({'': {'': investment}}, {'': crawler}, lot_ids)
+    return lots
+
+
+def lot_values(lots):
+    """sp × (current points / points at purchase) × stock_multiplier × personal_multiplier, per lot."""
+    return lots['sp'] * (lots['current_points'] / lots['points_at']) * lots['stock_multiplier'] * lots['personal_multiplier']
+
+
+def sale_breakdown(lots, sell_tax_percent=0.0):
+    """
+    Value, profit, tax and proceeds (before the sell fee) of selling each lot. Profit is
+    taxed over what was paid for the lot (original_sp), not over its bonus-adjusted sp.
+    """
+    value = lot_values(lots)
+    profit = value - lots['cost']
+    tax = np.maximum(0.0, profit * (float(sell_tax_percent or 0) / 100.0))
+    return {'value': value, 'cost': lots['cost'], 'profit': profit, 'tax': tax, 'net': value - tax}
+
+
+def value_positions(positions, lot_position, lots, sell_tax_percent=0.0, sell_fee_sp=0.0):
+    """
+    The sale breakdown summed per position, as force_sell_all_lots liquidates it:
+    every lot taxed on its own profit, then sell_fee_sp once per position.
+    """
+    sale = sale_breakdown(lots, sell_tax_percent)
+    totals = {key: np.bincount(lot_position, weights=column, minlength=len(positions)) for key, column in sale.items()}
+    totals['net'] = totals['net'] - float(sell_fee_sp or 0)
+    totals['lots'] = np.bincount(lot_position, minlength=len(positions))
+    return totals
+
+
+def reset_profit_multipliers(positions, lot_position, lots):
+    """
+    Personal multiplier that brings each position's value back to the SP held in its lots:
+    Σ sp / Σ sp × (current points / points at purchase) × stock_multiplier, or 1.0 where
+    that is undefined.
+    """
+    market_values = lots['sp'] * (lots['current_points'] / lots['points_at']) * lots['stock_multiplier']
+    held = np.bincount(lot_position, weights=lots['sp'], minlength=len(positions))
+    market = np.bincount(lot_position, weights=market_values, minlength=len(positions))
+    return np.divide(held, market, out=np.ones_like(held), where=(held > 0) & (market > 0))
+
+
+# --- bulk valuation ---
+def _rows(positions, totals):
+    rows = []
+    for index, (uid, crawler_name, personal_multiplier) in enumerate(positions):
+        row = {'user_id': uid, 'crawler_name': crawler_name, 'personal_multiplier': personal_multiplier,
+               'lots': int(totals['lots'][index])}
+        row.update({key: round(float(totals[key][index]), 2) for key in ('value', 'cost', 'profit', 'tax', 'net')})
+        rows.append(row)
+    return rows
+
+
+def _summary(rows):
+    summary = {key: round(sum(row[key] for row in rows), 2) for key in ('value', 'cost', 'profit', 'tax', 'net')}
+    summary.update({'positions': len(rows), 'lots': sum(row['lots'] for row in rows)})
+    return summary
+
+
+def value_crawler(crawler_name, crawler, settings):
+    """
+    Values every position held in one crawler. Investor ids come from a shallow read and
+    their positions are read VALUATION_PAGE_SIZE at a time; each page is valued at once.
+    """
+    uids = sorted((db.reference('investments', memoize=False).get(shallow=True) or {}).keys())
+    rows = []
+    for start in range(0, len(uids), VALUATION_PAGE_SIZE):
+        page = uids[start:start + VALUATION_PAGE_SIZE]
+        results = read_parallel({uid: f'investments/{uid}/{crawler_name}' for uid in page})
+        page_investments = {uid: {crawler_name: results.get(uid)} for uid in page if results.get(uid)}
+        positions, lot_position, lots = lot_arrays(page_investments, {crawler_name: crawler})
+        if positions:
+            totals = value_positions(positions, lot_position, lots, settings.get('sell_tax_percent', 0.0), settings.get('sell_fee_sp', 0.0))
+            rows.extend(_rows(positions, totals))
+    rows.sort(key=lambda row: row['value'], reverse=True)
+    return rows, _summary(rows)
+
+
+def value_user(user_id, crawlers, settings):
+    """Values every position of one user."""
+    user_investments = db.reference(f'investments/{user_id}').get() or {}
+    positions, lot_position, lots = lot_arrays({user_id: user_investments}, crawlers)
+    if not positions:
+        return [], _summary([])
+    totals = value_positions(positions, lot_position, lots, settings.get('sell_tax_percent', 0.0), settings.get('sell_fee_sp', 0.0))
+    rows = sorted(_rows(positions, totals), key=lambda row: row['value'], reverse=True)
+    return rows, _summary(rows)
+
+# --- END OF FILE project/valuation.py ---
@@ -0,0 +1,133 @@
+﻿# --- START OF FILE project/wallet_service.py ---
+import sys
+from .storage import db
+from .sharded_counter import wallet_counters, wallet_credits_sharded
+
+CURRENCIES = ('sp', 'cc')
+
+_change_hooks = []
+
+
+class WalletResult:
+    """Outcome of a wallet operation: `ok` and the balance after it (or the balance that was too low)."""
+
+    def __init__(self, ok, balance):
+        self.ok = ok
+        self.balance = balance
+
+    def __bool__(self):
+        return self.ok
+
+    def __repr__(self):
+        return f"WalletResult(ok={self.ok}, balance={self.balance})"
+
+
+class _InsufficientFunds(Exception):
+    def __init__(self, balance):
+        super().__init__(balance)
+        self.balance = balance
+
+
+def _check_currency(currency):
+    if currency not in CURRENCIES:
+        raise ValueError(f"Unknown wallet currency '{currency}'.")
+
+
+def _balance_ref(uid, currency):
+    _check_currency(currency)
+    return db.reference(f'wallets/{uid}/{currency}')
+
+
+def on_change(hook):
+    """Registers `hook(uid, currency, balance)`, called after every wallet change made through here."""
+    if hook not in _change_hooks:
+        _change_hooks.append(hook)
+
+
+def changed(uid, currency, balance=None):
+    """
+    Runs the change hooks. `balance` is the new balance when the writer knows it, None
+    for server-side increments. Code that writes wallets/ directly calls this too.
+    The money has already moved, so a failing hook is logged and never fails the caller.
+    """
+    for hook in _change_hooks:
+        try:
+            hook(uid, currency, balance)
+        except Exception as e:
+            print(f"!!! Wallet change hook failed for '{uid}': {e}", file=sys.stderr)
+
+
+def balance(uid, currency, canonical=None):
+    """The balance including credits still waiting in shards; `canonical` skips reading the field."""
+    if canonical is None:
+        canonical = _balance_ref(uid, currency).get() or 0
+    if wallet_credits_sharded():
+        return canonical + wallet_counters[currency].pending(uid)
+    return canonical
+
+
+def debit(uid, currency, amount, payout=0):
+    """
+    Takes `amount` from the wallet if the balance covers it, in one conditional transaction.
+
+    `payout` is added back in the same transaction once the debit is allowed, so a bet
+    and its winnings settle together and nothing has to be refunded afterwards.
+    Returns WalletResult(ok=False, balance=current) when funds are insufficient.
+    """
+    if amount < 0:
+        raise ValueError("Debit amount must not be negative.")
+    if wallet_credits_sharded():
+        _check_currency(currency)
+        wallet_counters[currency].fold(uid)
+
+    def transaction_update(current):
+        balance = current or 0
+        if balance < amount:
+            raise _InsufficientFunds(balance)
+        return balance - amount + payout
+
+    try:
+        new_balance = _balance_ref(uid, currency).transaction(transaction_update)
+    except _InsufficientFunds as e:
+        return WalletResult(False, e.balance)
+    changed(uid, currency, new_balance)
+    return WalletResult(True, new_balance)
+
+
+def credit_updates(uid, currency, amount):
+    """
+    Multi-path update entries that credit `amount` with a server-side increment
+    (or to a shard when sharded credits are on), so many credits can be written
+    together with other paths in one update. Nothing is written yet, so the caller
+    runs changed() once its update is committed (stage_credit does that for a WriteBatch).
+    """
+    _check_currency(currency)
+    if wallet_credits_sharded():
+        return wallet_counters[currency].stage(uid, amount)
+    return {f'wallets/{uid}/{currency}': {'.sv': {'increment': amount}}}
+
+
+def stage_credit(batch, uid, currency, amount):
+    """Stages a credit on a WriteBatch; the change hooks run only after the batch commits."""
+    for path, value in credit_updates(uid, currency, amount).items():
+        batch.set(path, value)
+    batch.after_commit(lambda: changed(uid, currency))
+
+
+def credit(uid, currency, amount):
+    """
+    Adds `amount` to the wallet in one transaction and returns the new balance.
+    Negative amounts are allowed for settlements that can end below zero (e.g. forced sells).
+    With sharded wallet credits enabled the amount goes to a shard instead and the
+    returned balance is None until the next fold.
+    """
+    if wallet_credits_sharded():
+        _check_currency(currency)
+        wallet_counters[currency].add(uid, amount)
+        changed(uid, currency)
+        return WalletResult(True, None)
+    new_balance = _balance_ref(uid, currency).transaction(lambda current: (current or 0) + amount)
+    changed(uid, currency, new_balance)
+    return WalletResult(True, new_balance)
+
+# --- END OF FILE project/wallet_service.py ---
@@ -0,0 +1,137 @@
+﻿# --- START OF FILE project/write_batch.py ---
+import sys
+import copy
+from flask import g, has_request_context
+from .storage import db, generate_push_id
+
+
+def _split(path):
+    return [p for p in path.strip('/').split('/') if p]
+
+
+def _increment(amount):
+    return {'.sv': {'increment': amount}}
+
+
+class WriteBatch:
+    """
+    Unit of work that gathers sets, deletes and pushes and commits them as a
+    single multi-path db.reference().update() — one round trip, applied atomically.
+
+    Writes that depend on the current value (balance checks etc.) cannot be staged;
+    use transaction(), which runs immediately and is deliberately not part of the batch.
+    """
+
+    def __init__(self):
+        self._updates = {}
+        self._after_commit = []
+
+    def __len__(self):
+        return len(self._updates)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+        return False
+
+    def set(self, path, value):
+        parts = _split(path)
+        key = '/'.join(parts)
+        value = copy.deepcopy(value) if isinstance(value, dict) else value
+        # A staged ancestor already owns this location: write inside its value instead.
+        for i in range(len(parts) - 1, 0, -1):
+            ancestor = '/'.join(parts[:i])
+            if ancestor in self._updates:
+                node = self._updates[ancestor]
+                if not isinstance(node, dict):
+                    node = {}
+                    self._updates[ancestor] = node
+                for part in parts[i:-1]:
+                    child = node.get(part)
+                    if not isinstance(child, dict):
+                        child = {}
+                        node[part] = child
+                    node = child
+                if value is None:
+                    node.pop(parts[-1], None)
+                else:
+                    node[parts[-1]] = value
+                return
+        # Descendants staged earlier are overwritten by this value (RTDB rejects overlapping paths).
+        prefix = key + '/'
+        for staged in [p for p in self._updates if p.startswith(prefix)]:
+            del self._updates[staged]
+        self._updates[key] = value
+
+    def update(self, path, values):
+        for key, value in (values or {}).items():
+            self.set(f"{path.rstrip('/')}/{key}", value)
+
+    def delete(self, path):
+        self.set(path, None)
+
+    def push(self, path, value):
+        """Stages a child under `path` with a pre-generated push key and returns the key."""
+        key = generate_push_id()
+        self.set(f"{path.rstrip('/')}/{key}", value)
+        return key
+
+    def increment(self, path, amount):
+        """Stages a server-side increment, so credits need no read or transaction."""
+        self.set(path, _increment(amount))
+
+    def transaction(self, path, transaction_update):
+        """Escape hatch: runs a real RTDB transaction now, outside the batch."""
+        return db.reference(path).transaction(transaction_update)
+
+    def after_commit(self, callback):
+        """Runs `callback()` once the staged writes are committed; dropped if the batch is discarded."""
+        self._after_commit.append(callback)
+
+    def commit(self):
+        callbacks, self._after_commit = self._after_commit, []
+        if self._updates:
+            updates, self._updates = self._updates, {}
+            db.reference().update(updates)
+        # بدون كتابات مرحلية لا يوجد ما يُنتظر، فتعمل الاستدعاءات مباشرة
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"!!! After-commit callback failed: {e}", file=sys.stderr)
+
+    def staged(self):
+        """A copy of the multi-path update that commit() would send."""
+        return dict(self._updates)
+
+    def discard(self):
+        self._updates = {}
+        self._after_commit = []
+
+
+def request_batch():
+    """The WriteBatch bound to the current request (created on first use)."""
+    if not has_request_context():
+        return WriteBatch()
+    if 'write_batch' not in g:
+        g.write_batch = WriteBatch()
+    return g.write_batch
+
+
+def discard_request_batch(exception=None):
+    """
+    teardown_request hook. Endpoints commit their batch explicitly once the work
+    succeeded; anything still staged here belongs to a request that bailed out
+    early, so it is dropped rather than half-applied.
+    """
+    batch = g.pop('write_batch', None)
+    if batch is not None and len(batch):
+        print(f"!!! Discarding {len(batch)} uncommitted batched writes.", file=sys.stderr)
+        batch.discard()
+
+# --- END OF FILE project/write_batch.py ---
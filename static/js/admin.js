@@ -267,6 +267,8 @@ function loadInvestmentSettings(data) {
     if (ui.sellTaxPercentInput) ui.sellTaxPercentInput.value = data.sell_tax_percent || '0';
     if (ui.sellFeeSpInput) ui.sellFeeSpInput.value = data.sell_fee_sp || '0';
     if (ui.withdrawalApprovalLimitInput) ui.withdrawalApprovalLimitInput.value = data.withdrawal_approval_limit || '500000';
+    if (ui.lotCompactionEnabledToggle) ui.lotCompactionEnabledToggle.checked = data.lot_compaction_enabled || false;
+    if (ui.lotCompactionMinLotsInput) ui.lotCompactionMinLotsInput.value = data.lot_compaction_min_lots || '10';
 }
 function renderShopAvatars(data) { if (!ui.shopAvatarsList) return; ui.shopAvatarsList.innerHTML = Object.entries(data).map(([id, avatar]) => ` <tr> <td><img src="${avatar.image_url}" alt="${avatar.name}" class="avatar-preview"></td> <td>${avatar.name}</td> <td>${formatNumber(avatar.price_sp_personal || 0)} / ${formatNumber(avatar.price_sp_gift || 0)} SP</td> <td><button class="btn btn-sm btn-outline-info" data-action="edit-avatar" data-avatar-id="${id}" data-avatar-name="${avatar.name}" data-price-personal="${avatar.price_sp_personal || 0}" data-price-gift="${avatar.price_sp_gift || 0}"><i class="bi bi-pencil"></i></button> <button class="btn btn-sm btn-outline-danger ms-1" data-action="delete-avatar" data-avatar-id="${id}"><i class="bi bi-trash"></i></button> </td> </tr> `).join('') || '<tr><td colspan="4" class="text-center text-muted p-3">لا توجد أفاتارات.</td></tr>'; }
 const renderListItemWithEdit = (id, text, deleteAction, editAction, editArgs) => { const editButton = editAction ? `<button class="btn btn-sm btn-outline-info me-1" data-action="${editAction}" data-id="${id}" ${editArgs}><i class="bi bi-pencil"></i></button>` : ''; return `<li class="list-group-item d-flex justify-content-between align-items-center"> ${text} <div> ${editButton} <button class="btn btn-sm btn-outline-danger" data-action="${deleteAction}" data-id="${id}"><i class="bi bi-trash"></i></button> </div> </li>`; };
@@ -351,6 +353,8 @@ function initializeAdminPanel() {
         sellTaxPercentInput: document.getElementById('sell-tax-percent-input'),
         sellFeeSpInput: document.getElementById('sell-fee-sp-input'),
         withdrawalApprovalLimitInput: document.getElementById('withdrawal-approval-limit-input'),
+        lotCompactionEnabledToggle: document.getElementById('lot-compaction-enabled-toggle'),
+        lotCompactionMinLotsInput: document.getElementById('lot-compaction-min-lots-input'),
         addProductForm: document.getElementById('add-product-form'),
         shopProductsList: document.getElementById('shop-products-list'),
         addSpinProductForm: document.getElementById('add-spin-product-form'),
@@ -556,7 +560,9 @@ async function handleInvestmentSettingsSubmit(e) {
         investment_lock_hours: ui.investmentLockHoursInput.value,
         sell_tax_percent: ui.sellTaxPercentInput.value,
         sell_fee_sp: ui.sellFeeSpInput.value,
-        withdrawal_approval_limit: ui.withdrawalApprovalLimitInput.value
+        withdrawal_approval_limit: ui.withdrawalApprovalLimitInput.value,
+        lot_compaction_enabled: ui.lotCompactionEnabledToggle.checked,
+        lot_compaction_min_lots: ui.lotCompactionMinLotsInput.value
     };
     await apiCall('/api/admin/settings/investment', {
         method: 'POST',
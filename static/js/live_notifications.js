@@ -81,28 +81,69 @@ document.addEventListener('firebase-ready', () => {
     };
     // <<< نهاية التعديل >>>
 
+    // الإشعارات مخزنة في دلاء ساعية live_feed/YYYYMMDDHH (بتوقيت UTC كما في الخادم).
+    // نستمع للدلو الحالي مع الدلو السابق والتالي حول تبدل الساعة، ونفصل ما عداها.
+    const feedBucketListeners = {};
+    let feedSyncTimer = null;
+
+    const feedBucketFor = (ms) => {
+        const d = new Date(ms);
+        const pad = (n) => String(n).padStart(2, '0');
+        return `${d.getUTCFullYear()}${pad(d.getUTCMonth() + 1)}${pad(d.getUTCDate())}${pad(d.getUTCHours())}`;
+    };
+
+    const detachFeedListeners = () => {
+        Object.keys(feedBucketListeners).forEach(bucket => {
+            feedBucketListeners[bucket].off('child_added');
+            delete feedBucketListeners[bucket];
+        });
+        if (feedSyncTimer) {
+            clearInterval(feedSyncTimer);
+            feedSyncTimer = null;
+        }
+    };
+
+    const syncFeedListeners = (currentUserID, since) => {
+        const now = Date.now();
+        const wanted = new Set([feedBucketFor(now - 60000), feedBucketFor(now), feedBucketFor(now + 60000)]);
+
+        Object.keys(feedBucketListeners).forEach(bucket => {
+            if (!wanted.has(bucket)) {
+                feedBucketListeners[bucket].off('child_added');
+                delete feedBucketListeners[bucket];
+            }
+        });
+
+        wanted.forEach(bucket => {
+            if (feedBucketListeners[bucket]) return;
+            const bucketQuery = db.ref(`live_feed/${bucket}`).orderByChild('timestamp').startAt(since);
+            feedBucketListeners[bucket] = bucketQuery;
+            bucketQuery.on('child_added', snapshot => {
+                const log = snapshot.val();
+                if (log && log.user_id !== currentUserID) {
+                    showLiveNotification(log);
+                }
+            }, (error) => {
+                console.error(`Firebase Read Error on live_feed/${bucket}:`, error);
+                delete feedBucketListeners[bucket];
+            });
+        });
+    };
+
     auth.onAuthStateChanged((user) => {
         if (user && !listenerAttached) {
             listenerAttached = true;
             const currentUserID = user.uid;
+            const since = Math.floor(Date.now() / 1000);
+
+            syncFeedListeners(currentUserID, since);
+            feedSyncTimer = setInterval(() => syncFeedListeners(currentUserID, since), 30000);
 
-            // تم تصحيح هذا المسار مسبقاً وهو صحيح
-            const feedRef = db.ref('live_feed');
-            feedRef.orderByChild('timestamp').startAt(Math.floor(Date.now() / 1000))
-                .on('child_added', snapshot => {
-                    const log = snapshot.val();
-                    if (log && log.user_id !== currentUserID) {
-                        showLiveNotification(log);
-                    }
-                }, (error) => {
-                    console.error("Firebase Read Error on live_feed:", error);
-                    listenerAttached = false;
-                });
-
-            console.log("Live notification listener is active on /live_feed.");
+            console.log("Live notification listener is active on /live_feed hour buckets.");
 
         } else if (!user) {
             listenerAttached = false;
+            detachFeedListeners();
         }
     });
 });
@@ -62,8 +62,7 @@ function initializeUserView() {
     let allUsersCache = [];
     let honorRollCache = [];
     let userInvestments = {};
-    let allInvestmentsCache = {};
-    let allWallets = {};
+    let richestInvestors = [];
     let userChartInstance = null;
     let db;
     let currentUserId;
@@ -211,16 +210,11 @@ function initializeUserView() {
             renderGamblingCard();
         });
 
-        db.ref('wallets').on('value', (s) => {
-            allWallets = s.val() || {};
+        // قائمة الأغنى يحدثها الخادم تدريجياً، فلا حاجة لتحميل كل المحافظ وكل المستخدمين
+        db.ref('leaderboards/richest/wallet').on('value', (s) => {
+            richestInvestors = Object.values(s.val() || {});
             renderRichestInvestors();
-        }, (e) => handleFirebaseError(e, 'wallets'));
-
-        db.ref('investments').on('value', (s) => {
-            allInvestmentsCache = s.val() || {};
-            userInvestments = (currentUserId && allInvestmentsCache[currentUserId]) ? allInvestmentsCache[currentUserId] : {};
-            renderUserTable();
-        }, (e) => handleFirebaseError(e, 'investments'));
+        }, (e) => handleFirebaseError(e, 'leaderboards/richest'));
 
         db.ref('site_settings/honor_roll').on('value', (s) => { honorRollCache = Object.values(s.val() || {}).map(i => i.name); renderHonorRollList(); renderUserTable(); }, (e) => handleFirebaseError(e, 'site_settings/honor_roll'));
         db.ref('candidates').on('value', (s) => renderCandidatesList(Object.keys(s.val() || {})), (e) => handleFirebaseError(e, 'candidates'));
@@ -229,6 +223,11 @@ function initializeUserView() {
 
         if (currentUserId) {
             db.ref(`wallets/${currentUserId}`).on('value', (s) => renderWallet(s.val()), (e) => handleFirebaseError(e, `wallets/${currentUserId}`));
+            // استثمارات المستخدم الحالي فقط، بدل تحميل شجرة investments الكاملة لكل المستخدمين
+            db.ref(`investments/${currentUserId}`).on('value', (s) => {
+                userInvestments = s.val() || {};
+                renderUserTable();
+            }, (e) => handleFirebaseError(e, `investments/${currentUserId}`));
             db.ref(`user_messages/${currentUserId}`).on('child_added', handleUserMessage, (e) => handleFirebaseError(e, `user_messages/${currentUserId}`));
             db.ref(`user_spin_state/${currentUserId}`).on('value', (s) => { if (window.spinWheelApp?.updateUI) window.spinWheelApp.updateUI(s.val()); }, (e) => handleFirebaseError(e, `user_spin_state/${currentUserId}`));
             db.ref(`registered_users/${currentUserId}/current_avatar`).on('value', (s) => {
@@ -283,7 +282,7 @@ function initializeUserView() {
             return;
         }
 
-        const votes = contest.votes || {}, votes1 = votes[name1] || {}, votes2 = votes[name2] || {}, userVotedFor = (currentUserId && (votes1[currentUserId] ? name1 : (votes2[currentUserId] ? name2 : null)));
+        const votes = contest.votes || {}, votes1 = votes[name1] || {}, votes2 = votes[name2] || {}, voteCounts = contest.vote_counts || {}, userVotedFor = (currentUserId && ((contest.voters || {})[currentUserId] || (votes1[currentUserId] ? name1 : (votes2[currentUserId] ? name2 : null))));
 
         const contestant1Avatar = contestant1.avatar_url ? contestant1.avatar_url : DEFAULT_AVATAR_URI;
         const contestant2Avatar = contestant2.avatar_url ? contestant2.avatar_url : DEFAULT_AVATAR_URI;
@@ -303,7 +302,7 @@ function initializeUserView() {
 
         let html;
         if (userVotedFor) {
-            html = ` <div class="col-6 text-center contestant-info" style="cursor: pointer;" data-contestant-name="${name1}"> <img src="${contestant1Avatar}" class="rounded-circle mb-2 nudge-trigger" data-target-name="${name1}" data-target-type="crawler" width="60" height="60"> <h6 class="mb-1 small">${name1}</h6> <div class="fw-bold mb-2">${Object.keys(votes1).length} صوت</div> <div class="d-flex justify-content-center align-items-center" style="min-height: 26px;">${renderVoters(votes1)}</div> </div> <div class="col-6 text-center contestant-info" style="cursor: pointer;" data-contestant-name="${name2}"> <img src="${contestant2Avatar}" class="rounded-circle mb-2 nudge-trigger" data-target-name="${name2}" data-target-type="crawler" width="60" height="60"> <h6 class="mb-1 small">${name2}</h6> <div class="fw-bold mb-2">${Object.keys(votes2).length} صوت</div> <div class="d-flex justify-content-center align-items-center" style="min-height: 26px;">${renderVoters(votes2)}</div> </div> <div class="col-12 mt-2"><div class="alert alert-success small text-center p-2 mb-0">شكراً لك، لقد قمت بالتصويت لـِ <strong>${userVotedFor}</strong>.</div></div>`;
+            html = ` <div class="col-6 text-center contestant-info" style="cursor: pointer;" data-contestant-name="${name1}"> <img src="${contestant1Avatar}" class="rounded-circle mb-2 nudge-trigger" data-target-name="${name1}" data-target-type="crawler" width="60" height="60"> <h6 class="mb-1 small">${name1}</h6> <div class="fw-bold mb-2">${voteCounts[name1] ?? Object.keys(votes1).length} صوت</div> <div class="d-flex justify-content-center align-items-center" style="min-height: 26px;">${renderVoters(votes1)}</div> </div> <div class="col-6 text-center contestant-info" style="cursor: pointer;" data-contestant-name="${name2}"> <img src="${contestant2Avatar}" class="rounded-circle mb-2 nudge-trigger" data-target-name="${name2}" data-target-type="crawler" width="60" height="60"> <h6 class="mb-1 small">${name2}</h6> <div class="fw-bold mb-2">${voteCounts[name2] ?? Object.keys(votes2).length} صوت</div> <div class="d-flex justify-content-center align-items-center" style="min-height: 26px;">${renderVoters(votes2)}</div> </div> <div class="col-12 mt-2"><div class="alert alert-success small text-center p-2 mb-0">شكراً لك، لقد قمت بالتصويت لـِ <strong>${userVotedFor}</strong>.</div></div>`;
         } else {
             html = ` <div class="col-5 text-center contestant-info" style="cursor: pointer;" data-contestant-name="${name1}"> <img src="${contestant1Avatar}" class="rounded-circle mb-2 nudge-trigger" data-target-name="${name1}" data-target-type="crawler" width="60" height="60"> <h6 class="mb-2 small">${name1}</h6> <button class="btn btn-sm btn-outline-success w-100 vote-btn" data-name="${name1}">صوّت</button> </div> <div class="col-2 d-flex justify-content-center align-items-center fs-4 fw-bold text-danger">VS</div> <div class="col-5 text-center contestant-info" style="cursor: pointer;" data-contestant-name="${name2}"> <img src="${contestant2Avatar}" class="rounded-circle mb-2 nudge-trigger" data-target-name="${name2}" data-target-type="crawler" width="60" height="60"> <h6 class="mb-2 small">${name2}</h6> <button class="btn btn-sm btn-outline-success w-100 vote-btn" data-name="${name2}">صوّت</button> </div>`;
         }
@@ -479,24 +478,10 @@ function initializeUserView() {
     }
 
     function renderRichestInvestors() {
-        if (!ui.richestInvestorsList || Object.keys(allWallets).length === 0 || Object.keys(registeredUsersCache).length === 0) {
-            if (ui.richestInvestorsList) ui.richestInvestorsList.innerHTML = '<p class="text-muted text-center my-3">لا يوجد مستثمرون لعرضهم بعد.</p>';
-            return;
-        }
-
-        const adminUIDs = new Set(Object.keys(registeredUsersCache).filter(id => registeredUsersCache[id].role === 'admin'));
+        if (!ui.richestInvestorsList) return;
 
-        const richList = Object.entries(allWallets)
-            .filter(([uid]) => !adminUIDs.has(uid) && registeredUsersCache[uid])
-            .filter(([uid]) => registeredUsersCache[uid].show_on_leaderboard !== false)
-            .map(([uid, wallet]) => ({
-                uid,
-                name: registeredUsersCache[uid].name,
-                avatar: registeredUsersCache[uid].current_avatar,
-                sp: wallet.sp || 0
-            }))
-            .sort((a, b) => b.sp - a.sp)
-            .slice(0, 3);
+        // الخادم يستبعد الأدمن ومن أخفى نفسه ويرتب القائمة مسبقاً
+        const richList = richestInvestors.slice(0, 3).map(entry => ({ ...entry, sp: entry.value }));
 
         if (richList.length === 0) {
             ui.richestInvestorsList.innerHTML = '<p class="text-muted text-center my-3">لا يوجد مستثمرون لعرضهم بعد.</p>';
@@ -583,38 +568,31 @@ function initializeUserView() {
         ui.sellLotsModalBody.innerHTML = `<div class="text-center p-5"><div class="spinner-border"></div></div>`;
         bootstrap.Modal.getOrCreateInstance(ui.sellLotsModal).show();
 
-        const investment = userInvestments[crawlerName];
-        const lots = investment?.lots || {};
-        const crawler = allUsersCache.find(u => u.name === crawlerName);
+        // القيم والضريبة ومدة القفل تُحسب على الخادم بنفس معادلة البيع
+        let portfolio;
+        try {
+            portfolio = await apiCall('/api/portfolio');
+        } catch (err) {
+            ui.sellLotsModalBody.innerHTML = `<p class="text-danger text-center my-4">${err.message}</p>`;
+            return;
+        }
+        const position = portfolio.positions.find(pos => pos.crawler_name === crawlerName);
+        const now = portfolio.server_time;
 
-        if (!crawler || Object.keys(lots).length === 0) {
+        if (!position || position.lots.length === 0) {
             ui.sellLotsModalBody.innerHTML = '<p class="text-muted text-center my-4">لا توجد دفعات استثمار لهذا الزاحف.</p>';
             return;
         }
 
-        const lockSeconds = (siteSettings.investment_lock_hours || 0) * 3600;
-        const now = Math.floor(Date.now() / 1000);
-        const pointsNow = Math.max(1, parseFloat(crawler.points) || 1);
-        const stockMultiplier = parseFloat(crawler.stock_multiplier) || 1.0;
-        const personalMultiplier = parseFloat(investment.personal_multiplier || 1.0);
-
-        const lotsArray = Object.entries(lots).map(([lotKey, lotData]) => ({ lotKey, ...lotData }));
-        lotsArray.sort((a, b) => (a.t || 0) - (b.t || 0));
-
-        let tableHtml = `<div class="table-responsive"> <table class="table table-sm table-hover align-middle"> <thead><tr><th>المبلغ المستثمر</th><th>تاريخ الشراء</th><th>القيمة الحالية</th><th>الحالة</th><th></th></tr></thead> <tbody>`;
-        lotsArray.forEach(({ lotKey, sp, p, t, original_sp }) => {
+        let tableHtml = `<div class="table-responsive"> <table class="table table-sm table-hover align-middle"> <thead><tr><th>المبلغ المستثمر</th><th>تاريخ الشراء</th><th>القيمة الحالية</th><th>صافي البيع</th><th>الحالة</th><th></th></tr></thead> <tbody>`;
+        position.lots.forEach(({ id: lotKey, sp, t, value, profit, tax, net, locked, unlocks_at }) => {
             const investedSP = sp || 0;
-            const pointsThen = Math.max(1, p || 1);
             const lotTimestamp = t || 0;
-            const isLocked = (now - lotTimestamp) < lockSeconds;
-
-            const currentValue = investedSP * (pointsNow / pointsThen) * stockMultiplier * personalMultiplier;
-            const profit = currentValue - (original_sp !== undefined ? original_sp : investedSP);
             const profitColor = profit > 0.01 ? 'text-success' : profit < -0.01 ? 'text-danger' : 'text-muted';
+            const netTitle = `الضريبة: ${tax.toFixed(2)} SP، الرسوم: ${(value - tax - net).toFixed(2)} SP`;
             let statusHtml, actionHtml;
-            if (isLocked) {
-                const unlockTime = lotTimestamp + lockSeconds;
-                const remaining = unlockTime - now;
+            if (locked) {
+                const remaining = unlocks_at - now;
                 const hours = Math.floor(remaining / 3600);
                 const minutes = Math.floor((remaining % 3600) / 60);
                 statusHtml = `<span class="badge bg-secondary">مقفلة (${hours}س ${minutes}د)</span>`;
@@ -623,7 +601,7 @@ function initializeUserView() {
                 statusHtml = `<span class="badge bg-success">متاحة</span>`;
                 actionHtml = `<button class="btn btn-sm btn-danger sell-lot-btn" data-lot-key="${lotKey}" data-crawler-name="${crawlerName}">بيع</button>`;
             }
-            tableHtml += `<tr id="lot-row-${lotKey}"> <td>${investedSP.toFixed(2)} SP</td> <td>${safeFormatDate(lotTimestamp)}</td> <td class="${profitColor} fw-bold">${currentValue.toFixed(2)} SP</td> <td>${statusHtml}</td> <td class="text-end">${actionHtml}</td> </tr>`;
+            tableHtml += `<tr id="lot-row-${lotKey}"> <td>${investedSP.toFixed(2)} SP</td> <td>${safeFormatDate(lotTimestamp)}</td> <td class="${profitColor} fw-bold">${value.toFixed(2)} SP</td> <td title="${netTitle}">${net.toFixed(2)} SP</td> <td>${statusHtml}</td> <td class="text-end">${actionHtml}</td> </tr>`;
         });
         tableHtml += `</tbody></table></div>`;
         ui.sellLotsModalBody.innerHTML = tableHtml;
@@ -872,7 +850,8 @@ function initializeUserView() {
         const votes = currentContestData.votes || {};
         const votes1 = votes[name1] || {};
         const votes2 = votes[name2] || {};
-        const userVotedFor = currentUserId && (votes1[currentUserId] ? name1 : (votes2[currentUserId] ? name2 : null));
+        const voteCounts = currentContestData.vote_counts || {};
+        const userVotedFor = currentUserId && ((currentContestData.voters || {})[currentUserId] || (votes1[currentUserId] ? name1 : (votes2[currentUserId] ? name2 : null)));
 
         const renderVotersList = (votersDict) => {
             const uids = Object.keys(votersDict);
@@ -891,7 +870,7 @@ function initializeUserView() {
                 <div class="col">
                     <img src="${contestant1.avatar_url || DEFAULT_AVATAR_URI}" class="img-fluid rounded-circle mb-2" style="width: 90px; height: 90px; border: 3px solid var(--secondary-glow);">
                     <h5 class="mb-1">${name1}</h5>
-                    <p class="text-warning fw-bold fs-5 mb-2">${Object.keys(votes1).length} صوت</p>
+                    <p class="text-warning fw-bold fs-5 mb-2">${voteCounts[name1] ?? Object.keys(votes1).length} صوت</p>
                     <ul class="list-group list-group-flush list-group-horizontal justify-content-center flex-wrap" style="max-height: 60px; overflow-y: auto;">
                         ${renderVotersList(votes1)}
                     </ul>
@@ -905,7 +884,7 @@ function initializeUserView() {
                 <div class="col">
                     <img src="${contestant2.avatar_url || DEFAULT_AVATAR_URI}" class="img-fluid rounded-circle mb-2" style="width: 90px; height: 90px; border: 3px solid var(--secondary-glow);">
                     <h5 class="mb-1">${name2}</h5>
-                    <p class="text-warning fw-bold fs-5 mb-2">${Object.keys(votes2).length} صوت</p>
+                    <p class="text-warning fw-bold fs-5 mb-2">${voteCounts[name2] ?? Object.keys(votes2).length} صوت</p>
                     <ul class="list-group list-group-flush list-group-horizontal justify-content-center flex-wrap" style="max-height: 60px; overflow-y: auto;">
                         ${renderVotersList(votes2)}
                     </ul>
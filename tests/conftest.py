@@ -0,0 +1,11 @@
+﻿# --- START OF FILE tests/conftest.py ---
+import os
+import sys
+
+# الاختبارات تعمل دائماً على قاعدة البيانات المحلية، قبل أن يستورد أي اختبار الحزمة project
+os.environ['STORAGE_BACKEND'] = 'local'
+os.environ.pop('STORAGE_SQLITE_PATH', None)
+os.environ.pop('STORAGE_SEED_FILE', None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# --- END OF FILE tests/conftest.py ---
@@ -0,0 +1,78 @@
+﻿# --- START OF FILE tests/test_local_storage.py ---
+import pytest
+from project.storage import LocalBackend
+
+
+class _Abort(Exception):
+    pass
+
+
+@pytest.fixture
+def backend():
+    backend = LocalBackend()
+    backend.initialize()
+    return backend
+
+
+def test_server_increment_on_set_and_multi_path_update(backend):
+    ref = backend.reference('counters')
+    ref.child('missing').set({'.sv': {'increment': 3}})
+    ref.update({'a': 10})
+    backend.reference().update({
+        'counters/a': {'.sv': {'increment': 5}},
+        'counters/b': {'.sv': {'increment': -2.5}},
+        'wallets/u1/sp': {'.sv': {'increment': 7}},
+    })
+    assert ref.get() == {'missing': 3, 'a': 15, 'b': -2.5}
+    assert backend.reference('wallets/u1/sp').get() == 7
+
+
+def test_multi_path_update_deletes_and_prunes_empty_parents(backend):
+    backend.reference('investments/u1/bob/lots').set({'l1': {'sp': 1}, 'l2': {'sp': 2}})
+    backend.reference().update({
+        'investments/u1/bob/lots/l1': None,
+        'investments/u1/bob/lots/l3': {'sp': 3},
+    })
+    assert set(backend.reference('investments/u1/bob/lots').get()) == {'l2', 'l3'}
+    backend.reference().update({'investments/u1/bob/lots/l2': None, 'investments/u1/bob/lots/l3': None})
+    assert backend.reference('investments').get() is None
+
+
+def test_transaction_applies_and_aborts(backend):
+    ref = backend.reference('wallets/u1/sp')
+    assert ref.transaction(lambda current: (current or 0) + 100) == 100
+
+    def debit(current):
+        if current < 500:
+            raise _Abort()
+        return current - 500
+
+    with pytest.raises(_Abort):
+        ref.transaction(debit)
+    assert ref.get() == 100
+
+
+def test_get_if_changed_uses_etags(backend):
+    ref = backend.reference('investments/u1')
+    ref.set({'bob': {'lots': {'l1': {'sp': 1}}}})
+    value, etag = ref.get(etag=True)
+    # مثل firebase_admin: الرد 304 لا يحمل قيمة ولا ETag
+    assert ref.get_if_changed(etag) == (False, None, None)
+    ref.child('bob/lots/l2').set({'sp': 2})
+    changed, new_value, new_etag = ref.get_if_changed(etag)
+    assert changed and new_etag != etag and set(new_value['bob']['lots']) == {'l1', 'l2'}
+
+
+def test_sqlite_persistence_round_trip(tmp_path):
+    path = str(tmp_path / 'local.sqlite3')
+    first = LocalBackend(sqlite_path=path)
+    first.initialize()
+    first.reference().update({'wallets/u1/sp': 5, 'users/bob/points': {'.sv': {'increment': 40}}})
+    first.flush()
+
+    second = LocalBackend(sqlite_path=path)
+    second.initialize()
+    assert second.reference('wallets/u1/sp').get() == 5
+    assert second.reference('users/bob/points').get() == 40
+
+# --- END OF FILE tests/test_local_storage.py ---
@@ -0,0 +1,51 @@
+﻿# --- START OF FILE tests/test_points_consistency.py ---
+import time
+import pytest
+from project import create_app
+from project.storage import db
+from project.crawler_roster import roster
+
+
+@pytest.fixture(scope='module')
+def client():
+    app = create_app()
+    app.testing = True
+    return app.test_client()
+
+
+def _wait_for(predicate, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_points_purchase_is_priced_immediately(client):
+    db.reference(memoize=False).update({
+        'users': {'alice': {'name': 'alice', 'points': 100, 'stock_multiplier': 1.0},
+                  'bob': {'name': 'bob', 'points': 50, 'stock_multiplier': 1.0}},
+        'registered_users/u1': {'name': 'U1', 'role': 'user', 'status': 'approved'},
+        'wallets/u1': {'sp': 1000, 'cc': 0},
+        'investments/u1/bob/lots/l1': {'sp': 100, 'p': 50, 't': 0, 'original_sp': 100},
+        'site_settings/shop_products_points/raise': {'type': 'raise', 'sp_price': 10, 'points_amount': 5, 'daily_limit': 5},
+        'site_settings/investment_settings': {'investment_lock_hours': 0, 'sell_tax_percent': 0, 'sell_fee_sp': 0},
+    })
+    assert _wait_for(lambda: (roster.lookup('bob') or {}).get('points') == 50 and (roster.lookup('alice') or {}).get('points') == 100)
+    with client.session_transaction() as session:
+        session['user_id'], session['name'] = 'u1', 'U1'
+
+    response = client.post('/api/shop/buy_points_product', data={'product_id': 'raise', 'target_crawler': 'bob'})
+    assert response.get_json()['success']
+    # النقاط الجديدة تُقرأ مباشرة من الحقل نفسه، لا تنتظر دمجاً لاحقاً
+    assert db.reference('users/bob/points', memoize=False).get() == 99
+    assert roster.lookup('bob')['points'] == 99
+    assert db.reference('counter_shards/points', memoize=False).get() is None
+
+    # الدفعة المشتراة عند 50 نقطة تُباع بالسعر الجديد: 100 × 99 / 50
+    response = client.post('/api/sell_lot', data={'crawler_name': 'bob', 'lot_id': 'l1'})
+    assert response.get_json()['success']
+    assert db.reference('wallets/u1/sp', memoize=False).get() == pytest.approx(990 + 198)
+
+# --- END OF FILE tests/test_points_consistency.py ---
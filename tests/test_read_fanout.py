@@ -0,0 +1,16 @@
+﻿# --- START OF FILE tests/test_read_fanout.py ---
+from project import read_fanout
+from project.storage import db
+
+
+def test_reads_run_inline_once_the_pool_is_shut_down(monkeypatch):
+    db.reference('fanout_test', memoize=False).set({'a': 1, 'b': 2})
+
+    def closed(*args, **kwargs):
+        raise RuntimeError('cannot schedule new futures after interpreter shutdown')
+
+    # كما في atexit بعد إغلاق مجمع الخيوط
+    monkeypatch.setattr(read_fanout._pool, 'submit', closed)
+    assert read_fanout.read_parallel({'a': 'fanout_test/a', 'b': 'fanout_test/b'}) == {'a': 1, 'b': 2}
+
+# --- END OF FILE tests/test_read_fanout.py ---
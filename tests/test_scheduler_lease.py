@@ -0,0 +1,66 @@
+﻿# --- START OF FILE tests/test_scheduler_lease.py ---
+import pytest
+from project import scheduler_lease
+from project.scheduler_lease import SchedulerCoordinator, LEASE_PATH
+from project.storage import db
+
+
+class _FakeScheduler:
+    def __init__(self):
+        self.running = True
+
+    def pause(self):
+        self.running = False
+
+    def resume(self):
+        self.running = True
+
+
+def _coordinator(mode, lock_path=None):
+    coordinator = SchedulerCoordinator()
+    coordinator.mode = mode
+    coordinator.lock_path = lock_path
+    coordinator._scheduler = _FakeScheduler()
+    return coordinator
+
+
+@pytest.mark.skipif(scheduler_lease.fcntl is None, reason='file lease needs fcntl')
+def test_file_lease_hands_off_on_stop(tmp_path):
+    lock_path = str(tmp_path / 'instance' / 'scheduler.lock')
+    first, second = _coordinator('file', lock_path), _coordinator('file', lock_path)
+
+    first._step()
+    second._step()
+    assert first.is_leader() and not second.is_leader()
+
+    first.stop()
+    assert not first.is_leader() and not first._scheduler.running
+    second._step()
+    assert second.is_leader() and second._scheduler.running
+    second.stop()
+
+
+def test_rtdb_lease_hands_off_on_expiry_and_release(monkeypatch):
+    db.reference(LEASE_PATH, memoize=False).delete()
+    clock = [1000.0]
+    monkeypatch.setattr(scheduler_lease.time, 'time', lambda: clock[0])
+    first, second = _coordinator('rtdb'), _coordinator('rtdb')
+
+    first._step()
+    second._step()
+    assert first.is_leader() and not second.is_leader()
+
+    # القائد توقف عن التجديد: بعد انتهاء المهلة يستلم العامل الآخر ويتوقف الأول عند فحصه التالي
+    clock[0] += first.ttl + 1
+    second._step()
+    first._step()
+    assert second.is_leader() and not first.is_leader()
+    assert db.reference(LEASE_PATH, memoize=False).get()['holder'] == second.holder_id
+
+    second.stop()
+    assert db.reference(LEASE_PATH, memoize=False).get() is None
+    first._step()
+    assert first.is_leader()
+    first.stop()
+
+# --- END OF FILE tests/test_scheduler_lease.py ---
@@ -0,0 +1,18 @@
+﻿# --- START OF FILE tests/test_sell_lot.py ---
+from project.storage import db
+from project.user_interactions_api import _drop_empty_investment
+
+
+def test_empty_position_is_removed_after_its_last_lot():
+    db.reference('investments/u2/bob', memoize=False).set({'personal_multiplier': 1.5})
+    _drop_empty_investment('investments/u2/bob')
+    assert db.reference('investments/u2/bob', memoize=False).get() is None
+
+
+def test_position_with_a_newer_lot_is_kept():
+    # دفعة اشتُريت بعد قراءة البيع يجب ألا تُحذف مع المركز
+    db.reference('investments/u3/bob', memoize=False).set({'personal_multiplier': 1.0, 'lots': {'new': {'sp': 10, 'p': 5, 't': 1}}})
+    _drop_empty_investment('investments/u3/bob')
+    assert db.reference('investments/u3/bob/lots/new/sp', memoize=False).get() == 10
+
+# --- END OF FILE tests/test_sell_lot.py ---
@@ -0,0 +1,29 @@
+﻿# --- START OF FILE tests/test_sharded_counter.py ---
+from project.storage import db
+from project.sharded_counter import ShardedCounter
+
+
+def test_fold_moves_shards_into_the_field_and_prunes_them():
+    db.reference('counter_test/bob', memoize=False).set({'likes': 10})
+    likes = ShardedCounter('test_likes', 'counter_test/{key}/likes')
+    for _ in range(20):
+        likes.add('bob', 1)
+    assert likes.value('bob') == 30
+
+    assert likes.fold() == 1
+    assert db.reference('counter_test/bob/likes', memoize=False).get() == 30
+    assert db.reference(likes.shards_path(), memoize=False).get() is None
+    assert likes.fold() == 0
+
+
+def test_inactive_counter_drains_then_is_skipped():
+    db.reference('counter_test/alice', memoize=False).set({'points': 5})
+    legacy = ShardedCounter('test_legacy', 'counter_test/{key}/points', active=lambda: False)
+    legacy.add('alice', 7)
+
+    assert legacy.fold() == 1 and not legacy.drained
+    assert db.reference('counter_test/alice/points', memoize=False).get() == 12
+    legacy.fold()
+    assert legacy.drained
+
+# --- END OF FILE tests/test_sharded_counter.py ---
@@ -0,0 +1,19 @@
+﻿# --- START OF FILE tests/test_wallet_service.py ---
+from project import wallet_service
+from project.storage import db
+
+
+def test_failing_change_hook_does_not_fail_the_debit():
+    def broken(uid, currency, balance):
+        raise RuntimeError('hook down')
+
+    db.reference('wallets/hooked/sp', memoize=False).set(100)
+    wallet_service.on_change(broken)
+    try:
+        result = wallet_service.debit('hooked', 'sp', 30)
+    finally:
+        wallet_service._change_hooks.remove(broken)
+    assert result and result.balance == 70
+    assert db.reference('wallets/hooked/sp', memoize=False).get() == 70
+
+# --- END OF FILE tests/test_wallet_service.py ---
@@ -0,0 +1,28 @@
+﻿# --- START OF FILE tests/test_write_batch.py ---
+from project.storage import db
+from project.write_batch import WriteBatch
+
+
+def test_after_commit_runs_once_the_update_lands():
+    seen = []
+    batch = WriteBatch()
+    batch.set('batch_test/a', 1)
+    batch.after_commit(lambda: seen.append(db.reference('batch_test/a', memoize=False).get()))
+    assert seen == []
+    batch.commit()
+    assert seen == [1]
+
+
+def test_after_commit_runs_on_an_empty_batch_and_not_after_discard():
+    seen = []
+    batch = WriteBatch()
+    batch.after_commit(lambda: seen.append('empty'))
+    batch.commit()
+    batch.set('batch_test/b', 1)
+    batch.after_commit(lambda: seen.append('discarded'))
+    batch.discard()
+    batch.commit()
+    assert seen == ['empty']
+    assert db.reference('batch_test/b', memoize=False).get() is None
+
+# --- END OF FILE tests/test_write_batch.py ---